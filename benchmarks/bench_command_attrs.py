@@ -0,0 +1,86 @@
+"""Measure the cost of looking up global flags on a Command object.
+
+Commands check 'dry_run', 'verbose' and 'force' on every helper call
+('copy_file()', 'spawn()', 'execute()', ...), and may use any CMDHelper
+attribute as their own.  This compares, per lookup:
+
+  legacy      the lookup failing on the command and falling back on
+              '__getattr__', as commands used to do for every global
+              flag and still do for other CMDHelper attributes
+  resolved    a global flag after 'ensure_finalized()'
+
+Usage:
+
+    python benchmarks/bench_command_attrs.py [lookups]
+"""
+
+import sys, time
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+
+
+class Bench(Command):
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+class Legacy(object):
+    """A command object resolving everything through '__getattr__'."""
+
+    def __init__(self, cmdutil):
+        self.cmdutil = cmdutil
+
+    def __getattr__(self, attr):
+        return getattr(self.cmdutil, attr)
+
+
+def per_lookup(obj, attr, lookups):
+    """Return the best time of one lookup of 'attr' on 'obj', in
+    nanoseconds.
+    """
+    code = compile("for i in loops: obj.%s" % attr, 'bench', 'exec')
+    empty = compile("for i in loops: obj", 'bench', 'exec')
+    loops = xrange(lookups)
+    best = None
+    for run in range(5):
+        start = time.time()
+        exec code in {'obj': obj, 'loops': loops}
+        elapsed = time.time() - start
+        start = time.time()
+        exec empty in {'obj': obj, 'loops': loops}
+        elapsed = elapsed - (time.time() - start)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / lookups * 1e9
+
+
+def main(args):
+    lookups = 1000000
+    if args:
+        lookups = int(args[0])
+
+    cmdutil = CMDHelper('cmdhelper.demo')
+    cmdutil.cmdclass['bench'] = Bench
+    command = cmdutil.get_command_obj('bench')
+    command.ensure_finalized()
+    legacy = Legacy(cmdutil)
+
+    print "%-30s %12s" % ('lookup', 'ns/lookup')
+    for (label, obj, attr) in [
+        ('legacy dry_run', legacy, 'dry_run'),
+        ('resolved dry_run', command, 'dry_run'),
+        ]:
+        print "%-30s %12.1f" % (label, per_lookup(obj, attr, lookups))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
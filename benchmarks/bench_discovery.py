@@ -0,0 +1,57 @@
+"""Compare the cost of finding a command with every discovery backend.
+
+Each measurement runs in a fresh interpreter so that import time is
+included, which is what short-lived utilities actually pay.  Usage:
+
+    python benchmarks/bench_discovery.py [group [command [repeat]]]
+
+'group' defaults to the 'cmdhelper.demo' entry point group and 'command'
+to its 'demoprint' command.
+"""
+
+import sys, time
+from subprocess import call
+
+SCRIPT = """
+import sys
+from cmdhelper import CMDHelper
+app = CMDHelper(%(group)r, {'registry_cache_dir': %(cache_dir)r,
+                            'discovery': %(discovery)r})
+app.get_command_class(%(command)r)
+"""
+
+CASES = [
+    # (label, discovery backend, registry cache directory)
+    ('pkg_resources, no cache', 'pkg_resources', ''),
+    ('metadata, no cache', 'metadata', ''),
+    ('metadata, warm cache', 'metadata', None),
+]
+
+
+def run_case(group, command, discovery, cache_dir, repeat):
+    script = SCRIPT % {'group': group, 'command': command,
+                       'discovery': discovery, 'cache_dir': cache_dir}
+    timings = []
+    # one extra untimed run fills the registry cache
+    for i in range(repeat + 1):
+        start = time.time()
+        status = call([sys.executable, '-c', script])
+        if status:
+            raise SystemExit("benchmark script failed for %s" % discovery)
+        if i:
+            timings.append(time.time() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def main(args):
+    group = len(args) > 0 and args[0] or 'cmdhelper.demo'
+    command = len(args) > 1 and args[1] or 'demoprint'
+    repeat = len(args) > 2 and int(args[2]) or 10
+
+    print "%-26s %10s %10s" % ('get_command_class()', 'best', 'mean')
+    for (label, discovery, cache_dir) in CASES:
+        best, mean = run_case(group, command, discovery, cache_dir, repeat)
+        print "%-26s %8.1fms %8.1fms" % (label, best * 1000, mean * 1000)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
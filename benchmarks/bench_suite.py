@@ -0,0 +1,307 @@
+"""Benchmark cmdhelper startup, option parsing and command dispatch.
+
+Generates synthetic distributions registering 10 to 5000 commands with
+large option tables, plus configuration files setting thousands of
+options, and measures for each size:
+
+  import                cold import of cmdhelper (fresh interpreter)
+  get_command_class     finding and importing one command, fresh
+                        interpreter, with and without the registry cache
+  parse_command_line    parsing a command line using many options
+  parse_config_files    reading the configuration, with and without
+                        the snapshot
+  print_commands        listing all the commands
+  run_commands          creating, finalizing and running 100 commands
+
+Every measurement keeps the best of --repeat runs, in seconds.  Results
+can be saved as JSON and compared against a previous run:
+
+    python benchmarks/bench_suite.py --output baseline.json
+    ... change things ...
+    python benchmarks/bench_suite.py --baseline baseline.json
+
+which exits with status 1 if some measurement got slower than the
+baseline by more than --threshold (default 10%).
+"""
+
+import sys, os, time, shutil, tempfile
+from optparse import OptionParser
+from subprocess import Popen, PIPE
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+COMMAND_MODULE = """
+from cmdhelper.cmd import Command
+
+class SyntheticCommand(Command):
+    description = "synthetic benchmark command"
+    user_options = [('opt-%%d=' %% i, None, "option %%d" %% i)
+                    for i in range(%(options)d)]
+    boolean_options = []
+
+    def initialize_options(self):
+        for i in range(%(options)d):
+            setattr(self, 'opt_%%d' %% i, None)
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+for i in range(%(commands)d):
+    globals()['Command%%d' %% i] = type('Command%%d' %% i,
+                                        (SyntheticCommand,), {})
+"""
+
+# Measurements run in a child interpreter, which prints the best time
+# of 'repeat' runs.  Available names: group, commands, options, repeat,
+# config, cache_dir.
+CHILD_PREAMBLE = """
+import sys, time
+from StringIO import StringIO
+from cmdhelper import CMDHelper
+
+def best_of(func):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def make(args=(), **attrs):
+    attrs['registry_cache_dir'] = cache_dir
+    attrs['use_config_snapshots'] = 1
+    attrs['config_cache_dir'] = cache_dir and cache_dir + '/config'
+    app = CMDHelper(group, attrs)
+    app.script_args = list(args)
+    return app
+"""
+
+CHILD_OPERATIONS = {
+    'parse_command_line': """
+args = ['cmd0']
+for i in range(min(options, 200)):
+    args.append('--opt-%d=%d' % (i, i))
+make(args).get_command_class('cmd0')       # warm the registry cache
+print best_of(lambda: make(args).parse_command_line())
+""",
+    'parse_config_files': """
+def parse():
+    make().parse_config_files([config])
+parse()                                     # write the snapshot
+print best_of(parse)
+""",
+    'parse_config_files_no_snapshot': """
+def parse():
+    app = make()
+    app.use_config_snapshots = 0
+    app.parse_config_files([config])
+print best_of(parse)
+""",
+    'print_commands': """
+def list_commands():
+    app = make()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        app.print_commands()
+    finally:
+        sys.stdout = stdout
+list_commands()
+print best_of(list_commands)
+""",
+    'run_commands': """
+args = ['cmd%d' % i for i in range(min(commands, 100))]
+def run():
+    app = make(args)
+    app.parse_command_line()
+    app.run_commands()
+run()
+print best_of(run)
+""",
+}
+
+# run as the whole child process, timed from the outside
+CHILD_PROCESSES = {
+    'import': "import cmdhelper",
+    'get_command_class': """
+from cmdhelper import CMDHelper
+CMDHelper(group, {'registry_cache_dir': cache_dir}).get_command_class(
+    'cmd%d' % (commands - 1))
+""",
+}
+
+
+def make_distribution(directory, commands, options):
+    """Create, in 'directory', a distribution registering 'commands'
+    commands with 'options' options each in the entry point group it
+    returns.
+    """
+    name = 'synthetic_%d' % commands
+    group = 'cmdhelper.bench_%d' % commands
+    os.makedirs(os.path.join(directory, name))
+    f = open(os.path.join(directory, name, '__init__.py'), 'w')
+    f.write(COMMAND_MODULE % {'commands': commands, 'options': options})
+    f.close()
+
+    egg_info = os.path.join(directory, '%s-1.0.egg-info' % name)
+    os.makedirs(egg_info)
+    f = open(os.path.join(egg_info, 'PKG-INFO'), 'w')
+    f.write("Metadata-Version: 1.1\nName: %s\nVersion: 1.0\n" % name)
+    f.close()
+    f = open(os.path.join(egg_info, 'entry_points.txt'), 'w')
+    f.write("[%s]\n" % group)
+    for i in range(commands):
+        f.write("cmd%d = %s:Command%d\n" % (i, name, i))
+    f.close()
+    return group
+
+
+def make_config(filename, commands, options):
+    """Write a configuration file setting (at most) 20 options of every
+    command.
+    """
+    f = open(filename, 'w')
+    for i in range(commands):
+        f.write("[cmd%d]\n" % i)
+        for j in range(min(options, 20)):
+            f.write("opt-%d = value %d of cmd%d\n" % (j, j, i))
+    f.close()
+
+
+def run_child(script, env, values):
+    process = Popen([sys.executable, '-c', script % values], env=env,
+                    stdout=PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise SystemExit("benchmark script failed:\n%s" % (script % values))
+    return output
+
+
+def measure(commands, options, repeat, workdir):
+    """Return the measurements for one size, as a dictionary."""
+    directory = os.path.join(workdir, str(commands))
+    group = make_distribution(directory, commands, options)
+    config = os.path.join(directory, 'bench.cfg')
+    make_config(config, commands, options)
+    cache_dir = os.path.join(directory, 'cache')
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [directory] + filter(None, [env.get('PYTHONPATH')]))
+    env['CMDHELPER_CACHE_DIR'] = cache_dir
+
+    results = {}
+    header = "group, commands, cache_dir = %(group)r, %(commands)d, " \
+             "%(cache_dir)r\n"
+    for (name, script) in CHILD_PROCESSES.items():
+        script = header + script.replace('%', '%%')
+        for (label, cache) in (('', cache_dir), (' (no cache)', '')):
+            if name == 'import' and label:
+                continue
+            values = {'group': group, 'commands': commands,
+                      'cache_dir': cache}
+            run_child(script, env, values)      # fill the caches
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                run_child(script, env, values)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            results[name + label] = best
+
+    for (name, script) in CHILD_OPERATIONS.items():
+        values = {'group': group, 'commands': commands,
+                  'options': options, 'repeat': repeat,
+                  'config': config, 'cache_dir': cache_dir}
+        header = "group, commands, options, repeat, config, cache_dir = " \
+                 "%(group)r, %(commands)d, %(options)d, %(repeat)d, " \
+                 "%(config)r, %(cache_dir)r\n"
+        output = run_child(header + CHILD_PREAMBLE.replace('%', '%%') +
+                           script.replace('%', '%%'), env, values)
+        results[name] = float(output.split()[-1])
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print 'results' next to 'baseline' and return the list of the
+    measurements which got slower by more than 'threshold'.
+    """
+    regressions = []
+    print "%-50s %10s %10s %8s" % ('measurement', 'baseline', 'now',
+                                   'change')
+    keys = results.keys()
+    keys.sort()
+    for key in keys:
+        old = baseline.get(key)
+        if not old:
+            print "%-50s %10s %9.2fms %8s" % (key, '-', results[key] * 1000,
+                                              'new')
+            continue
+        change = results[key] / old - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(key)
+            flag = ' !'
+        print "%-50s %9.2fms %9.2fms %+7.1f%%%s" % \
+              (key, old * 1000, results[key] * 1000, change * 100, flag)
+    return regressions
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default='10,100,1000,5000',
+                      help="numbers of commands to generate "
+                           "[default: %default]")
+    parser.add_option('--options', type='int', default=200,
+                      help="options per command [default: %default]")
+    parser.add_option('--repeat', type='int', default=5,
+                      help="runs per measurement [default: %default]")
+    parser.add_option('--output', help="save the results to this file")
+    parser.add_option('--baseline', help="compare with the results saved "
+                                         "in this file")
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help="slowdown reported as a regression "
+                           "[default: %default]")
+    (opts, args) = parser.parse_args(args)
+
+    workdir = tempfile.mkdtemp(prefix='cmdhelper-bench-')
+    results = {}
+    try:
+        for size in map(int, opts.sizes.split(',')):
+            sys.stderr.write("measuring %d commands...\n" % size)
+            for (name, value) in measure(size, opts.options, opts.repeat,
+                                         workdir).items():
+                results['%s[%d commands]' % (name, size)] = value
+    finally:
+        shutil.rmtree(workdir)
+
+    if opts.output:
+        f = open(opts.output, 'w')
+        json.dump({'python': sys.version.split()[0], 'results': results},
+                  f, indent=2, sort_keys=True)
+        f.close()
+
+    baseline = {}
+    if opts.baseline:
+        f = open(opts.baseline)
+        baseline = json.load(f)['results']
+        f.close()
+    regressions = compare(results, baseline, opts.threshold)
+    if regressions:
+        print
+        print "%d measurement(s) slower than the baseline by more " \
+              "than %d%%" % (len(regressions), opts.threshold * 100)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
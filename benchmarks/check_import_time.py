@@ -0,0 +1,79 @@
+"""Check that importing cmdhelper stays cheap.
+
+Every run of a command line utility pays for 'import cmdhelper' before
+doing anything, so the distutils helpers (option parsing, file, archive
+and dependency utilities, ...) are only imported when first used.  This
+script fails (exit status 1) if importing cmdhelper and cmdhelper.cmd
+
+  - imports one of the modules in LAZY_MODULES, or
+  - takes longer than the budget, in milliseconds over the start of a
+    bare interpreter (best of 'repeat' runs).
+
+Usage:
+
+    python benchmarks/check_import_time.py [budget [repeat]]
+
+'budget' defaults to 35ms, 'repeat' to 20.
+"""
+
+import sys, time
+from subprocess import call, Popen, PIPE
+
+# modules importing cmdhelper must not import
+LAZY_MODULES = [
+    'distutils.archive_util',
+    'distutils.dep_util',
+    'distutils.dir_util',
+    'distutils.dist',
+    'distutils.fancy_getopt',
+    'distutils.file_util',
+    'distutils.spawn',
+    'distutils.util',
+    'email',
+]
+
+IMPORT = "import cmdhelper, cmdhelper.cmd"
+
+
+def best_time(script, repeat):
+    best = None
+    # one extra untimed run compiles the modules
+    for i in range(repeat + 1):
+        start = time.time()
+        if call([sys.executable, '-c', script]):
+            raise SystemExit("benchmark script failed: %s" % script)
+        elapsed = time.time() - start
+        if i and (best is None or elapsed < best):
+            best = elapsed
+    return best
+
+
+def main(args):
+    budget = 35.0
+    repeat = 20
+    if args:
+        budget = float(args[0])
+    if len(args) > 1:
+        repeat = int(args[1])
+
+    process = Popen([sys.executable, '-c',
+                     IMPORT + "\nimport sys\nprint ' '.join(sys.modules)"],
+                    stdout=PIPE)
+    modules = process.communicate()[0].split()
+    loaded = filter(lambda name: name in modules, LAZY_MODULES)
+
+    elapsed = (best_time(IMPORT, repeat) - best_time("pass", repeat)) * 1000
+    print "import cmdhelper: %.1fms (budget %.1fms)" % (elapsed, budget)
+
+    failed = 0
+    if loaded:
+        print "modules which should be imported lazily: %s" % \
+              ', '.join(loaded)
+        failed = 1
+    if elapsed > budget:
+        print "over budget by %.1fms" % (elapsed - budget)
+        failed = 1
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -9,23 +9,39 @@ stripped down all distribution related stuff. CMDHelper contains only those
 things required for command line utilities.
 """
 
-import sys, os, string, re
+import sys, os, string, re, threading, time
+
+# when the import of cmdhelper started (wall clock and CPU time), see
+# 'CMDHelper.run()'
+_import_started = (time.time(), os.times())
+
 from types import *
-from copy import copy
+from stat import S_ISREG
 
 try:
     import warnings
 except ImportError:
     warnings = None
 
-from distutils.fancy_getopt import FancyGetopt, translate_longopt
-from distutils.util import check_environ, strtobool
+# The distutils helpers (fancy_getopt, util, dist, ...) are imported
+# where they are used: importing cmdhelper must stay cheap.
 from distutils import log
-from distutils.dist import fix_help_options, command_re
-import pkg_resources
 
 from cmdhelper.debug import DEBUG
 from cmdhelper.errors import *
+from cmdhelper.registry import CommandRegistry
+from cmdhelper.config import LazyCommandOptions
+from cmdhelper.timings import Timings, TIMINGS_FORMATS
+from cmdhelper.hooks import HookRegistry, HOOKS_GROUP
+
+
+# Regex to define acceptable command names, as in distutils.dist (which
+# isn't imported for it: it pulls in the email package)
+command_re = re.compile(r'^[a-zA-Z]([a-zA-Z0-9_]*)$')
+
+# Entries marking the root of a project: the search for its karm.cfg
+# stops there (see 'CMDHelper.find_project_config_file()')
+PROJECT_ROOT_MARKERS = ('.git', '.hg', '.svn', '.bzr')
 
 
 class CMDHelper(object):
@@ -58,7 +74,26 @@ class CMDHelper(object):
     # utility commands, not sure yet whether this kind of options is really
     # useful
     cmdhelper_only_options = [
-        ('config-file=', 'c', "path to configuration file (not working yet)")
+        ('config-file=', 'c', "path to configuration file (not working yet)"),
+        ('jobs=', 'j', "run up to N independent commands in parallel"),
+        ('timings=', None,
+         "report time and memory used by each phase and command "
+         "(FORMAT: table or json)"),
+        ('profile=', None, "write cProfile statistics of the commands "
+                           "to FILE"),
+        ('trace-file=', None, "append the events of the commands run to "
+                              "FILE, as JSON lines"),
+        ('plan-file=', None, "append the plans of the journaled file "
+                             "operations of the commands to FILE, as JSON "
+                             "lines"),
+        ('batch=', None, "run the command lines read from FILE ('-' for "
+                         "stdin), reporting their results as JSON lines"),
+        ('batch-workers=', None, "run the --batch command lines in N "
+                                 "worker processes"),
+        ('resume', None, "skip the commands a previous run with --resume "
+                         "completed with the same options"),
+        ('state-file=', None, "file --resume records the completed "
+                              "commands in"),
     ]
     
     # list of required options
@@ -69,7 +104,7 @@ class CMDHelper(object):
         ('help-commands', None, "list all available commands"),
     ]
 
-    display_option_names = map(lambda x: translate_longopt(x[0]),
+    display_option_names = map(lambda x: string.replace(x[0], '-', '_'),
                                display_options)
 
     # negative options are options that exclude other options
@@ -91,6 +126,41 @@ class CMDHelper(object):
 
         # Path to configuration file
         self.config_file = ''
+
+        # Maximum number of commands run in parallel, see 'get_jobs()'
+        self.jobs = None
+
+        # Format of the report of the --timings option, file written by
+        # the --profile option
+        self.timings = None
+        self.profile = None
+
+        # 'timer' measures the phases of the run, see cmdhelper.timings
+        self.timer = Timings()
+
+        # 'hooks' is the HookRegistry observing the commands run, see
+        # 'get_hooks()'.  Hooks are discovered from the entry point group
+        # 'hooks_entry_point' (None disables discovery), 'trace_file' is
+        # the file the --trace-file option exports events to.
+        self.hooks = None
+        self.hooks_entry_point = HOOKS_GROUP
+        self.trace_file = None
+
+        # File the plans of journaled file operations are appended to,
+        # see 'Command.commit_journal()'
+        self.plan_file = None
+
+        # File the --batch option reads command lines from, number of
+        # processes running them, see 'run_batch()'
+        self.batch = None
+        self.batch_workers = None
+
+        # Whether commands completed by a previous run are skipped, file
+        # recording them (None means the default location), see
+        # 'get_run_state()'
+        self.resume = 0
+        self.state_file = None
+        self.run_state = None
         
         # Default values for our command-line options
         self.verbose = 1
@@ -105,6 +175,16 @@ class CMDHelper(object):
         # for the command line utilities to override command classes
         self.cmdclass = {}
 
+        # 'registry' caches the commands found in the 'entry_point' group,
+        # see 'get_registry()'.  'registry_cache_dir' is the directory it
+        # is stored in between runs: None means the default location
+        # (~/.cache/cmdhelper or $CMDHELPER_CACHE_DIR), an empty string
+        # keeps the registry in memory only.  'discovery' names the
+        # backend used to find entry points (see cmdhelper.discovery).
+        self.registry = None
+        self.registry_cache_dir = None
+        self.discovery = None
+
         self.script_name = os.path.basename(sys.argv[0])
         self.script_args = sys.argv[1:]
 
@@ -113,7 +193,9 @@ class CMDHelper(object):
         # they are actually needed -- ie. when the command in question is
         # instantiated.  It is a dictionary of dictionaries of 2-tuples:
         #   command_options = { command_name : { option : (source, value) } }
-        self.command_options = {}
+        # whose option dictionaries are merged from the configuration
+        # layers on first use (see cmdhelper.config.LazyCommandOptions).
+        self.command_options = LazyCommandOptions()
 
         # And now initialize bookkeeping stuff that can't be supplied by
         # the caller at all.  'command_obj' maps command names to
@@ -133,6 +215,46 @@ class CMDHelper(object):
         # '.get()' rather than a straight lookup.
         self.have_run = {}
 
+        # 'run_lock' guards the creation of command objects and
+        # 'command_locks' (command names mapped to locks), which make sure
+        # a command is run only once when commands run in parallel.
+        self.run_lock = threading.RLock()
+        self.command_locks = {}
+
+        # Commands being run by each thread, outermost first: a command
+        # found there again depends on itself, see 'run_command()'
+        self.running = threading.local()
+
+        # Thread pool running commands and sub-commands in parallel, see
+        # 'get_worker_pool()'
+        self.worker_pool = None
+
+        # Event loop running the coroutines of asynchronous commands, see
+        # 'get_event_loop()'
+        self.event_loop = None
+
+        # 'stat_cache' caches filesystem metadata for the duration of the
+        # run, see 'get_stat_cache()'.  If 'use_build_cache' is true,
+        # 'make_file()' compares the contents of files instead of their
+        # timestamps, recording the files it generates in
+        # 'build_cache_dir': None means the "build" directory of the
+        # registry cache location, an empty string disables the build
+        # cache (as does a false 'use_build_cache').
+        self.stat_cache = None
+        self.use_build_cache = 0
+        self.build_cache_dir = None
+
+        # If 'use_config_snapshots' is true, parsed configuration files
+        # are stored in snapshots in 'config_cache_dir', see
+        # 'get_config_cache_dir()'; None and an empty string mean the
+        # same as for 'build_cache_dir'.
+        self.use_config_snapshots = 0
+        self.config_cache_dir = None
+
+        # Whether the karm.cfg of the project being worked on is read,
+        # see 'find_project_config_file()'
+        self.use_project_config = 0
+
         # Now we'll use the attrs dictionary (ultimately, keyword args from
         # the setup script) to possibly override any or all of these
         # CMDHelper options.
@@ -207,54 +329,101 @@ class CMDHelper(object):
         should be parsed.  The filenames returned are guaranteed to exist
         (modulo nasty race conditions).
 
-        Look for configuration file in the user's home directory named
-        .karm.cfg on Unix and karm.cfg on Windows/Mac.
+        There are up to four layers of configuration files, each
+        overriding the options set by the previous ones:
+          - the system configuration file /etc/karm.cfg (karm.cfg in
+            the installation prefix on Windows/Mac)
+          - the 'config_file' given to the utility
+          - the per-user configuration file in the home directory, named
+            .karm.cfg on Unix and karm.cfg on Windows/Mac
+          - if the utility sets 'use_project_config', the project
+            configuration file karm.cfg (see 'find_project_config_file()')
         """
-        files = []
-        if self.config_file:
-            files.append(self.config_file)
+        from distutils.util import check_environ
         check_environ()
 
-        # What to call the per-user config file
         if os.name == 'posix':
+            system_file = os.path.join('/etc', 'karm.cfg')
             user_filename = ".karm.cfg"
         else:
+            system_file = os.path.join(sys.prefix, 'karm.cfg')
             user_filename = "karm.cfg"
 
-        # And look for the user config file
+        # every candidate is stat-ed once, missing ones included
+        stats = self.get_stat_cache()
+
+        def exists(filename):
+            st = stats.stat(filename)
+            return st is not None and S_ISREG(st.st_mode)
+
+        files = []
+        if exists(system_file):
+            files.append(system_file)
+        if self.config_file:
+            files.append(self.config_file)
         if os.environ.has_key('HOME'):
             user_file = os.path.join(os.environ.get('HOME'), user_filename)
-            if os.path.isfile(user_file):
+            if exists(user_file):
                 files.append(user_file)
-
+        project_file = self.find_project_config_file()
+        if project_file is not None:
+            files.append(project_file)
         return files
 
-    def parse_config_files(self, filenames=None):
+    def find_project_config_file(self):
+        """Return the name of the project configuration file, or None if
+        the utility doesn't set 'use_project_config' or there is none.
+        It is the karm.cfg of the current directory or of the nearest
+        directory above it, looking no higher than the root of the
+        project: the first directory holding a version control directory
+        (one of PROJECT_ROOT_MARKERS).
+        """
+        if not self.use_project_config:
+            return None
+        stats = self.get_stat_cache()
+        dirname = os.getcwd()
+        while 1:
+            filename = os.path.join(dirname, 'karm.cfg')
+            st = stats.stat(filename)
+            if st is not None and S_ISREG(st.st_mode):
+                return filename
+            for marker in PROJECT_ROOT_MARKERS:
+                if stats.exists(os.path.join(dirname, marker)):
+                    return None
+            parent = os.path.dirname(dirname)
+            if parent == dirname:
+                return None
+            dirname = parent
+
+    def get_project_dir(self):
+        """Return the directory of the project configuration file (see
+        'find_project_config_file()'), or the current directory if there
+        is none.
+        """
+        filename = self.find_project_config_file()
+        if filename is None:
+            return os.getcwd()
+        return os.path.dirname(filename)
 
-        from ConfigParser import ConfigParser
+    def parse_config_files(self, filenames=None):
+        """Read the configuration files 'filenames' (defaults to the
+        files found by 'find_config_files()'), then the CMDHELPER_*
+        environment variables (see cmdhelper.config.environ_options()),
+        into 'command_options'.
+        """
+        from distutils.util import strtobool
+        from cmdhelper.config import read_config_files, environ_options
 
         if filenames is None:
             filenames = self.find_config_files()
 
         if DEBUG: print "CMDHelper.parse_config_files():"
 
-        parser = ConfigParser()
-        for filename in filenames:
-            if DEBUG: print "  reading", filename
-            parser.read(filename)
-            for section in parser.sections():
-                options = parser.options(section)
-                opt_dict = self.get_option_dict(section)
-
-                for opt in options:
-                    if opt != '__name__':
-                        val = parser.get(section, opt)
-                        opt = string.replace(opt, '-', '_')
-                        opt_dict[opt] = (filename, val)
-
-            # Make the ConfigParser forget everything (so we retain
-            # the original filenames that options come from)
-            parser.__init__()
+        self.command_options.add_layer(
+            read_config_files(filenames, self.get_config_cache_dir(),
+                              self.get_stat_cache()))
+        self.command_options.add_layer(
+            environ_options(None, self.get_command_names))
 
         # If there was a "global" section in the config file, use it
         # to set CMDHelper options.
@@ -289,6 +458,7 @@ class CMDHelper(object):
         execute commands (currently, this only happens if user asks for
         help).
         """
+        from distutils.fancy_getopt import FancyGetopt
         toplevel_options = self._get_toplevel_options()
 
         # We have to parse the command line a bit at a time -- global
@@ -309,6 +479,13 @@ class CMDHelper(object):
         if self.handle_display_options(option_order):
             return
 
+        # in batch mode the commands come from the batch file
+        if self.batch:
+            if args:
+                raise CMDHelperArgError, \
+                      "commands can't be given together with --batch"
+            return 1
+
         while args:
             args = self._parse_command_opts(parser, args)
             if args is None:            # user asked for help (and got it)
@@ -346,8 +523,7 @@ class CMDHelper(object):
         list if there are no more commands on the command line.  Returns
         None if the user asked for help on this command.
         """
-        # late import because of mutual dependence between these modules
-        from cmdhelper.cmd import Command
+        from cmdhelper.options import get_command_options
 
         # Pull the current command from the head of the command line
         command = args[0]
@@ -363,64 +539,29 @@ class CMDHelper(object):
         except CMDHelperModuleError, msg:
             raise CMDHelperArgError, msg
 
-        # Require that the command class be derived from Command -- want
-        # to be sure that the basic "command" interface is implemented.
-        if not issubclass(cmd_class, Command):
-            raise CMDHelpersClassError, \
-                  "command class %s must subclass Command" % cmd_class
-
-        # Also make sure that the command object provides a list of its
-        # known options.
-        if not (hasattr(cmd_class, 'user_options') and
-                type(cmd_class.user_options) is ListType):
-            raise CMDHelperClassError, \
-                  ("command class %s must provide " +
-                   "'user_options' attribute (a list of tuples)") % \
-                  cmd_class
-
-        # If the command class has a list of negative alias options,
-        # merge it in with the global negative aliases.
-        negative_opt = self.negative_opt
-        if hasattr(cmd_class, 'negative_opt'):
-            negative_opt = copy(negative_opt)
-            negative_opt.update(cmd_class.negative_opt)
-
-        # Check for help_options in command class.  They have a different
-        # format (tuple of four) so we need to preprocess them here.
-        if (hasattr(cmd_class, 'help_options') and
-            type(cmd_class.help_options) is ListType):
-            help_options = fix_help_options(cmd_class.help_options)
-        else:
-            help_options = []
-
-
-        # All commands support the global options too, just by adding
-        # in 'global_options'.
-        parser.set_option_table(self.global_options +
-                                cmd_class.user_options +
-                                help_options)
-        parser.set_negative_aliases(negative_opt)
-        (args, opts) = parser.getopt(args[1:])
+        # The option table, negative aliases and help options of the
+        # command class are compiled (and validated) once per process.
+        compiled = get_command_options(cmd_class, self.global_options,
+                                       self.negative_opt)
+        (args, opts) = compiled.parser.getopt(args[1:])
         if hasattr(opts, 'help') and opts.help:
             self._show_help(parser, display_options=0, commands=[cmd_class])
             return
 
-        if (hasattr(cmd_class, 'help_options') and
-            type(cmd_class.help_options) is ListType):
-            help_option_found = 0
-            for (help_option, short, desc, func) in cmd_class.help_options:
-                if hasattr(opts, parser.get_attr_name(help_option)):
-                    help_option_found=1
-                    if callable(func):
-                        func()
-                    else:
-                        raise CMDHelperClassError(
-                            "invalid help function %r for help option '%s': "
-                            "must be a callable object (function, etc.)"
-                            % (func, help_option))
+        help_option_found = 0
+        for (attr, help_option, func) in compiled.help_options:
+            if hasattr(opts, attr):
+                help_option_found=1
+                if callable(func):
+                    func()
+                else:
+                    raise CMDHelperClassError(
+                        "invalid help function %r for help option '%s': "
+                        "must be a callable object (function, etc.)"
+                        % (func, help_option))
 
-            if help_option_found:
-                return
+        if help_option_found:
+            return
 
         # Put the options from the command-line into their official
         # holding pen, the 'command_options' dictionary.
@@ -449,6 +590,7 @@ class CMDHelper(object):
         """
         from distutils.core import gen_usage
         from cmdhelper.cmd import Command
+        from cmdhelper.options import fix_help_options
 
         if global_options:
             if display_options:
@@ -509,14 +651,22 @@ class CMDHelper(object):
 
         print header + ":"
 
+        registry = self.get_registry()
         for cmd in commands:
+            # Prefer the description from the command manifest, so that
+            # listing commands doesn't import them all
             klass = self.cmdclass.get(cmd)
-            if not klass:
-                klass = self.get_command_class(cmd)
-            try:
-                description = klass.description
-            except AttributeError:
-                description = "(no description available)"
+            record = registry.get(cmd)
+            if not klass and record and 'description' in record:
+                description = record['description']
+            else:
+                if not klass:
+                    # don't require extras, we're not running
+                    klass = registry.load(cmd, require=0)
+                try:
+                    description = klass.description
+                except AttributeError:
+                    description = "(no description available)"
 
             print "  %-*s  %s" % (max_length, cmd, description)
 
@@ -525,17 +675,13 @@ class CMDHelper(object):
         description of each.  The list is divided into "standard commands"
         (listed in cmdhelper.command.__all__) and "extra commands"
         (mentioned in self.cmdclass, but not a standard command).  The
-        descriptions come from the command class attribute
-        'description'.
+        descriptions come from the command manifests or, for commands
+        without one, from the command class attribute 'description'.
         """
-        for ep in pkg_resources.iter_entry_points(self.entry_point):
-            if ep.name not in self.cmdclass:
-                cmdclass = ep.load(False) # don't require extras, we're not running
-                self.cmdclass[ep.name] = cmdclass
-
-        commands = []
+        commands = self.get_registry().names()
         for cmd in self.cmdclass.keys():
-            commands.append(cmd)
+            if cmd not in commands:
+                commands.append(cmd)
 
         max_length = 0
         for cmd in commands:
@@ -544,19 +690,109 @@ class CMDHelper(object):
 
         self.print_command_list(commands, "Commands", max_length)
 
+    def get_command_names(self):
+        """Return the names of all the commands known: those of
+        'cmdclass' and those of the entry point group.
+        """
+        names = self.cmdclass.keys()
+        for name in self.get_registry().names():
+            if name not in self.cmdclass:
+                names.append(name)
+        return names
+
+    def get_registry(self):
+        """Return the CommandRegistry of our entry point group, creating
+        it on first use.
+        """
+        if self.registry is None:
+            self.registry = CommandRegistry(self.entry_point,
+                                            self.registry_cache_dir,
+                                            self.discovery,
+                                            self.hooks_entry_point)
+        return self.registry
+
+    def get_hooks(self):
+        """Return the HookRegistry observing the commands run, creating
+        it on first use with the hooks of the 'hooks_entry_point' group
+        and, if --trace-file was given, a JSON lines exporter.
+        """
+        if self.hooks is not None:
+            return self.hooks
+        self.run_lock.acquire()
+        try:
+            if self.hooks is None:
+                hooks = HookRegistry()
+                if self.hooks_entry_point:
+                    hooks.load_entry_points(self.get_registry(), self)
+                if self.trace_file:
+                    from cmdhelper.hooks import JSONLinesExporter
+                    hooks.register(JSONLinesExporter(self.trace_file))
+                self.hooks = hooks
+            return self.hooks
+        finally:
+            self.run_lock.release()
+
+    def get_stat_cache(self):
+        """Return the StatCache shared by the commands of this run."""
+        if self.stat_cache is None:
+            from cmdhelper.fscache import StatCache
+            self.stat_cache = StatCache()
+        return self.stat_cache
+
+    def get_run_state(self):
+        """Return the RunState recording the commands completed with
+        --resume, see cmdhelper.resume.
+        """
+        if self.run_state is not None:
+            return self.run_state
+        self.run_lock.acquire()
+        try:
+            if self.run_state is None:
+                from cmdhelper.resume import RunState, get_state_file
+                filename = self.state_file
+                if not filename:
+                    from cmdhelper.registry import get_cache_dir
+                    filename = get_state_file(get_cache_dir(),
+                                              self.entry_point)
+                self.run_state = RunState(filename)
+            return self.run_state
+        finally:
+            self.run_lock.release()
+
+    def get_build_cache_dir(self):
+        """Return the directory holding the build caches of commands, or
+        None if the build cache is disabled.
+        """
+        if not self.use_build_cache:
+            return None
+        if self.build_cache_dir is None:
+            from cmdhelper.registry import get_cache_dir
+            return os.path.join(get_cache_dir(), 'build')
+        return self.build_cache_dir or None
+
+    def get_config_cache_dir(self):
+        """Return the directory holding the snapshots of parsed
+        configuration files, or None if snapshots are disabled.
+        """
+        if not self.use_config_snapshots:
+            return None
+        if self.config_cache_dir is None:
+            from cmdhelper.registry import get_cache_dir
+            return os.path.join(get_cache_dir(), 'config')
+        return self.config_cache_dir or None
+
     def get_command_class(self, command):
         """Pluggable version of get_command_class()"""
         if command in self.cmdclass:
             return self.cmdclass[command]
 
-        from setuptools.dist import Distribution
-        dist = Distribution()
-        for ep in pkg_resources.iter_entry_points(self.entry_point, command):
-            ep.require(installer=dist.fetch_build_egg)
-            self.cmdclass[command] = cmdclass = ep.load()
-            return cmdclass
-        
-        raise CMDHelperModuleError("invalid command '%s'" % command)
+        timing = self.timer.start('import', command)
+        try:
+            cmdclass = self.get_registry().load(command)
+        finally:
+            self.timer.stop(timing)
+        self.cmdclass[command] = cmdclass
+        return cmdclass
 
     def get_command_obj(self, command, create=1):
         """Return the command object for 'command'.  Normally this object
@@ -566,22 +802,36 @@ class CMDHelper(object):
         """
         cmd_obj = self.command_obj.get(command)
         if not cmd_obj and create:
-            if DEBUG:
-                print "cmdhelper.get_command_obj(): " \
-                      "creating '%s' command object" % command
-
-            klass = self.get_command_class(command)
-            cmd_obj = self.command_obj[command] = klass(self)
-            self.have_run[command] = 0
-
-            # Set any options that were supplied in config files
-            # or on the command line.  (NB. support for error
-            # reporting is lame here: any errors aren't reported
-            # until 'finalize_options()' is called, which means
-            # we won't report the source of the error.)
-            options = self.command_options.get(command)
-            if options:
-                self._set_command_options(cmd_obj, options)
+            self.run_lock.acquire()
+            try:
+                cmd_obj = self.command_obj.get(command)
+                if not cmd_obj:
+                    cmd_obj = self._create_command_obj(command)
+            finally:
+                self.run_lock.release()
+
+        return cmd_obj
+
+    def _create_command_obj(self, command):
+        """Create the command object for 'command' and set the options
+        supplied for it.  Must be called with 'run_lock' held.
+        """
+        if DEBUG:
+            print "cmdhelper.get_command_obj(): " \
+                  "creating '%s' command object" % command
+
+        klass = self.get_command_class(command)
+        cmd_obj = self.command_obj[command] = klass(self)
+        self.have_run[command] = 0
+
+        # Set any options that were supplied in config files
+        # or on the command line.  (NB. support for error
+        # reporting is lame here: any errors aren't reported
+        # until 'finalize_options()' is called, which means
+        # we won't report the source of the error.)
+        options = self.command_options.get(command)
+        if options:
+            self._set_command_options(cmd_obj, options)
 
         return cmd_obj
 
@@ -594,36 +844,19 @@ class CMDHelper(object):
         supplied, uses the standard option dictionary for this command
         (from 'self.command_options').
         """
+        from cmdhelper.options import get_option_descriptor
+
         command_name = command_obj.get_command_name()
         if option_dict is None:
             option_dict = self.get_option_dict(command_name)
 
-        if DEBUG: print "  setting options for '%s' command:" % command_name
-        for (option, (source, value)) in option_dict.items():
-            if DEBUG: print "    %s = %s (from %s)" % (option, value, source)
-            try:
-                bool_opts = map(translate_longopt, command_obj.boolean_options)
-            except AttributeError:
-                bool_opts = []
-            try:
-                neg_opt = command_obj.negative_opt
-            except AttributeError:
-                neg_opt = {}
+        if DEBUG:
+            print "  setting options for '%s' command:" % command_name
+            for (option, (source, value)) in option_dict.items():
+                print "    %s = %s (from %s)" % (option, value, source)
 
-            try:
-                is_string = type(value) is StringType
-                if neg_opt.has_key(option) and is_string:
-                    setattr(command_obj, neg_opt[option], not strtobool(value))
-                elif option in bool_opts and is_string:
-                    setattr(command_obj, option, strtobool(value))
-                elif hasattr(command_obj, option):
-                    setattr(command_obj, option, value)
-                else:
-                    raise CMDHelperOptionError, \
-                          ("error in %s: command '%s' has no such option '%s'"
-                           % (source, command_name, option))
-            except ValueError, msg:
-                raise CMDHelperOptionError, msg
+        get_option_descriptor(command_obj).apply(command_obj, option_dict,
+                                                 command_name)
 
     def reinitialize_command(self, command, reinit_subcommands=0):
         """Reinitializes a command to the state it was in when first
@@ -659,8 +892,17 @@ class CMDHelper(object):
         self._set_command_options(command)
 
         if reinit_subcommands:
-            for sub in command.get_sub_commands():
-                self.reinitialize_command(sub, reinit_subcommands)
+            sub_commands = command.get_sub_commands()
+            if command.use_parallel_sub_commands():
+                from cmdhelper.parallel import run_all
+                results = run_all(self.get_worker_pool(),
+                                  lambda sub: self.reinitialize_command(
+                                      sub, reinit_subcommands),
+                                  sub_commands)
+                command.raise_sub_command_errors(sub_commands, results)
+            else:
+                for sub in sub_commands:
+                    self.reinitialize_command(sub, reinit_subcommands)
 
         return command
 
@@ -675,9 +917,16 @@ class CMDHelper(object):
     def run(self):
         """Join all the goodness incorporated in this class"""
         
+        timer = self.timer
+        timer.add('import', 'cmdhelper', _import_wall, _import_cpu)
+
         # Find and parse the config file(s): they will override options from
         # the init, but be overridden by the command line.
-        self.parse_config_files()
+        timing = timer.start('phase', 'config files')
+        try:
+            self.parse_config_files()
+        finally:
+            timer.stop(timing)
 
         if DEBUG:
             print "options (after parsing config files):"
@@ -685,28 +934,186 @@ class CMDHelper(object):
 
         # Parse the command line; any command-line errors are the end user's
         # fault, so turn them into SystemExit to suppress tracebacks.
-        ok = self.parse_command_line()
+        timing = timer.start('phase', 'command line')
+        try:
+            ok = self.parse_command_line()
+        finally:
+            timer.stop(timing)
 
         if DEBUG:
             print "options (after parsing command line):"
             self.dump_option_dicts()
 
-        # And finally, run all the commands found on the command line.
+        # And finally, run all the commands found on the command line, or
+        # those of the batch.
         if ok:
-            # check for required options, if there are missing
-            # required options error will be raised
-            self.checkRequiredOptions()
-            self.run_commands()
+            if self.batch:
+                if self.batch == '-':
+                    failed = self.run_batch(sys.stdin)
+                else:
+                    f = open(self.batch)
+                    try:
+                        failed = self.run_batch(f)
+                    finally:
+                        f.close()
+                if failed:
+                    raise SystemExit, 1
+            else:
+                self.execute()
 
         return self
 
+    def execute(self):
+        """Run the commands of the parsed command line: check the
+        required and global options, then run the commands, profiled and
+        timed if asked to.
+        """
+        # check for required options, if there are missing
+        # required options error will be raised
+        self.checkRequiredOptions()
+        if self.timings is not None and \
+           self.timings not in TIMINGS_FORMATS:
+            raise CMDHelperOptionError, \
+                  "--timings must be one of %s (got '%s')" % \
+                  (string.join(TIMINGS_FORMATS, ', '), self.timings)
+        profiler = None
+        if self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            self.run_commands()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile)
+                log.info("profile written to %s", self.profile)
+            if self.timings:
+                self.timer.report(self.timings)
+
+    def run_batch(self, lines, output=None):
+        """Run the command lines of 'lines' (an iterable of strings, eg.
+        a file) one after the other, reusing the configuration and the
+        command classes (see cmdhelper.batch).  Their results are written
+        to 'output' (defaults to sys.stdout) as JSON lines.  Return the
+        number of command lines which failed.
+        """
+        from cmdhelper.batch import BatchRunner
+
+        if output is None:
+            output = sys.stdout
+        workers = 1
+        if self.batch_workers is not None:
+            try:
+                workers = int(self.batch_workers)
+            except ValueError:
+                workers = 0
+            if workers < 1:
+                raise CMDHelperOptionError, \
+                      "--batch-workers must be a positive integer " \
+                      "(got '%s')" % self.batch_workers
+        return BatchRunner(self).run(lines, output, workers)
+
+    def get_jobs(self):
+        """Return the maximum number of commands to run in parallel, as
+        given by the --jobs option (1 if not given).
+        """
+        if self.jobs is None:
+            return 1
+        try:
+            jobs = int(self.jobs)
+        except ValueError:
+            jobs = 0
+        if jobs < 1:
+            raise CMDHelperOptionError, \
+                  "--jobs must be a positive integer (got '%s')" % self.jobs
+        return jobs
+
     def run_commands(self):
         """Run each command that was seen on the utility command line.
         Uses the list of commands found and cache of command objects
-        created by 'get_command_obj()'.
+        created by 'get_command_obj()'.  If --jobs allows it, independent
+        commands are run in parallel (see cmdhelper.parallel).
         """
-        for cmd in self.commands:
-            self.run_command(cmd)
+        try:
+            if self.get_jobs() > 1 and len(self.commands) > 1:
+                from cmdhelper.parallel import CommandScheduler
+                CommandScheduler(self, self.get_worker_pool()).run(
+                    self.commands)
+            else:
+                for cmd in self.commands:
+                    self.run_command(cmd)
+            # nothing left to resume
+            if self.resume and not self.dry_run:
+                state = self.get_run_state()
+                try:
+                    state.clear()
+                except OSError, msg:
+                    log.warn("can't remove %s: %s", state.filename, msg)
+        finally:
+            self.close_worker_pool()
+            self.close_event_loop()
+            if self.hooks is not None:
+                self.hooks.close()
+
+    def get_worker_pool(self):
+        """Return the pool of --jobs threads shared by all the commands
+        run in parallel, creating it on first use.
+        """
+        self.run_lock.acquire()
+        try:
+            if self.worker_pool is None:
+                from cmdhelper.parallel import WorkerPool
+                self.worker_pool = WorkerPool(self.get_jobs(), self.running)
+            return self.worker_pool
+        finally:
+            self.run_lock.release()
+
+    def get_event_loop(self):
+        """Return the event loop running asynchronous commands (and the
+        coroutines they start), creating it on first use.  There is one
+        loop, run by a thread of its own (see cmdhelper.aiocmd): the
+        other threads hand coroutines over to it with 'run_coroutine()'.
+        """
+        self.run_lock.acquire()
+        try:
+            if self.event_loop is None:
+                from cmdhelper.aiocmd import EventLoopThread
+                self.event_loop = EventLoopThread()
+            return self.event_loop.loop
+        finally:
+            self.run_lock.release()
+
+    def run_coroutine(self, coro):
+        """Run the coroutine 'coro' on the event loop, wait for it and
+        return its result.
+        """
+        self.get_event_loop()
+        commands = getattr(self.running, 'commands', None) or ()
+        if self.worker_pool is not None:
+            # the coroutine may wait for jobs of the pool (see
+            # 'AsyncCommand.run_command_async()'): if this thread is a
+            # worker, it mustn't hold them up
+            return self.worker_pool.blocking(self.event_loop.run, coro,
+                                             commands)
+        return self.event_loop.run(coro, commands)
+
+    def close_event_loop(self):
+        """Stop and close the event loop, if there is one."""
+        self.run_lock.acquire()
+        try:
+            event_loop = self.event_loop
+            self.event_loop = None
+        finally:
+            self.run_lock.release()
+        if event_loop is not None:
+            event_loop.close()
+
+    def close_worker_pool(self):
+        """Stop the threads of the worker pool, if there is one."""
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
 
     def run_command(self, command):
         """Do whatever it takes to run a command (including nothing at all,
@@ -714,17 +1121,160 @@ class CMDHelper(object):
         already created and run the command named by 'command', return
         silently without doing anything.  If the command named by 'command'
         doesn't even have a command object yet, create one.  Then invoke
-        'run()' on that command object (or an existing one).
+        'run()' on that command object (or an existing one).  Raises
+        CMDHelperClassError if the command depends on itself, through
+        'depends_on' or commands run by its 'run()'.
         """
         # Already been here, done that? then return silently.
         if self.have_run.get(command):
             return
 
+        stack = getattr(self.running, 'commands', None)
+        if stack is None:
+            stack = self.running.commands = []
+        if command in stack:
+            raise CMDHelperClassError, \
+                  "circular dependency between commands: %s" % \
+                  " -> ".join(stack + [command])
+        stack.append(command)
+        try:
+            self._run_command(command)
+        finally:
+            stack.pop()
+
+    def _run_command(self, command):
+        """Run 'command' and the commands it depends on, once
+        'run_command()' checked it isn't running already.
+        """
+        # Commands the command depends on are run first
+        for dependency in getattr(self.get_command_class(command),
+                                  'depends_on', []):
+            self.run_command(dependency)
+
+        lock = self.get_command_lock(command)
+        lock.acquire()
+        try:
+            started = self._start_command(command)
+            if started is None:
+                return
+            cmd_obj = started[0]
+            try:
+                if cmd_obj.is_async:
+                    self.run_coroutine(cmd_obj.run())
+                else:
+                    cmd_obj.run()
+            except:
+                exc_info = sys.exc_info()
+                self._fail_command(command, started[1], exc_info, cmd_obj)
+                raise exc_info[0], exc_info[1], exc_info[2]
+            self._finish_command(command, started)
+        finally:
+            lock.release()
+
+    def _start_command(self, command):
+        """Get ready to run 'command', whose lock the caller holds:
+        create and finalize its command object and tell the hooks.
+        Return the '(cmd_obj, timing, digest)' tuple to pass to
+        '_finish_command()' once 'cmd_obj.run()' returned, or None if
+        there is nothing to run -- somebody else ran it meanwhile, or
+        --resume found it completed by a previous run.
+        """
+        # somebody else may have run it while we were waiting
+        if self.have_run.get(command):
+            return None
         log.info("running %s", command)
-        cmd_obj = self.get_command_obj(command)
-        cmd_obj.ensure_finalized()
-        cmd_obj.run()
+        hooks = self.get_hooks()
+        timing = self.timer.start('command', command)
+        # files may have changed since the metadata was cached, by the
+        # previous commands or otherwise
+        if self.stat_cache is not None:
+            self.stat_cache.clear()
+        try:
+            cmd_obj = self.get_command_obj(command)
+            if hooks.active:
+                hooks.dispatch('before_finalize', command, self)
+            cmd_obj.ensure_finalized()
+            digest = None
+            if self.resume:
+                from cmdhelper.resume import get_options_digest
+                digest = get_options_digest(cmd_obj)
+                if digest is not None and \
+                   self.get_run_state().is_completed(command, digest):
+                    log.info("skipping %s (completed by a previous run)",
+                             command)
+                    self.timer.stop(timing)
+                    self.have_run[command] = 1
+                    return None
+            if hooks.active:
+                hooks.dispatch('before_run', command, self,
+                               timing.started, timing.cpu_started)
+        except:
+            exc_info = sys.exc_info()
+            self._fail_command(command, timing, exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return (cmd_obj, timing, digest)
+
+    def _finish_command(self, command, started):
+        """Complete the run of 'command' started by '_start_command()':
+        commit the journal of the command object and save its build
+        cache, tell the hooks and record the command in 'have_run' (and
+        the --resume state).
+        """
+        (cmd_obj, timing, digest) = started
+        try:
+            # operations still journaled when the command is done
+            if cmd_obj.journal is not None:
+                cmd_obj.commit_journal()
+            cmd_obj.save_build_cache()
+        except:
+            exc_info = sys.exc_info()
+            self._fail_command(command, timing, exc_info, cmd_obj)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self.timer.stop(timing)
+        hooks = self.get_hooks()
+        if hooks.active:
+            hooks.dispatch('after_run', command, self,
+                           timing.started, timing.cpu_started)
         self.have_run[command] = 1
+        if digest is not None and not cmd_obj.dry_run:
+            state = self.get_run_state()
+            try:
+                state.mark_completed(command, digest)
+            except (IOError, OSError), msg:
+                log.warn("can't record %s in %s: %s", command,
+                         state.filename, msg)
+
+    def _fail_command(self, command, timing, exc_info, cmd_obj=None):
+        """Clean up after 'command' failed with 'exc_info': save the
+        build cache of its command object 'cmd_obj', if it was created,
+        and tell the hooks.  The command is reported as still running
+        by --timings.
+        """
+        try:
+            if cmd_obj is not None:
+                cmd_obj.save_build_cache()
+        finally:
+            self.timer.abort(timing)
+            hooks = self.get_hooks()
+            if hooks.active:
+                hooks.dispatch('on_error', command, self,
+                               timing.started, timing.cpu_started, exc_info)
+
+    def get_command_lock(self, command):
+        """Return the lock held while 'command' is being run."""
+        self.run_lock.acquire()
+        try:
+            lock = self.command_locks.get(command)
+            if lock is None:
+                lock = self.command_locks[command] = threading.RLock()
+            return lock
+        finally:
+            self.run_lock.release()
+
+# time spent importing cmdhelper, reported by --timings
+_import_wall = time.time() - _import_started[0]
+_import_cpu = (os.times()[0] + os.times()[1] -
+               _import_started[1][0] - _import_started[1][1])
 
 if __name__ == "__main__":
     cmdhelper = CMDHelper()
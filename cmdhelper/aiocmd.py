@@ -0,0 +1,394 @@
+"""cmdhelper.aiocmd
+
+Provides the AsyncCommand class, the base class for commands whose
+'run()' method is a coroutine.
+
+Commands which spawn many programs or wait for many slow operations
+spend most of their time blocked.  An AsyncCommand instead starts them
+all and waits for them concurrently on an event loop, eg.
+
+    class Fetch(AsyncCommand):
+        ...
+        @coroutine
+        def run(self):
+            yield From(asyncio.gather(*[self.spawn_async(['fetch', url])
+                                        for url in self.urls]))
+
+CMDHelper runs the coroutines of all its commands on one event loop,
+run by a thread of its own (see EventLoopThread): whichever thread runs
+a command -- the main thread, or a --jobs worker -- hands the coroutine
+over to the loop and waits for it.  The loop (CommandEventLoop) waits
+for its child processes with a ThreadedChildWatcher of its own, which
+unlike the SIGCHLD based watchers of trollius doesn't need the main
+thread to run the loop; the child watcher of the process is left alone.
+
+Coroutines use the trollius flavour of asyncio ("yield From(...)",
+"raise Return(...)"), which works with the Python versions supported by
+cmdhelper; this module requires the 'trollius' package.
+"""
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return, coroutine
+except ImportError:
+    raise ImportError("cmdhelper.aiocmd requires the 'trollius' package")
+
+import os, sys, errno, threading
+from distutils import log
+from distutils.spawn import find_executable
+
+from cmdhelper.cmd import Command
+from cmdhelper.errors import *
+from cmdhelper.parallel import output, Job
+
+if os.name == 'posix':
+
+    from trollius.unix_events import _UnixSubprocessTransport
+
+    class ThreadedChildWatcher(asyncio.AbstractChildWatcher):
+        """Child watcher of a CommandEventLoop: a daemon thread polls the
+        child processes started by the loop with waitpid(WNOHANG) --
+        more often right after one started -- and calls their handlers
+        there (the handlers pass the exit status on to their loop
+        thread-safely).  Works whichever thread runs the loop and never
+        reaps processes it wasn't told about.
+        """
+
+        # bounds of the polling interval, in seconds
+        min_interval = 0.001
+        max_interval = 0.05
+
+        def __init__(self):
+            self.handlers = {}
+            self.condition = threading.Condition()
+            self.interval = self.min_interval
+            self.thread = None
+            self.closed = 0
+
+        def add_child_handler(self, pid, callback, *args):
+            self.condition.acquire()
+            try:
+                self.handlers[pid] = (callback, args)
+                self.interval = self.min_interval
+                if self.thread is None:
+                    self.thread = threading.Thread(
+                        target=self._run, name="cmdhelper child watcher")
+                    self.thread.setDaemon(1)
+                    self.thread.start()
+                self.condition.notify()
+            finally:
+                self.condition.release()
+
+        def remove_child_handler(self, pid):
+            self.condition.acquire()
+            try:
+                return self.handlers.pop(pid, None) is not None
+            finally:
+                self.condition.release()
+
+        def _run(self):
+            self.condition.acquire()
+            try:
+                while not self.closed:
+                    if not self.handlers:
+                        self.condition.wait()
+                        continue
+                    exited = []
+                    for pid in self.handlers.keys():
+                        returncode = self._poll(pid)
+                        if returncode is not None:
+                            exited.append((pid, returncode,
+                                           self.handlers.pop(pid)))
+                    if not exited:
+                        self.condition.wait(self.interval)
+                        self.interval = min(self.interval * 2,
+                                            self.max_interval)
+                        continue
+                    self.condition.release()
+                    try:
+                        for (pid, returncode, (callback, args)) in exited:
+                            callback(pid, returncode, *args)
+                    finally:
+                        self.condition.acquire()
+            finally:
+                self.condition.release()
+
+        def _poll(self, pid):
+            """Return the exit status of the child process 'pid', None
+            if it is still running.
+            """
+            try:
+                (pid_, status) = os.waitpid(pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    return None
+                # reaped by somebody else: the status is lost
+                log.warn("unknown child process %d, exit status unknown",
+                         pid)
+                return 255
+            if not pid_:
+                return None
+            if os.WIFSIGNALED(status):
+                return -os.WTERMSIG(status)
+            return os.WEXITSTATUS(status)
+
+        def attach_loop(self, loop):
+            pass
+
+        def close(self):
+            self.condition.acquire()
+            try:
+                self.closed = 1
+                self.condition.notify()
+            finally:
+                self.condition.release()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, a, b, c):
+            pass
+
+    class CommandEventLoop(asyncio.SelectorEventLoop):
+        """The event loop of an EventLoopThread, waiting for the child
+        processes it starts with its own ThreadedChildWatcher,
+        'child_watcher', rather than with the child watcher of the
+        process.
+        """
+
+        def __init__(self, selector=None):
+            asyncio.SelectorEventLoop.__init__(self, selector)
+            self.child_watcher = ThreadedChildWatcher()
+
+        @coroutine
+        def _make_subprocess_transport(self, protocol, args, shell,
+                                       stdin, stdout, stderr, bufsize,
+                                       extra=None, **kwargs):
+            # as in trollius, but with the watcher of the loop
+            waiter = asyncio.Future(loop=self)
+            transp = _UnixSubprocessTransport(self, protocol, args, shell,
+                                              stdin, stdout, stderr, bufsize,
+                                              waiter=waiter, extra=extra,
+                                              **kwargs)
+            self.child_watcher.add_child_handler(
+                transp.get_pid(), self._child_watcher_callback, transp)
+            try:
+                yield From(waiter)
+            except Exception, exc:
+                err = exc
+            else:
+                err = None
+            if err is not None:
+                transp.close()
+                yield From(transp._wait())
+                raise err
+            raise Return(transp)
+
+        def close(self):
+            asyncio.SelectorEventLoop.close(self)
+            self.child_watcher.close()
+
+else:
+    CommandEventLoop = asyncio.SelectorEventLoop
+
+
+class CommandTask(asyncio.Task):
+    """Task running a coroutine on behalf of the thread which handed it
+    over to the loop: 'commands' is the list of commands that thread is
+    running (see 'CMDHelper.run_command()'), and the output of the loop
+    thread is captured into 'buffer', the buffer of that thread (see
+    cmdhelper.parallel.CapturedOutput) -- so the output of a command run
+    with --jobs stays with the command.  Tasks created by the coroutine
+    inherit both.
+    """
+
+    def __init__(self, coro, loop=None, commands=(), buffer=None):
+        self.commands = list(commands)
+        self.buffer = buffer
+        asyncio.Task.__init__(self, coro, loop=loop)
+
+    def _step(self, *args):
+        previous = getattr(output.local, 'buffer', None)
+        output.local.buffer = self.buffer
+        try:
+            asyncio.Task._step(self, *args)
+        finally:
+            output.local.buffer = previous
+
+
+def _create_task(loop, coro):
+    parent = asyncio.Task.current_task(loop=loop)
+    return CommandTask(coro, loop=loop,
+                       commands=getattr(parent, 'commands', ()),
+                       buffer=getattr(output.local, 'buffer', None))
+
+
+class EventLoopThread(object):
+    """An event loop, 'loop', run by a daemon thread of its own until
+    'close()' is called.
+    """
+
+    def __init__(self):
+        self.loop = CommandEventLoop()
+        self.loop.set_task_factory(_create_task)
+        self.thread = threading.Thread(target=self._run,
+                                       name="cmdhelper event loop")
+        self.thread.setDaemon(1)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, commands=()):
+        """Run the coroutine 'coro' on the loop, on behalf of the
+        commands 'commands' (see CommandTask), and wait for it; return
+        its result or raise its exception.  Can't be called from the
+        loop thread: coroutines wait for other coroutines with "yield
+        From(...)".
+        """
+        if threading.currentThread() is self.thread:
+            raise CMDHelperInternalError, \
+                  "can't wait for a coroutine in the event loop thread " \
+                  "(use run_command_async() in coroutines)"
+        buffer = getattr(output.local, 'buffer', None)
+        done = threading.Event()
+        started = []
+
+        def start():
+            try:
+                task = CommandTask(coro, loop=self.loop,
+                                   commands=commands, buffer=buffer)
+            except:
+                started.append((None, sys.exc_info()))
+                done.set()
+                return
+            started.append((task, None))
+            task.add_done_callback(lambda task: done.set())
+
+        self.loop.call_soon_threadsafe(start)
+        done.wait()
+        (task, exc_info) = started[0]
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return task.result()
+
+    def close(self):
+        """Stop the loop once the callbacks already scheduled ran, and
+        close it.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class AsyncCommand(Command):
+    """Command whose 'run()' method is a coroutine.  Besides the usual
+    Command helpers, provides coroutine versions of 'spawn()',
+    'execute()' and 'run_command()'.
+    """
+
+    # tells CMDHelper.run_command() that 'run()' returns a coroutine
+    is_async = 1
+
+    @coroutine
+    def run(self):
+        """Coroutine version of 'Command.run()'.
+
+        This method must be implemented by all command classes.
+        """
+        raise RuntimeError, \
+              "abstract method -- subclass %s must override" % self.__class__
+
+    @coroutine
+    def spawn_async(self, cmd, search_path=1, level=1):
+        """Run the program 'cmd' (an argument list) respecting the
+        dry-run flag, without blocking the event loop.  Raises
+        CMDHelperExecError if it fails.
+        """
+        log.info(' '.join(cmd))
+        if self.dry_run:
+            return
+
+        executable = cmd[0]
+        if search_path:
+            executable = find_executable(executable) or executable
+        try:
+            process = yield From(asyncio.create_subprocess_exec(
+                executable, *cmd[1:]))
+        except OSError, e:
+            raise CMDHelperExecError, \
+                  "command '%s' failed: %s" % (cmd[0], e.strerror)
+        status = yield From(process.wait())
+        self.forget_file_stats()
+        if status < 0:
+            raise CMDHelperExecError, \
+                  "command '%s' terminated by signal %d" % (cmd[0], -status)
+        elif status:
+            raise CMDHelperExecError, \
+                  "command '%s' failed with exit status %d" % (cmd[0], status)
+
+    @coroutine
+    def execute_async(self, func, args, msg=None, level=1):
+        """Coroutine version of 'execute()': 'func(*args)' is run in the
+        default executor of the event loop, so blocking functions don't
+        stall other coroutines.  Returns the result of 'func'.
+        """
+        if msg is None:
+            msg = "%s%r" % (func.__name__, args)
+            if msg[-2:] == ',)':        # correct for singleton tuple
+                msg = msg[0:-2] + ')'
+        log.info(msg)
+        if self.dry_run:
+            return
+        loop = self.cmdutil.get_event_loop()
+        try:
+            result = yield From(loop.run_in_executor(None, func, *args))
+        finally:
+            self.forget_file_stats()
+        raise Return(result)
+
+    @coroutine
+    def run_command_async(self, command):
+        """Coroutine version of 'run_command()': 'command' is run by
+        'CMDHelper.run_command()' -- dependencies, hooks, --resume and
+        all -- on the worker pool, so the loop keeps running other
+        coroutines meanwhile.  The coroutine of an asynchronous command
+        is handed back to the loop.  If the coroutine is cancelled
+        before the command started, it never starts; a command already
+        running is left to finish.
+        """
+        cmdutil = self.cmdutil
+        if cmdutil.have_run.get(command):
+            return
+        loop = cmdutil.get_event_loop()
+        task = asyncio.Task.current_task(loop=loop)
+        buffer = getattr(task, 'buffer', None)
+        future = asyncio.Future(loop=loop)
+
+        def run():
+            # the output goes to the buffer of the calling coroutine
+            previous = getattr(output.local, 'buffer', None)
+            output.local.buffer = buffer
+            try:
+                cmdutil.run_command(command)
+            finally:
+                output.local.buffer = previous
+
+        def set_result(job):
+            if not future.cancelled():
+                future.set_result(job)
+
+        # the job runs on behalf of the commands of the calling
+        # coroutine, to catch circular dependencies
+        job = Job(run, (), tuple(getattr(task, 'commands', ())))
+        job.callbacks.append(
+            lambda job: loop.call_soon_threadsafe(set_result, job))
+        cmdutil.get_worker_pool().submit_job(job)
+        try:
+            yield From(future)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+        # re-raises the exception of the command, traceback included
+        job.get()
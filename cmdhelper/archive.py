@@ -0,0 +1,404 @@
+"""cmdhelper.archive
+
+Provides 'make_archive()', the engine behind 'Command.make_archive()'.
+
+Archives are written as a stream, straight to the output file or to any
+file-like object open for writing (eg. a pipe); nothing is seeked back
+or staged in a temporary archive.  Compression with deflate (gztar and
+zip archives) is done the way pigz does it: the data is cut into chunks
+which are compressed by a pool of threads -- zlib releases the global
+interpreter lock while compressing -- and the compressed chunks are
+joined back in order into a single deflate stream.  At most a fixed
+number of chunks are in flight at any time, so memory use doesn't grow
+with the size of the tree.
+
+Archives are built from 'root_dir' without changing the working
+directory, which isn't safe to do while other commands run in parallel.
+"""
+
+import os, time, struct, zlib, tarfile, zipfile
+from collections import deque
+from tempfile import SpooledTemporaryFile
+from distutils import archive_util, log
+from distutils.dir_util import mkpath
+
+from cmdhelper.parallel import WorkerPool
+
+# size of the chunks compressed by the worker threads
+CHUNK_SIZE = 1024 * 1024
+
+# chunks in flight per worker thread
+WINDOW_PER_THREAD = 4
+
+# zip members compressing to more than this are spooled to disk
+SPOOL_SIZE = 4 * 1024 * 1024
+
+# ends a deflate stream made of chunks compressed by 'deflate_chunk()'
+_FINAL_BLOCK = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+# archive formats written by this module, with the compression used
+STREAM_FORMATS = {'gztar': 'gzip', 'bztar': 'bzip2', 'tar': None,
+                  'zip': 'deflate'}
+
+
+def get_default_threads():
+    """Return the number of compression threads used by default: one
+    per processor.
+    """
+    try:
+        from multiprocessing import cpu_count
+        return cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def deflate_chunk(data, level):
+    """Compress the string 'data' to raw deflate blocks ending on a byte
+    boundary, which can be concatenated with the compressed data of the
+    following chunk.  The concatenation must end with '_FINAL_BLOCK'.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class DeflatePipeline(object):
+    """Compresses chunks of data on a WorkerPool, keeping at most
+    'window' chunks in flight.  Compressed chunks are handed, in order,
+    to the 'output' callable of the stream they belong to.
+    """
+
+    def __init__(self, pool, window, level):
+        self.pool = pool
+        self.window = window
+        self.level = level
+        self.jobs = deque()
+
+    def submit(self, data, output):
+        self.jobs.append((self.pool.submit(deflate_chunk, data, self.level),
+                          output))
+        while len(self.jobs) > self.window:
+            self.settle()
+
+    def settle(self):
+        """Wait for the oldest chunk and pass it on."""
+        job, output = self.jobs.popleft()
+        output(job.get())
+
+    def flush(self):
+        while self.jobs:
+            self.settle()
+
+
+class GzipWriter(object):
+    """File-like object gzip-compressing what is written to it into the
+    file object 'fileobj'.  'name' is the original file name recorded
+    in the gzip header.
+    """
+
+    def __init__(self, fileobj, pipeline, name=None, mtime=None):
+        self.fileobj = fileobj
+        self.pipeline = pipeline
+        self.buffer = []
+        self.buffered = 0
+        self.crc = zlib.crc32('') & 0xffffffffL
+        self.size = 0
+
+        flags = 0
+        if name:
+            flags = 0x08            # FNAME
+        if mtime is None:
+            mtime = time.time()
+        fileobj.write('\037\213\010' + chr(flags) +
+                      struct.pack('<L', long(mtime)) + '\000\377')
+        if name:
+            fileobj.write(name + '\000')
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffffL
+        self.size = self.size + len(data)
+        self.buffer.append(data)
+        self.buffered = self.buffered + len(data)
+        if self.buffered >= CHUNK_SIZE:
+            self._submit()
+
+    def _submit(self):
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.pipeline.submit(data, self.fileobj.write)
+
+    def close(self):
+        if self.buffered:
+            self._submit()
+        self.pipeline.flush()
+        self.fileobj.write(_FINAL_BLOCK)
+        self.fileobj.write(struct.pack('<LL', self.crc,
+                                       self.size & 0xffffffffL))
+
+    def flush(self):
+        pass
+
+
+class PositionWriter(object):
+    """Wraps the file object 'fileobj', keeping track of the position
+    for zipfile: pipes can't tell() it.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.position = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.position = self.position + len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class _ZipMember(object):
+    """A file or directory being added to a StreamingZipFile."""
+
+    def __init__(self, filename, zinfo=None):
+        self.filename = filename
+        self.zinfo = zinfo
+        self.crc = zlib.crc32('') & 0xffffffffL
+        self.size = 0
+        self.compressed = None
+        self.compress_size = 0
+        self.pending = 0
+        if zinfo is not None:
+            self.compressed = SpooledTemporaryFile(SPOOL_SIZE)
+
+    def output(self, data):
+        self.compressed.write(data)
+        self.compress_size = self.compress_size + len(data)
+        self.pending = self.pending - 1
+
+
+class StreamingZipFile(zipfile.ZipFile):
+    """ZipFile writing deflated members which are compressed on a
+    DeflatePipeline, without ever seeking in the output file.
+    """
+
+    def __init__(self, fileobj, pipeline):
+        zipfile.ZipFile.__init__(self, PositionWriter(fileobj), 'w',
+                                 zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.pipeline = pipeline
+        self.members = deque()
+
+    def add_file(self, filename, arcname):
+        """Queue the file 'filename' to be stored as 'arcname'."""
+        st = os.stat(filename)
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        member = _ZipMember(filename, zinfo)
+        self.members.append(member)
+
+        f = open(filename, 'rb')
+        try:
+            while 1:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                member.crc = zlib.crc32(data, member.crc) & 0xffffffffL
+                member.size = member.size + len(data)
+                member.pending = member.pending + 1
+                self.pipeline.submit(data, member.output)
+                self._write_members()
+        finally:
+            f.close()
+        self._write_members()
+
+    def add_directory(self, dirname, arcname):
+        """Queue the directory 'dirname' to be stored as 'arcname'."""
+        member = _ZipMember(dirname)
+        member.arcname = arcname
+        self.members.append(member)
+
+    def _write_members(self, final=0):
+        # write out the leading members whose chunks are all compressed;
+        # the last one may still be read unless 'final' is true
+        while self.members and not self.members[0].pending and \
+              (final or len(self.members) > 1):
+            self._write_member(self.members.popleft())
+
+    def _write_member(self, member):
+        zinfo = member.zinfo
+        if zinfo is None:
+            # directories have no data: ZipFile.write() doesn't seek
+            self.write(member.filename, member.arcname)
+            return
+        member.compressed.write(_FINAL_BLOCK)
+        member.compress_size = member.compress_size + len(_FINAL_BLOCK)
+        zinfo.CRC = member.crc
+        zinfo.file_size = member.size
+        zinfo.compress_size = member.compress_size
+        zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or \
+                zinfo.compress_size > zipfile.ZIP64_LIMIT
+        zinfo.header_offset = self.fp.tell()
+        self._writecheck(zinfo)
+        self.fp.write(zinfo.FileHeader(zip64))
+        compressed = member.compressed
+        compressed.seek(0)
+        while 1:
+            data = compressed.read(CHUNK_SIZE)
+            if not data:
+                break
+            self.fp.write(data)
+        compressed.close()
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
+
+    def flush(self):
+        """Write all the queued files."""
+        self.pipeline.flush()
+        self._write_members(final=1)
+
+    def close(self):
+        if self.fp is not None:
+            self.flush()
+        zipfile.ZipFile.close(self)
+
+
+def _set_owner(owner, group):
+    """Return the tarfile filter setting the owner and group of the
+    members, like distutils does.
+    """
+    uid = archive_util._get_uid(owner)
+    gid = archive_util._get_gid(group)
+
+    def set_uid_gid(tarinfo):
+        if gid is not None:
+            tarinfo.gid = gid
+            tarinfo.gname = group
+        if uid is not None:
+            tarinfo.uid = uid
+            tarinfo.uname = owner
+        return tarinfo
+    return set_uid_gid
+
+
+def write_tarball(fileobj, root_dir, base_dir, compress, pipeline,
+                  name=None, owner=None, group=None):
+    """Write the tree 'base_dir' of 'root_dir' as a tar archive to
+    'fileobj', compressed with 'compress' (see 'make_tarball()').
+    'name' is recorded in the gzip header.
+    """
+    gzip = None
+    if compress == 'gzip':
+        gzip = fileobj = GzipWriter(fileobj, pipeline, name)
+        mode = 'w|'
+    elif compress == 'bzip2':
+        mode = 'w|bz2'
+    else:
+        mode = 'w|'
+    tar = tarfile.open(mode=mode, fileobj=fileobj)
+    try:
+        tar.add(os.path.join(root_dir, base_dir), base_dir,
+                filter=_set_owner(owner, group))
+    finally:
+        tar.close()
+    if gzip is not None:
+        gzip.close()
+
+
+def write_zipfile(fileobj, root_dir, base_dir, pipeline):
+    """Write the tree 'base_dir' of 'root_dir' as a zip archive to
+    'fileobj', naming the members like 'distutils.archive_util.
+    make_zipfile()' does.
+    """
+    zip = StreamingZipFile(fileobj, pipeline)
+    try:
+        if base_dir != os.curdir:
+            path = os.path.normpath(os.path.join(base_dir, ''))
+            zip.add_directory(os.path.join(root_dir, path), path)
+            log.info("adding '%s'", path)
+        for dirpath, dirnames, filenames in \
+                os.walk(os.path.join(root_dir, base_dir)):
+            reldir = os.path.join(base_dir,
+                                  os.path.relpath(dirpath,
+                                      os.path.join(root_dir, base_dir)))
+            for name in dirnames:
+                path = os.path.normpath(os.path.join(reldir, name, ''))
+                zip.add_directory(os.path.join(root_dir, path), path)
+                log.info("adding '%s'", path)
+            for name in filenames:
+                path = os.path.normpath(os.path.join(reldir, name))
+                filename = os.path.join(root_dir, path)
+                if os.path.isfile(filename):
+                    zip.add_file(filename, path)
+                    log.info("adding '%s'", path)
+    finally:
+        zip.close()
+
+
+def make_archive(base_name, format, root_dir=None, base_dir=None,
+                 verbose=0, dry_run=0, owner=None, group=None,
+                 fileobj=None, threads=None, level=9):
+    """Create an archive file (eg. zip or tar); arguments and return
+    value are those of 'distutils.archive_util.make_archive()'.
+
+    If 'fileobj' is given the archive is written to it instead of to a
+    file named after 'base_name', and None is returned.  Formats not in
+    STREAM_FORMATS can't be written to a file object; they are created
+    by distutils.  Compression is spread over 'threads' threads, one per
+    processor by default.
+    """
+    if format not in STREAM_FORMATS:
+        if fileobj is not None:
+            raise ValueError, \
+                  "archive format '%s' can't be streamed" % format
+        return archive_util.make_archive(
+            base_name, format, root_dir, base_dir, verbose=verbose,
+            dry_run=dry_run, owner=owner, group=group)
+
+    if root_dir is None:
+        root_dir = os.curdir
+    if base_dir is None:
+        base_dir = os.curdir
+    compress = STREAM_FORMATS[format]
+
+    archive_name = None
+    if fileobj is None:
+        if format == 'zip':
+            archive_name = base_name + '.zip'
+        else:
+            archive_name = base_name + '.tar' + \
+                {'gzip': '.gz', 'bzip2': '.bz2', None: ''}[compress]
+        mkpath(os.path.dirname(archive_name), dry_run=dry_run)
+
+    if format == 'zip':
+        log.info("creating '%s' and adding '%s' to it",
+                 archive_name or '<stream>', base_dir)
+    else:
+        log.info('Creating tar archive')
+    if dry_run:
+        return archive_name
+
+    if threads is None:
+        threads = get_default_threads()
+    pool = WorkerPool(threads)
+    pipeline = DeflatePipeline(pool, threads * WINDOW_PER_THREAD, level)
+    if archive_name is not None:
+        out = open(archive_name, 'wb')
+    else:
+        out = fileobj
+    try:
+        if format == 'zip':
+            write_zipfile(out, root_dir, base_dir, pipeline)
+        else:
+            name = None
+            if archive_name is not None:
+                name = os.path.basename(archive_name)[:-3]
+            write_tarball(out, root_dir, base_dir, compress, pipeline,
+                          name, owner, group)
+    finally:
+        if archive_name is not None:
+            out.close()
+        pool.close()
+    return archive_name
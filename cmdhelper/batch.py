@@ -0,0 +1,193 @@
+"""cmdhelper.batch
+
+Running many command lines through one CMDHelper.
+
+Driver scripts calling a utility thousands of times pay, for every call,
+for starting the interpreter, reading the configuration files and
+finding and importing the commands.  In batch mode -- the --batch=FILE
+global option ('-' reads stdin) or 'CMDHelper.run_batch()' -- the
+utility reads command lines, one per line, and runs each of them through
+'parse_command_line()' and the commands it names with the same
+CMDHelper.  The configuration is read once, and the command classes and
+their compiled option tables are kept from one command line to the
+next; the command objects, 'have_run' and the options set by the
+previous command line are reset.  Global options given with --batch
+apply to every command line.
+
+Command lines are split like a shell would (see shlex); blank lines and
+lines starting with '#' are skipped.  The result of every command line
+is written as a line of JSON, in the order of the input:
+
+    {"line": 3, "args": ["build", "-f"], "status": 0, "error": null,
+     "output": "...", "elapsed": 0.0012}
+
+'status' is the exit status the utility would have had, 'output' what
+the command line printed on sys.stdout.  Programs spawned by the
+commands write to the real standard output, so they should capture
+their output (eg. 'Command.spawn_many()' does by default).
+
+With --batch-workers=N the command lines are run by N worker processes
+forked from the utility once the configuration is read, so they start
+warm.  This needs fork().
+"""
+
+import sys, os, time, shlex
+from StringIO import StringIO
+from distutils.errors import DistutilsError
+from distutils.fancy_getopt import translate_longopt
+
+from cmdhelper.errors import *
+from cmdhelper.timings import Timings
+
+# BatchRunner run by the worker processes, inherited through fork()
+_worker_runner = None
+
+
+def _run_in_worker(item):
+    return _worker_runner.run_item(*item)
+
+
+def read_batch(lines):
+    """Yield a (line number, arguments, error) tuple for every command
+    line of 'lines' (an iterable of strings, eg. a file).  'arguments'
+    is None, and 'error' the reason, if the line can't be split.
+    """
+    lineno = 0
+    for line in lines:
+        lineno = lineno + 1
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        try:
+            yield (lineno, shlex.split(line), None)
+        except ValueError, msg:
+            yield (lineno, None, "can't split command line: %s" % msg)
+
+
+class BatchRunner(object):
+    """Runs command lines with the CMDHelper 'cmdutil', whose
+    configuration and global options are read already.  Every command
+    line starts from the state 'cmdutil' had when the runner was
+    created.
+    """
+
+    # command lines sent to a worker process at a time
+    chunk_size = 16
+
+    def __init__(self, cmdutil):
+        self.cmdutil = cmdutil
+        self.options = cmdutil.command_options.copy()
+
+        # attributes the global options set
+        self.state = {}
+        for option in cmdutil._get_toplevel_options() + \
+                      cmdutil.display_options:
+            attr = translate_longopt(option[0])
+            if attr[-1] == '=':
+                attr = attr[:-1]
+            attr = cmdutil.negative_opt.get(attr, attr)
+            self.state[attr] = getattr(cmdutil, attr, None)
+        self.state['batch'] = None
+        self.state['batch_workers'] = None
+
+    def reset(self, args):
+        """Bring 'cmdutil' back to its initial state, ready to parse the
+        command line 'args'.
+        """
+        cmdutil = self.cmdutil
+        for (attr, value) in self.state.items():
+            setattr(cmdutil, attr, value)
+        cmdutil.command_options = self.options.copy()
+        cmdutil.command_obj = {}
+        cmdutil.have_run = {}
+        cmdutil.command_locks = {}
+        cmdutil.stat_cache = None
+        cmdutil.run_state = None
+        cmdutil.timer = Timings()
+        cmdutil.script_args = args
+
+    def run_item(self, lineno, args, error=None):
+        """Run the command line 'args' (a list of arguments, without the
+        script name) found on line 'lineno'; return its result, as
+        described in the module documentation.  'error' is the reason
+        why the line couldn't be split, if it couldn't.
+        """
+        result = {'line': lineno, 'args': args, 'status': 0,
+                  'error': error, 'output': '', 'elapsed': 0.0}
+        if error is not None:
+            result['status'] = 1
+            return result
+
+        cmdutil = self.cmdutil
+        self.reset(args)
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        start = time.time()
+        try:
+            try:
+                if cmdutil.parse_command_line():
+                    if cmdutil.batch:
+                        raise CMDHelperArgError, \
+                              "--batch can't be used in a batch"
+                    cmdutil.execute()
+            except SystemExit, e:
+                # same exit status as 'cmdhelper.server'
+                if isinstance(e.code, int):
+                    result['status'] = e.code
+                elif e.code is not None:
+                    result['status'] = 1
+                    result['error'] = str(e.code)
+            except KeyboardInterrupt:
+                raise
+            except (CMDHelperError, DistutilsError, EnvironmentError), msg:
+                result['status'] = 1
+                result['error'] = str(msg)
+            except Exception, e:
+                result['status'] = 1
+                result['error'] = "%s: %s" % (e.__class__.__name__, e)
+        finally:
+            sys.stdout = stdout
+        result['elapsed'] = time.time() - start
+        result['output'] = output.getvalue()
+        return result
+
+    def run(self, lines, output, workers=1):
+        """Run the command lines of 'lines' (see 'read_batch()') with
+        'workers' processes and write their results to 'output' as JSON
+        lines.  Return the number of command lines which failed.
+        """
+        import json
+
+        items = read_batch(lines)
+        if workers > 1:
+            results = self._run_forked(items, workers)
+        else:
+            results = (self.run_item(*item) for item in items)
+
+        failed = 0
+        for result in results:
+            if result['status']:
+                failed = failed + 1
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+        return failed
+
+    def _run_forked(self, items, workers):
+        global _worker_runner
+
+        if not hasattr(os, 'fork'):
+            raise CMDHelperPlatformError, \
+                  "--batch-workers needs fork(), run without it"
+        import multiprocessing
+
+        _worker_runner = self
+        sys.stdout.flush()          # or the workers would flush it too
+        pool = multiprocessing.Pool(workers)
+        try:
+            for result in pool.imap(_run_in_worker, items, self.chunk_size):
+                yield result
+            pool.close()
+        finally:
+            _worker_runner = None
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,207 @@
+"""cmdhelper.buildcache
+
+Provides the BuildCache class used by 'Command.make_file()' to decide
+whether an output file has to be regenerated.
+
+Comparing timestamps (distutils.dep_util.newer_group) regenerates the
+output whenever some input was touched, even if its contents didn't
+change.  The build cache instead records, for every output file, the
+content digests of its inputs and a signature of the function and
+arguments which generated it; the output is up to date as long as all
+of those are unchanged and the output file itself wasn't modified.
+
+Input digests are recomputed only for files whose size or modification
+time changed since they were last hashed.  Every command of every
+utility has its own cache file per project (see 'get_cache_file()').
+
+The build cache is off unless the utility sets the 'use_build_cache'
+attribute of CMDHelper: timestamps are compared then, as distutils does.
+"""
+
+import os, threading
+
+from cmdhelper.debug import DEBUG
+from cmdhelper.util import write_file_atomic
+
+# Bumped every time the layout of the cache file changes.
+BUILD_CACHE_FORMAT = 1
+
+
+def file_digest(filename, blocksize=65536):
+    """Return the hex MD5 digest of the contents of 'filename'."""
+    try:
+        from hashlib import md5
+    except ImportError:
+        from md5 import new as md5
+    digest = md5()
+    f = open(filename, 'rb')
+    try:
+        while 1:
+            block = f.read(blocksize)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+def get_cache_file(cache_dir, entry_point, directory, command):
+    """Return the name of the build cache file, in 'cache_dir', of the
+    command 'command' of the utility of the entry point group
+    'entry_point' run in the project 'directory'.
+    """
+    try:
+        from hashlib import md5
+    except ImportError:
+        from md5 import new as md5
+    name = md5('%s\0%s' % (entry_point, os.path.abspath(directory)))
+    return os.path.join(cache_dir, name.hexdigest(), command + '.json')
+
+
+def make_signature(func, args):
+    """Return a string identifying the call 'func(*args)'.  Functions
+    and methods are identified by their names, since their repr()
+    contains their address.
+    """
+    def describe(obj):
+        if callable(obj) and hasattr(obj, '__name__'):
+            return '%s.%s' % (getattr(obj, '__module__', None), obj.__name__)
+        return repr(obj)
+    return '%s(%s)' % (describe(func), ', '.join(map(describe, args)))
+
+
+class BuildCache(object):
+    """The record of the output files generated by one command, stored
+    in the file 'filename'.  File metadata is taken from the StatCache
+    'stats'.
+    """
+
+    def __init__(self, filename, stats):
+        self.filename = filename
+        self.stats = stats
+        self.lock = threading.RLock()
+
+        # 'outputs' maps absolute output file names to dictionaries with
+        # 'signature', 'output' ([size, mtime] of the output file) and
+        # 'inputs' (list of [input file, digest]) keys; 'digests' maps
+        # absolute input file names to [size, mtime, digest]
+        self.outputs = None
+        self.digests = None
+        self.dirty = 0
+
+    def load(self):
+        if self.outputs is not None:
+            return
+        self.outputs = {}
+        self.digests = {}
+        try:
+            import json
+            f = open(self.filename)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), msg:
+            if DEBUG: print "  can't read build cache %s: %s" % \
+                            (self.filename, msg)
+            return
+        if isinstance(data, dict) and \
+           data.get('format') == BUILD_CACHE_FORMAT:
+            self.outputs = data['outputs']
+            self.digests = data['digests']
+
+    def save(self):
+        """Write the cache back to disk if it changed.  Failures are
+        ignored: they only cost a rebuild next time.
+        """
+        self.lock.acquire()
+        try:
+            if not self.dirty:
+                return
+            import json
+            try:
+                write_file_atomic(self.filename, json.dumps({
+                    'format': BUILD_CACHE_FORMAT,
+                    'outputs': self.outputs,
+                    'digests': self.digests}))
+                self.dirty = 0
+            except (IOError, OSError), msg:
+                if DEBUG: print "  can't write build cache %s: %s" % \
+                                (self.filename, msg)
+        finally:
+            self.lock.release()
+
+    def digest(self, filename):
+        """Return the content digest of 'filename', or None if it
+        doesn't exist.
+        """
+        st = self.stats.stat(filename)
+        if st is None:
+            return None
+        key = os.path.abspath(filename)
+        cached = self.digests.get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+            return cached[2]
+        digest = file_digest(filename)
+        self.digests[key] = [st.st_size, st.st_mtime, digest]
+        self.dirty = 1
+        return digest
+
+    def is_outdated(self, infiles, outfile, signature):
+        """Return true if 'outfile' has to be regenerated from 'infiles'
+        by the call identified by 'signature'.  Outputs not recorded yet
+        are checked by comparing timestamps, like 'newer_group()' does,
+        and recorded if they turn out to be up to date.
+        """
+        self.lock.acquire()
+        try:
+            self.load()
+            out = self.stats.stat(outfile)
+            if out is None:
+                return 1
+
+            entry = self.outputs.get(os.path.abspath(outfile))
+            if entry is None:
+                for st in self.stats.stat_many(infiles):
+                    if st is None or st.st_mtime > out.st_mtime:
+                        return 1
+                self.record(infiles, outfile, signature)
+                return 0
+
+            if entry['signature'] != signature or \
+               entry['output'] != [out.st_size, out.st_mtime] or \
+               [input for (input, digest) in entry['inputs']] != \
+               list(infiles):
+                return 1
+            for (input, digest) in entry['inputs']:
+                if self.digest(input) != digest:
+                    return 1
+            return 0
+        finally:
+            self.lock.release()
+
+    def record(self, infiles, outfile, signature):
+        """Record that 'outfile' was just generated from 'infiles' by the
+        call identified by 'signature'.
+        """
+        self.lock.acquire()
+        try:
+            self.load()
+            self.stats.invalidate(outfile)
+            out = self.stats.stat(outfile)
+            key = os.path.abspath(outfile)
+            if out is None:
+                if key in self.outputs:
+                    del self.outputs[key]
+                    self.dirty = 1
+                return
+            inputs = []
+            for input in infiles:
+                inputs.append([input, self.digest(input)])
+            self.outputs[key] = {'signature': signature,
+                                 'output': [out.st_size, out.st_mtime],
+                                 'inputs': inputs}
+            self.dirty = 1
+        finally:
+            self.lock.release()
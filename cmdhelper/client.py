@@ -0,0 +1,128 @@
+"""cmdhelper.client
+
+Thin client for the cmdhelper command server (see cmdhelper.server).
+
+The client forwards its command line, environment and working directory
+to a running server over a Unix socket and replays the output of the
+command, so that
+
+    python -m cmdhelper.client /path/to/socket some_utility.py cmd1 ...
+
+behaves like running "some_utility.py cmd1 ..." directly, minus the
+startup cost.  This module only needs the standard library.
+
+Protocol: the request is one frame holding a JSON object with 'argv',
+'env' and 'cwd' keys, followed by the client's stdin as STDIN frames, an
+empty one marking its end.  The server answers with a stream of frames,
+each tagged with a channel: STDOUT and STDERR carry output, EXIT carries
+the exit status as a decimal string and ends the conversation.
+"""
+
+import sys, os, socket, struct, threading
+
+STDIN = 'i'
+STDOUT = 'o'
+STDERR = 'e'
+EXIT = 'x'
+REQUEST = 'r'
+
+_header = struct.Struct('!cI')
+
+
+def send_frame(sock, channel, data):
+    """Send 'data' (a string) on 'channel' over the socket 'sock'."""
+    sock.sendall(_header.pack(channel, len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError("connection closed by peer")
+        chunks.append(chunk)
+        size = size - len(chunk)
+    return ''.join(chunks)
+
+
+def recv_frame(sock):
+    """Receive the next frame from 'sock'; return a (channel, data)
+    tuple.  Raises EOFError if the connection was closed.
+    """
+    (channel, size) = _header.unpack(_recv_exactly(sock, _header.size))
+    return channel, _recv_exactly(sock, size)
+
+
+def _forward_stdin(sock, stdin):
+    """Send what can be read from the file 'stdin' over 'sock' as STDIN
+    frames, then an empty one.
+    """
+    try:
+        while 1:
+            if hasattr(stdin, 'fileno'):
+                # whatever is available, not a whole buffer
+                data = os.read(stdin.fileno(), 65536)
+            else:
+                data = stdin.read(65536)
+            send_frame(sock, STDIN, data)
+            if not data:
+                break
+    except (socket.error, OSError, IOError):
+        # the command is over
+        pass
+
+
+def run_remote(socket_path, argv, env=None, cwd=None,
+               stdout=None, stderr=None, stdin=None):
+    """Run the command line 'argv' (argv[0] being the script name) on
+    the server listening on 'socket_path', feeding it 'stdin' and
+    writing its output to 'stdout' and 'stderr'.  Return the exit status
+    of the command.
+    """
+    import json
+
+    if env is None:
+        env = dict(os.environ)
+    if cwd is None:
+        cwd = os.getcwd()
+    if stdout is None:
+        stdout = sys.stdout
+    if stderr is None:
+        stderr = sys.stderr
+    if stdin is None:
+        stdin = sys.stdin
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        send_frame(sock, REQUEST, json.dumps({'argv': list(argv),
+                                              'env': env,
+                                              'cwd': cwd}))
+        feeder = threading.Thread(target=_forward_stdin, args=(sock, stdin))
+        feeder.setDaemon(1)
+        feeder.start()
+        while 1:
+            (channel, data) = recv_frame(sock)
+            if channel == STDOUT:
+                stdout.write(data)
+                stdout.flush()
+            elif channel == STDERR:
+                stderr.write(data)
+                stderr.flush()
+            elif channel == EXIT:
+                return int(data)
+    finally:
+        sock.close()
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) < 2:
+        sys.stderr.write("usage: python -m cmdhelper.client SOCKET "
+                         "script_name [args ...]\n")
+        return 2
+    return run_remote(args[0], args[1:])
+
+if __name__ == '__main__':
+    sys.exit(main())
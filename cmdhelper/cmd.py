@@ -9,10 +9,15 @@ down to contain only required by command-line utilities stuff.
 
 import sys, os, string, re
 from types import *
-from distutils import util, dir_util, file_util, archive_util, dep_util
 from distutils import log
 
 from cmdhelper.errors import *
+from cmdhelper.buildcache import BuildCache, make_signature, get_cache_file
+
+# Command classes mapped to the names of the CMDHelper attributes their
+# objects were found to delegate, see 'Command.__getattr__()'
+_delegated = {}
+
 
 class Command(object):
     """Abstract base class for defining command classes, the "worker bees"
@@ -45,6 +50,23 @@ class Command(object):
     # predicates can be unbound methods, so they must already have been
     # defined.  The canonical example is the "install" command.
     sub_commands = []
+
+    # 'depends_on' lists the names of the commands which must have been
+    # run before this command runs.  They are run automatically, and
+    # the --jobs global option never runs a command concurrently with
+    # its dependencies.
+    depends_on = []
+
+    # If 'parallel_sub_commands' is true and the --jobs global option
+    # allows it, the predicates of 'sub_commands' are evaluated and the
+    # applicable sub-commands are run (see 'run_sub_commands()') and
+    # reinitialized concurrently.
+    parallel_sub_commands = 0
+
+    # 'is_async' is true for commands whose 'run()' method returns a
+    # coroutine to be run on the CMDHelper's event loop (see
+    # cmdhelper.aiocmd.AsyncCommand)
+    is_async = 0
     
     # list of required options
     required_options = []
@@ -52,6 +74,10 @@ class Command(object):
     # boolean options
     boolean_options = []
 
+    # flags of the command line utility commands can override, see
+    # 'resolve_global_flags()'
+    global_flags = ('dry_run', 'verbose', 'force')
+
     def __init__(self, cmdutil, **kw):
         """Create and initialize a new Command object.  Most importantly,
         invokes the 'initialize_options()' method, which is the real
@@ -70,16 +96,13 @@ class Command(object):
         self.cmdutil = cmdutil
         self.initialize_options()
 
-        # Per-command versions of the global flags, so that the user can
-        # customize command line utility' behaviour command-by-command and
-        # let some commands fall back on the CMDHelper's behaviour.
-        # None means "not defined, check self.cmdutil's copy", while 0
-        # or 1 mean false and true (duh).  Note that this means figuring out
-        # the real value of each flag is a touch complicated -- hence
-        # "self._dry_run" will be handled by __getattr__, below.
-        # XXX This needs to be fixed.
-        self._dry_run = None
-
+        # Per-command versions of the global flags ('global_flags'), so
+        # that the user can customize command line utility' behaviour
+        # command-by-command and let some commands fall back on the
+        # CMDHelper's behaviour.  A flag which isn't set (or is None)
+        # when the command is finalized takes the value of
+        # self.cmdutil's copy, see 'resolve_global_flags()'.  Until then
+        # 'dry_run' is looked up on self.cmdutil by __getattr__.
         self.verbose = cmdutil.verbose
 
         # Some commands define a 'self.force' option to ignore file
@@ -97,18 +120,48 @@ class Command(object):
         # this flag: it is the business of 'ensure_finalized()', which
         # always calls 'finalize_options()', to respect/update it.
         self.finalized = 0
+
+        # 'build_cache' records the files generated by 'make_file()', see
+        # 'get_build_cache()'
+        self.build_cache = None
+
+        # 'journal' records the file operations of the command between
+        # 'begin_journal()' and 'commit_journal()', see cmdhelper.journal
+        self.journal = None
         
         for k,v in kw.items():
             setattr(self, k, v)
 
     def __getattr__(self, attr):
-        return getattr(self.cmdutil, attr)
+        # Names the objects of this class delegated before go straight to
+        # the CMDHelper; the class itself is left alone.
+        names = _delegated.get(self.__class__)
+        if names is not None and attr in names:
+            return getattr(self.cmdutil, attr)
+        if attr[:2] == '__' or attr == 'cmdutil':
+            raise AttributeError, attr
+        value = getattr(self.cmdutil, attr)
+        if names is None:
+            names = _delegated.setdefault(self.__class__, {})
+        names[attr] = 1
+        return value
 
     def ensure_finalized(self):
         if not self.finalized:
             self.finalize_options()
+            self.resolve_global_flags()
         self.finalized = 1
 
+    def resolve_global_flags(self):
+        """Give the global flags of 'global_flags' which aren't set for
+        this command the value they have for the command line utility,
+        as real attributes: the helpers check them on every call.
+        """
+        for flag in self.global_flags:
+            if self.__dict__.get(flag) is None and \
+               getattr(self.__class__, flag, None) is None:
+                self.__dict__[flag] = getattr(self.cmdutil, flag, None)
+
 
     # Subclasses must define:
     #   initialize_options()
@@ -258,12 +311,14 @@ class Command(object):
 
     def ensure_filename(self, option):
         """Ensure that 'option' is the name of an existing file."""
-        self._ensure_tested_string(option, os.path.isfile,
+        self._ensure_tested_string(option,
+                                   self.cmdutil.get_stat_cache().isfile,
                                    "filename",
                                    "'%s' does not exist or is not a file")
 
     def ensure_dirname(self, option):
-        self._ensure_tested_string(option, os.path.isdir,
+        self._ensure_tested_string(option,
+                                   self.cmdutil.get_stat_cache().isdir,
                                    "directory name",
                                    "'%s' does not exist or is not a directory")
 
@@ -331,62 +386,293 @@ class Command(object):
         a method that we call to determine if the subcommand needs to be
         run for the current command line utility. Return a list of command names.
         """
+        if not self.use_parallel_sub_commands():
+            commands = []
+            for (cmd_name, method) in self.sub_commands:
+                if method is None or method(self):
+                    commands.append(cmd_name)
+            return commands
+
+        from cmdhelper.parallel import run_all
+        def is_applicable(sub_command):
+            method = sub_command[1]
+            return method is None or method(self)
+        results = run_all(self.cmdutil.get_worker_pool(), is_applicable,
+                          self.sub_commands)
+        names = [cmd_name for (cmd_name, method) in self.sub_commands]
+        self.raise_sub_command_errors(names, results)
         commands = []
-        for (cmd_name, method) in self.sub_commands:
-            if method is None or method(self):
-                commands.append(cmd_name)
+        for i in range(len(names)):
+            if results[i][0]:
+                commands.append(names[i])
         return commands
 
+    def run_sub_commands(self):
+        """Run all the sub-commands returned by 'get_sub_commands()',
+        concurrently if 'parallel_sub_commands' is true and --jobs allows
+        it.  Failures of parallel sub-commands are reported together by a
+        single CMDHelperExecError.
+        """
+        commands = self.get_sub_commands()
+        if not self.use_parallel_sub_commands():
+            for cmd_name in commands:
+                self.run_command(cmd_name)
+            return
+
+        from cmdhelper.parallel import run_all
+        results = run_all(self.cmdutil.get_worker_pool(),
+                          self.cmdutil.run_command, commands)
+        self.raise_sub_command_errors(commands, results)
+
+    def use_parallel_sub_commands(self):
+        """Return true if sub-commands should be handled in parallel."""
+        return (self.parallel_sub_commands and
+                len(self.sub_commands) > 1 and
+                self.cmdutil.get_jobs() > 1)
+
+    def raise_sub_command_errors(self, names, results):
+        """Raise CMDHelperExecError listing the failures found in
+        'results', as returned by 'cmdhelper.parallel.run_all()' for the
+        sub-commands 'names'.  The list of '(name, exc_info)' tuples is
+        available as the 'failures' attribute of the exception.
+        """
+        failures = []
+        for i in range(len(names)):
+            exc_info = results[i][1]
+            if exc_info is not None:
+                failures.append((names[i], exc_info))
+        if not failures:
+            return
+
+        lines = ["%d sub-command(s) of '%s' failed:" %
+                 (len(failures), self.get_command_name())]
+        for (name, exc_info) in failures:
+            lines.append("  %s: %s: %s" % (name, exc_info[0].__name__,
+                                           exc_info[1]))
+        error = CMDHelperExecError(string.join(lines, "\n"))
+        error.failures = failures
+        raise error
+
 
     def warn(self, msg):
         sys.stderr.write("warning: %s: %s\n" %
                          (self.get_command_name(), msg))
 
 
+    # -- Journal -----------------------------------------------------
+    # While the journal is open, 'mkpath()', 'copy_file()', 'move_file()',
+    # 'execute()' and 'make_file()' record their operation and return it
+    # instead of acting.
+
+    def begin_journal(self):
+        """Start recording the file operations of this command; returns
+        the Journal.
+        """
+        from cmdhelper.journal import Journal
+        if self.journal is None:
+            self.journal = Journal(self.cmdutil.get_stat_cache())
+        return self.journal
+
+    def commit_journal(self):
+        """Stop recording and run the recorded operations in parallel
+        batches (see cmdhelper.journal) -- with dry-run, one by one, only
+        reporting what they would do.  The plan is appended to the
+        --plan-file file, if given.  Returns the Journal, or None if
+        there was none.
+        """
+        from cmdhelper.journal import DEFAULT_JOURNAL_THREADS
+        journal = self.journal
+        if journal is None:
+            return None
+        self.journal = None
+
+        plan_file = self.cmdutil.plan_file
+        if plan_file:
+            import json
+            line = json.dumps({'command': self.get_command_name(),
+                               'dry_run': bool(self.dry_run),
+                               'operations': journal.as_list()})
+            self.cmdutil.run_lock.acquire()
+            try:
+                f = open(plan_file, 'a')
+                try:
+                    f.write(line + '\n')
+                finally:
+                    f.close()
+            finally:
+                self.cmdutil.run_lock.release()
+
+        if self.dry_run:
+            journal.run(threads=1)
+        else:
+            journal.run(max(self.cmdutil.get_jobs(),
+                            DEFAULT_JOURNAL_THREADS))
+        return journal
+
     def execute(self, func, args, msg=None, level=1):
-        util.execute(func, args, msg, dry_run=self.dry_run)
+        if self.journal is not None:
+            from cmdhelper.journal import Operation
+            return self.journal.add(Operation(
+                'execute', self._execute, (func, args, msg, level),
+                barrier=1,
+                details={'function': getattr(func, '__name__', repr(func)),
+                         'args': map(repr, args), 'msg': msg}))
+        self._execute(func, args, msg, level)
+
+    def _execute(self, func, args, msg=None, level=1):
+        from distutils import util
+        try:
+            util.execute(func, args, msg, dry_run=self.dry_run)
+        finally:
+            self.forget_file_stats()
+
+    def forget_file_stats(self):
+        """Clear the StatCache of the run: called after running programs
+        or functions, which may have changed any file.
+        """
+        self.cmdutil.get_stat_cache().clear()
 
 
     def mkpath(self, name, mode=0777):
-        dir_util.mkpath(name, mode, dry_run=self.dry_run)
+        stats = self.cmdutil.get_stat_cache()
+        if stats.isdir(name):
+            return
+        if self.journal is not None:
+            from cmdhelper.journal import Operation
+            return self.journal.mkpath(Operation(
+                'mkpath', self._mkpath, (name, mode), writes=[name],
+                details={'mode': mode}))
+        self._mkpath(name, mode)
+
+    def _mkpath(self, name, mode=0777):
+        from distutils import dir_util
+        stats = self.cmdutil.get_stat_cache()
+        for created in dir_util.mkpath(name, mode, dry_run=self.dry_run):
+            stats.invalidate(created)
 
 
     def copy_file(self, infile, outfile,
                   preserve_mode=1, preserve_times=1, link=None, level=1):
         """Copy a file respecting verbose, dry-run and force flags."""
-
-        return file_util.copy_file(
+        if self.journal is not None:
+            from cmdhelper.journal import Operation
+            dst = outfile
+            if self.journal.isdir(outfile):
+                dst = os.path.join(outfile, os.path.basename(infile))
+            key = ('copy_file', os.path.abspath(infile),
+                   os.path.abspath(dst), preserve_mode, preserve_times, link)
+            return self.journal.add(Operation(
+                'copy_file', self._copy_file,
+                (infile, outfile, preserve_mode, preserve_times, link),
+                reads=[infile], writes=[dst], details={'link': link}),
+                key)
+        return self._copy_file(infile, outfile, preserve_mode,
+                               preserve_times, link)
+
+    def _copy_file(self, infile, outfile, preserve_mode=1, preserve_times=1,
+                   link=None):
+        from distutils import file_util
+        (dst, copied) = file_util.copy_file(
             infile, outfile,
             preserve_mode, preserve_times,
             not self.force,
             link,
             dry_run=self.dry_run)
+        if copied and not self.dry_run:
+            self.cmdutil.get_stat_cache().invalidate(dst)
+        return (dst, copied)
 
 
     def copy_tree(self, infile, outfile, preserve_mode=1,
                   preserve_times=1, preserve_symlinks=0, level=1):
         """Copy an entire directory tree respecting verbose, dry-run,
-        and force flags.
+        and force flags.  Files are copied by --jobs threads (at least
+        'DEFAULT_COPY_THREADS'); unless forced, files already copied
+        and unchanged since are skipped.
         """
-        return dir_util.copy_tree(
+        from cmdhelper.copytree import copy_tree, DEFAULT_COPY_THREADS
+        return copy_tree(
             infile, outfile,
             preserve_mode,preserve_times,preserve_symlinks,
             not self.force,
-            dry_run=self.dry_run)
+            dry_run=self.dry_run,
+            threads=max(self.cmdutil.get_jobs(), DEFAULT_COPY_THREADS),
+            stats=self.cmdutil.get_stat_cache())
 
     def move_file(self, src, dst, level=1):
         """Move a file respectin dry-run flag."""
-        return file_util.move_file(src, dst, dry_run = self.dry_run)
+        if self.journal is not None:
+            from cmdhelper.journal import Operation
+            target = dst
+            if self.journal.isdir(dst):
+                target = os.path.join(dst, os.path.basename(src))
+            return self.journal.add(Operation(
+                'move_file', self._move_file, (src, dst),
+                writes=[src, target]))
+        return self._move_file(src, dst)
+
+    def _move_file(self, src, dst):
+        from distutils import file_util
+        dst = file_util.move_file(src, dst, dry_run = self.dry_run)
+        if not self.dry_run:
+            stats = self.cmdutil.get_stat_cache()
+            stats.invalidate(src)
+            stats.invalidate(dst)
+        return dst
 
     def spawn(self, cmd, search_path=1, level=1):
         """Spawn an external command respecting dry-run flag."""
         from distutils.spawn import spawn
-        spawn(cmd, search_path, dry_run=self.dry_run)
+        try:
+            spawn(cmd, search_path, dry_run=self.dry_run)
+        finally:
+            self.forget_file_stats()
+
+    def spawn_many(self, cmds, search_path=1, capture=1, check=1,
+                   cwd=None, env=None):
+        """Run the argument lists 'cmds' respecting dry-run flag, up to
+        --jobs of them at a time.  Returns the list of
+        'cmdhelper.spawnpool.SpawnResult' of the programs, in the order
+        of 'cmds'; their output is captured if 'capture' is true.  If
+        'check' is true raises CMDHelperExecError if some program
+        failed, with the results available as its 'results' attribute.
+        """
+        from cmdhelper.spawnpool import SpawnPool
+        pool = SpawnPool(self.cmdutil.get_jobs(), capture, search_path,
+                         self.dry_run)
+        results = []
+        try:
+            for cmd in cmds:
+                log.info(string.join(cmd, ' '))
+                results.append(pool.submit(cmd, cwd, env))
+        finally:
+            pool.close()
+            self.forget_file_stats()
+
+        failures = filter(lambda result: result.failed(), results)
+        if check and failures:
+            lines = ["%d of %d command(s) failed:" %
+                     (len(failures), len(results))]
+            for result in failures:
+                lines.append("  " + result.describe())
+            error = CMDHelperExecError(string.join(lines, "\n"))
+            error.results = results
+            raise error
+        return results
 
     def make_archive(self, base_name, format,
-                     root_dir=None, base_dir=None):
-        return archive_util.make_archive(
-            base_name, format, root_dir, base_dir, dry_run=self.dry_run)
+                     root_dir=None, base_dir=None, fileobj=None):
+        """Create an archive respecting dry-run flag.  tar and zip
+        archives are streamed, to 'fileobj' if given, and compressed by
+        several threads; see cmdhelper.archive.
+        """
+        from cmdhelper.archive import make_archive
+        try:
+            return make_archive(
+                base_name, format, root_dir, base_dir, dry_run=self.dry_run,
+                fileobj=fileobj)
+        finally:
+            self.forget_file_stats()
 
 
     def make_file(self, infiles, outfile, func, args,
@@ -399,6 +685,24 @@ class Command(object):
         and it is true, then the command is unconditionally run -- does no
         timestamp checks.
         """
+        if self.journal is not None:
+            # whether 'outfile' is out of date is only known once the
+            # operations recorded before ran
+            from cmdhelper.journal import Operation
+            inputs = infiles
+            if type(infiles) is StringType:
+                inputs = [infiles]
+            return self.journal.add(Operation(
+                'make_file', self._make_file,
+                (infiles, outfile, func, args, exec_msg, skip_msg, level),
+                reads=inputs, writes=[outfile], barrier=1,
+                details={'output': outfile,
+                         'function': getattr(func, '__name__', repr(func))}))
+        self._make_file(infiles, outfile, func, args, exec_msg, skip_msg,
+                        level)
+
+    def _make_file(self, infiles, outfile, func, args,
+                   exec_msg=None, skip_msg=None, level=1):
         if exec_msg is None:
             exec_msg = "generating %s from %s" % \
                        (outfile, string.join(infiles, ', '))
@@ -416,9 +720,42 @@ class Command(object):
         # If 'outfile' must be regenerated (either because it doesn't
         # exist, is out-of-date, or the 'force' flag is true) then
         # perform the action that presumably regenerates it
-        if self.force or dep_util.newer_group (infiles, outfile):
-            self.execute(func, args, exec_msg, level)
+        build_cache = self.get_build_cache()
+        if build_cache is None:
+            outdated = self.cmdutil.get_stat_cache().newer_group(infiles,
+                                                                 outfile)
+        else:
+            signature = make_signature(func, args)
+            outdated = build_cache.is_outdated(infiles, outfile, signature)
+        if self.force or outdated:
+            self._execute(func, args, exec_msg, level)
+            if build_cache is not None and not self.dry_run:
+                build_cache.record(infiles, outfile, signature)
+            elif not self.dry_run:
+                self.cmdutil.get_stat_cache().invalidate(outfile)
 
         # Otherwise, print the "skip" message
         else:
             log.debug(skip_msg)
+
+    def get_build_cache(self):
+        """Return the BuildCache recording the files generated by this
+        command's 'make_file()' calls, or None if the build cache is
+        disabled (see 'CMDHelper.use_build_cache').
+        """
+        if self.build_cache is None:
+            cmdutil = self.cmdutil
+            cache_dir = cmdutil.get_build_cache_dir()
+            if cache_dir is None:
+                return None
+            self.build_cache = BuildCache(
+                get_cache_file(cache_dir, cmdutil.entry_point,
+                               cmdutil.get_project_dir(),
+                               self.get_command_name()),
+                cmdutil.get_stat_cache())
+        return self.build_cache
+
+    def save_build_cache(self):
+        """Write the build cache back to disk, if it was used."""
+        if self.build_cache is not None:
+            self.build_cache.save()
@@ -0,0 +1,381 @@
+"""cmdhelper.config
+
+Reading configuration files.
+
+Provides 'read_config_files()', used by 'CMDHelper.parse_config_files()'
+to turn a list of configuration files into option dictionaries,
+'environ_options()' reading options from environment variables and
+LazyCommandOptions, the mapping layering them all.
+
+Parsing a large configuration file with ConfigParser and normalizing
+its option names takes a measurable part of a short run, while a run
+typically needs the options of one or two commands.  Configuration
+files are therefore only split into sections up front; a section is
+parsed the first time its options are looked up.  The split files are
+stored as a snapshot when the utility sets CMDHelper.use_config_snapshots
+(see 'read_config_files()'): a marshal dump keyed by the name, size and
+modification time of every configuration file.  As long as none of the
+files changed, they are loaded back from the snapshot with a single
+read.  Snapshots are only readable by their owner, as the files they
+copy may hold credentials.
+"""
+
+import os, string, marshal
+from UserDict import DictMixin
+
+from cmdhelper.debug import DEBUG
+from cmdhelper.util import write_file_atomic
+
+# Bumped every time the layout of the snapshot files changes.
+CONFIG_SNAPSHOT_FORMAT = 2
+
+# Prefix of the environment variables setting command options, see
+# 'environ_options()'
+ENVIRON_PREFIX = 'CMDHELPER_'
+
+
+def split_config_file(filename):
+    """Split the configuration file 'filename' into sections, without
+    parsing them.  Returns a (sections, defaults) tuple: 'sections' maps
+    section names to their text, 'defaults' is the text of the DEFAULT
+    section (whose options ConfigParser adds to every section).  Returns
+    None if the file can't be read.
+    """
+    from ConfigParser import ConfigParser, DEFAULTSECT
+
+    try:
+        f = open(filename)
+    except IOError:
+        return None
+    try:
+        sections = {}
+        lines = None
+        for line in f:
+            # same test as ConfigParser: a header can't be indented, so
+            # this is never a continuation line
+            mo = ConfigParser.SECTCRE.match(line)
+            if mo:
+                lines = sections.get(mo.group('header'))
+                if lines is None:
+                    lines = sections[mo.group('header')] = []
+            elif lines is None:
+                if line.strip() == '' or line[0] in '#;' or \
+                   (line.split(None, 1)[0].lower() == 'rem' and
+                    line[0] in "rR"):
+                    continue
+                # let ConfigParser raise MissingSectionHeaderError
+                ConfigParser().read(filename)
+                continue
+            lines.append(line)
+    finally:
+        f.close()
+
+    for (section, lines) in sections.items():
+        sections[section] = string.join(lines, '')
+    defaults = sections.pop(DEFAULTSECT, '')
+    return (sections, defaults)
+
+
+def parse_section(filename, section, text, defaults):
+    """Parse 'text', the text of 'section' of the configuration file
+    'filename' ('defaults' is the text of its DEFAULT section), and
+    return the option dictionary of the section:
+      { option : (filename, value) }
+    Dashes in option names are replaced by underscores.
+    """
+    from ConfigParser import ConfigParser
+    from StringIO import StringIO
+
+    parser = ConfigParser()
+    parser.readfp(StringIO(defaults + text), filename)
+    opt_dict = {}
+    for opt in parser.options(section):
+        if opt != '__name__':
+            val = parser.get(section, opt)
+            opt = string.replace(opt, '-', '_')
+            opt_dict[opt] = (filename, val)
+    return opt_dict
+
+
+def compile_config_files(filenames):
+    """Split the configuration files 'filenames' into sections (see
+    'split_config_file()'), returning a list of (filename, sections,
+    defaults) tuples in the order of 'filenames'.  Files which can't be
+    read are skipped.
+    """
+    files = []
+    for filename in filenames:
+        if DEBUG: print "  reading", filename
+        split = split_config_file(filename)
+        if split is not None:
+            files.append((filename, split[0], split[1]))
+    return files
+
+
+class ConfigLayer(DictMixin):
+    """The options set by a list of configuration files, compiled by
+    'compile_config_files()': section names mapped to option
+    dictionaries, in the format of 'parse_section()'.  Sections set by
+    several files are merged, later files taking precedence.  A section
+    is parsed when it is first looked up.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.parsed = {}
+
+    def __getitem__(self, section):
+        try:
+            return self.parsed[section]
+        except KeyError:
+            pass
+        opt_dict = None
+        for (filename, sections, defaults) in self.files:
+            text = sections.get(section)
+            if text is not None:
+                if opt_dict is None:
+                    opt_dict = {}
+                opt_dict.update(parse_section(filename, section, text,
+                                              defaults))
+        if opt_dict is None:
+            raise KeyError(section)
+        self.parsed[section] = opt_dict
+        return opt_dict
+
+    def __setitem__(self, section, opt_dict):
+        raise TypeError, "configuration layers are read-only"
+
+    def __delitem__(self, section):
+        raise TypeError, "configuration layers are read-only"
+
+    def __contains__(self, section):
+        for (filename, sections, defaults) in self.files:
+            if section in sections:
+                return 1
+        return 0
+
+    has_key = __contains__
+
+    def keys(self):
+        keys = {}
+        for (filename, sections, defaults) in self.files:
+            keys.update(dict.fromkeys(sections))
+        return keys.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+def get_snapshot_key(filenames, stats=None):
+    """Return the list of (filename, size, mtime) tuples identifying the
+    current contents of 'filenames'; missing files have a size and
+    modification time of None.  Files are stat-ed through the StatCache
+    'stats' if given.
+    """
+    key = []
+    for filename in filenames:
+        if stats is not None:
+            st = stats.stat(filename)
+        else:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                st = None
+        if st is not None:
+            key.append((filename, st.st_size, st.st_mtime))
+        else:
+            key.append((filename, None, None))
+    return key
+
+
+def get_snapshot_file(cache_dir, filenames):
+    """Return the name of the snapshot of 'filenames' in 'cache_dir'."""
+    try:
+        from hashlib import md5
+    except ImportError:
+        from md5 import new as md5
+    paths = map(os.path.abspath, filenames)
+    name = md5(string.join(paths, '\0')).hexdigest()
+    return os.path.join(cache_dir, name + '.snapshot')
+
+
+def read_config_files(filenames, cache_dir=None, stats=None):
+    """Return the ConfigLayer of the configuration files 'filenames'.
+    If 'cache_dir' is given, the compiled files are taken from (or
+    stored to) a snapshot in that directory; 'stats' is the StatCache
+    used to check the files.
+    """
+    if not cache_dir or not filenames:
+        return ConfigLayer(compile_config_files(filenames))
+
+    key = get_snapshot_key(filenames, stats)
+    snapshot_file = get_snapshot_file(cache_dir, filenames)
+    try:
+        f = open(snapshot_file, 'rb')
+        try:
+            data = marshal.loads(f.read())
+        finally:
+            f.close()
+        format, snapshot_key, files = data
+        if format == CONFIG_SNAPSHOT_FORMAT and snapshot_key == key:
+            if DEBUG: print "  using snapshot", snapshot_file
+            return ConfigLayer(files)
+    except (IOError, EOFError, ValueError, TypeError):
+        # no snapshot yet or unreadable one: it gets rewritten below
+        pass
+
+    files = compile_config_files(filenames)
+    try:
+        write_file_atomic(snapshot_file, marshal.dumps(
+            (CONFIG_SNAPSHOT_FORMAT, key, files)), 0600)
+    except (IOError, OSError), msg:
+        if DEBUG: print "  can't write config snapshot %s: %s" % \
+                        (snapshot_file, msg)
+    return ConfigLayer(files)
+
+
+def get_environ_name(command):
+    """Return the <COMMAND> part of the environment variables setting the
+    options of 'command': its name in upper case, dashes replaced by
+    underscores.
+    """
+    return string.replace(string.upper(command), '-', '_')
+
+
+def environ_options(environ=None, commands=None):
+    """Return the options set by the environment variables of 'environ'
+    (defaults to os.environ): command names mapped to option
+    dictionaries, in the format of 'parse_section()'.
+    The variable CMDHELPER_<COMMAND>__<OPTION> sets the option <option>
+    of the command <command>, eg. CMDHELPER_GLOBAL__DRY_RUN=1.
+    'commands' is a function returning the names of the commands known:
+    <COMMAND> is matched against them (see 'get_environ_name()'), so
+    commands whose name has capitals or dashes can be set too.  Other
+    names are taken in lower case.
+    """
+    if environ is None:
+        environ = os.environ
+    options = {}
+    known = None
+    for (name, value) in environ.items():
+        if not name.startswith(ENVIRON_PREFIX):
+            continue
+        section, sep, opt = name[len(ENVIRON_PREFIX):].partition('__')
+        if not (section and sep and opt):
+            # not an option, eg. CMDHELPER_CACHE_DIR
+            continue
+        if known is None:
+            known = {}
+            if commands is not None:
+                for command in commands():
+                    known.setdefault(get_environ_name(command),
+                                     []).append(command)
+        opt = string.lower(opt)
+        for command in known.get(string.upper(section),
+                                 [string.lower(section)]):
+            opt_dict = options.get(command)
+            if opt_dict is None:
+                opt_dict = options[command] = {}
+            opt_dict[opt] = ('$' + name, value)
+    return options
+
+
+class LazyCommandOptions(DictMixin):
+    """The 'command_options' mapping of CMDHelper: command names mapped
+    to option dictionaries.
+
+    Options read from configuration files and the environment are added
+    as layers (see 'add_layer()'): mappings of command names to option
+    dictionaries, such as ConfigLayer.  The option dictionary of a
+    command is merged from the layers only when it is first looked up,
+    so the options of commands which are never run are never parsed.
+    The layers are shared with copies of the mapping and never changed:
+    deleting a section only hides it from the layers added so far.
+    """
+
+    def __init__(self):
+        # option dictionaries merged so far, and the layers to merge
+        # the others from, lowest priority first
+        self.sections = {}
+        self.layers = []
+        # deleted sections mapped to the number of layers they hide
+        self.deleted = {}
+
+    def add_layer(self, options):
+        """Add the options 'options', which take precedence over all the
+        options known so far.  The mapping takes ownership of 'options'.
+        """
+        for (section, opt_dict) in self.sections.items():
+            if section in options:
+                opt_dict.update(options[section])
+        self.layers.append(options)
+
+    def copy(self):
+        """Return a copy of the mapping sharing its layers: the option
+        dictionaries merged so far are copied, the others get merged
+        from the layers -- whose sections are already parsed -- on first
+        use.
+        """
+        options = LazyCommandOptions()
+        for (section, opt_dict) in self.sections.items():
+            options.sections[section] = opt_dict.copy()
+        options.layers = list(self.layers)
+        options.deleted = self.deleted.copy()
+        return options
+
+    def _get_layers(self, section):
+        """Return the layers 'section' may be merged from."""
+        return self.layers[self.deleted.get(section, 0):]
+
+    def __getitem__(self, section):
+        try:
+            return self.sections[section]
+        except KeyError:
+            pass
+        opt_dict = None
+        for layer in self._get_layers(section):
+            if section in layer:
+                if opt_dict is None:
+                    opt_dict = {}
+                opt_dict.update(layer[section])
+        if opt_dict is None:
+            raise KeyError(section)
+        self.sections[section] = opt_dict
+        return opt_dict
+
+    def __setitem__(self, section, opt_dict):
+        self.sections[section] = opt_dict
+
+    def __delitem__(self, section):
+        if section not in self:
+            raise KeyError(section)
+        if section in self.sections:
+            del self.sections[section]
+        self.deleted[section] = len(self.layers)
+
+    def __contains__(self, section):
+        if section in self.sections:
+            return 1
+        for layer in self._get_layers(section):
+            if section in layer:
+                return 1
+        return 0
+
+    has_key = __contains__
+
+    def keys(self):
+        keys = dict.fromkeys(self.sections)
+        for i in range(len(self.layers)):
+            for section in self.layers[i].keys():
+                if i >= self.deleted.get(section, 0):
+                    keys[section] = None
+        return keys.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,296 @@
+"""cmdhelper.copytree
+
+Provides 'copy_tree()', the engine behind 'Command.copy_tree()'.
+
+'distutils.dir_util.copy_tree()' copies one file at a time through a
+16k Python buffer.  This version walks the source tree once, then
+checks and copies the files on a pool of threads.  File contents are
+copied by the kernel when it knows how to -- a reflink (FICLONE) on
+filesystems supporting copy-on-write clones, 'copy_file_range()' or
+'sendfile()' -- and through a large buffer otherwise.
+
+When not forced, files whose destination has the same size and is at
+least as new as the source are left alone, so copying a tree over a
+previous copy of itself only copies what changed.
+"""
+
+import sys, os, errno, shutil
+from stat import S_IMODE, S_ISREG
+from distutils import dir_util, log
+from distutils.errors import DistutilsFileError
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+copy_file_range = getattr(os, 'copy_file_range', None)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cmdhelper.parallel import WorkerPool
+from cmdhelper.fscache import StatCache
+
+# number of copying threads used when --jobs doesn't ask for more
+DEFAULT_COPY_THREADS = 8
+
+# buffer size of the fallback read/write loop
+BUFFER_SIZE = 1024 * 1024
+
+# _IOW(0x94, 9, int): clone a whole file on btrfs, xfs, ...
+FICLONE = 0x40049409
+
+# errno values meaning "this way of copying doesn't work here"
+UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.ENOTTY,
+               getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+               getattr(errno, 'ENOTSUP', errno.EINVAL))
+
+# copy methods the running kernel doesn't implement
+_unsupported = {}
+
+
+def _list_dir(dirname):
+    """Return the list of (name, is_symlink, is_dir) tuples describing
+    the entries of 'dirname', in 'os.listdir()' order.  'is_dir' follows
+    symbolic links.
+    """
+    if scandir is not None:
+        entries = []
+        for entry in scandir(dirname):
+            entries.append((entry.name, entry.is_symlink(), entry.is_dir()))
+        return entries
+    entries = []
+    for name in os.listdir(dirname):
+        path = os.path.join(dirname, name)
+        entries.append((name, os.path.islink(path), os.path.isdir(path)))
+    return entries
+
+
+def _clone(fsrc, fdst, size):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return 0
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    return 1
+
+
+def _copy_file_range(fsrc, fdst, size):
+    if copy_file_range is None:
+        return 0
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    while copied < size:
+        count = copy_file_range(src_fd, dst_fd, size - copied)
+        if not count:
+            break
+        copied = copied + count
+    return 1
+
+
+def _sendfile(fsrc, fdst, size):
+    if sendfile is None:
+        return 0
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    while copied < size:
+        count = sendfile(dst_fd, src_fd, copied, size - copied)
+        if not count:
+            break
+        copied = copied + count
+    return 1
+
+_copy_methods = (_clone, _copy_file_range, _sendfile)
+
+
+def copy_file_contents(src, dst, size):
+    """Copy the contents of the file 'src' ('size' bytes long) to 'dst',
+    replacing it.  Raises DistutilsFileError on failure, with the same
+    messages as 'distutils.file_util.copy_file()'.
+    """
+    try:
+        fsrc = open(src, 'rb')
+    except (IOError, OSError), e:
+        raise DistutilsFileError("could not open '%s': %s" % (src, e.strerror))
+    try:
+        if os.path.lexists(dst):
+            try:
+                os.unlink(dst)
+            except OSError, e:
+                raise DistutilsFileError(
+                      "could not delete '%s': %s" % (dst, e.strerror))
+        try:
+            fdst = open(dst, 'wb')
+        except (IOError, OSError), e:
+            raise DistutilsFileError(
+                  "could not create '%s': %s" % (dst, e.strerror))
+        try:
+            for method in _copy_methods:
+                if method in _unsupported:
+                    continue
+                try:
+                    if method(fsrc, fdst, size):
+                        return
+                except (IOError, OSError), e:
+                    if e.errno not in UNSUPPORTED:
+                        raise DistutilsFileError(
+                              "could not copy '%s' to '%s': %s" %
+                              (src, dst, e.strerror))
+                    if e.errno == errno.ENOSYS:
+                        _unsupported[method] = 1
+                    # nothing was written: start over with the next method
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+            try:
+                shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+            except (IOError, OSError), e:
+                raise DistutilsFileError(
+                      "could not copy '%s' to '%s': %s" %
+                      (src, dst, e.strerror))
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+
+def _sync_file(src, dst, preserve_mode, preserve_times, update, dry_run,
+               stats):
+    """Copy the file 'src' to 'dst' unless 'update' is true and 'dst' is
+    up to date, according to the StatCache 'stats'.  Returns true if the
+    file was copied (or would have been, if 'dry_run' is true).
+    """
+    st = stats.stat(src)
+    if st is None or not S_ISREG(st.st_mode):
+        raise DistutilsFileError(
+              "can't copy '%s': doesn't exist or not a regular file" % src)
+    if update:
+        dst_st = stats.stat(dst)
+        # whole seconds, like distutils.dep_util.newer() and the times
+        # set by copy_file()
+        if dst_st is not None and dst_st.st_size == st.st_size and \
+           int(dst_st.st_mtime) >= int(st.st_mtime):
+            return 0
+    if dry_run:
+        return 1
+
+    try:
+        copy_file_contents(src, dst, st.st_size)
+        # utime() before chmod(), like copy_file() does
+        if preserve_times:
+            os.utime(dst, (int(st.st_atime), int(st.st_mtime)))
+        if preserve_mode:
+            os.chmod(dst, S_IMODE(st.st_mode))
+    finally:
+        stats.invalidate(dst)
+    return 1
+
+
+def copy_tree(src, dst, preserve_mode=1, preserve_times=1,
+              preserve_symlinks=0, update=0, verbose=1, dry_run=0,
+              threads=DEFAULT_COPY_THREADS, stats=None):
+    """Copy the directory tree 'src' to 'dst' using 'threads' copying
+    threads.  Arguments and return value are those of
+    'distutils.dir_util.copy_tree()': the list of the files of 'dst'
+    which were (or would have been) copied or are up to date.
+
+    If 'update' is true a file is copied only if its destination
+    doesn't exist, has a different size or is older than the source.
+    Files are stat-ed through the StatCache 'stats', if given.
+    """
+    if stats is None:
+        stats = StatCache()
+    if not dry_run and not stats.isdir(src):
+        raise DistutilsFileError, \
+              "cannot copy tree '%s': not a directory" % src
+
+    # walk the tree creating directories and symbolic links; files are
+    # collected and copied afterwards
+    files = []
+    outputs = _walk(src, dst, files, preserve_symlinks, verbose, dry_run,
+                    stats)
+    if not files:
+        return outputs
+
+    pool = WorkerPool(min(threads, len(files)))
+    try:
+        jobs = []
+        for (src_name, dst_name) in files:
+            jobs.append(pool.submit(_sync_file, src_name, dst_name,
+                                    preserve_mode, preserve_times, update,
+                                    dry_run, stats))
+        try:
+            # log in walk order, as the copies complete
+            for (job, (src_name, dst_name)) in zip(jobs, files):
+                if job.get():
+                    if verbose >= 1:
+                        log.info("copying %s -> %s",
+                                 src_name, os.path.dirname(dst_name))
+                elif verbose >= 1:
+                    log.debug("not copying %s (output up-to-date)", src_name)
+        except:
+            # let the other copies finish before reporting the failure
+            exc_info = sys.exc_info()
+            pool.wait(jobs)
+            raise exc_info[0], exc_info[1], exc_info[2]
+    finally:
+        pool.close()
+    return outputs
+
+
+def _walk(src, dst, files, preserve_symlinks, verbose, dry_run, stats):
+    """Create the directory 'dst' and the symbolic links it must contain
+    and add the (source, destination) pairs of the files to copy to
+    'files', recursively.  Return the list of output files.
+    """
+    try:
+        entries = _list_dir(src)
+    except OSError, e:
+        if dry_run:
+            entries = []
+        else:
+            raise DistutilsFileError, \
+                  "error listing files in '%s': %s" % (src, e.strerror)
+    if not dry_run and not stats.isdir(dst):
+        for created in dir_util.mkpath(dst, verbose=verbose):
+            stats.invalidate(created)
+
+    outputs = []
+    for (name, is_symlink, is_dir) in entries:
+        src_name = os.path.join(src, name)
+        dst_name = os.path.join(dst, name)
+
+        if name.startswith('.nfs'):
+            # skip NFS rename files
+            continue
+
+        if preserve_symlinks and is_symlink:
+            link_dest = os.readlink(src_name)
+            if verbose >= 1:
+                log.info("linking %s -> %s", dst_name, link_dest)
+            if not dry_run:
+                os.symlink(link_dest, dst_name)
+                stats.invalidate(dst_name)
+            outputs.append(dst_name)
+
+        elif is_dir:
+            outputs.extend(_walk(src_name, dst_name, files,
+                                 preserve_symlinks, verbose, dry_run,
+                                 stats))
+        else:
+            files.append((src_name, dst_name))
+            outputs.append(dst_name)
+
+    return outputs
@@ -0,0 +1,208 @@
+"""cmdhelper.discovery
+
+Provides the entry point discovery backends used by the command
+registry (see cmdhelper.registry) to find commands.
+
+Two backends are available:
+
+  pkg_resources
+    the classic setuptools way; builds the whole working set, which
+    makes importing it rather slow
+  metadata
+    built on importlib.metadata (or its 'importlib_metadata' backport);
+    reads only the entry_points.txt files of installed distributions
+
+Which one is used is decided by the 'discovery' option of CMDHelper or
+the CMDHELPER_DISCOVERY environment variable, "auto" (the default)
+prefers 'metadata' when it is available.  Neither backend imports
+setuptools unless some egg has to be installed to satisfy the extras of
+a command.
+"""
+
+import os, re
+
+from cmdhelper.errors import *
+from cmdhelper.manifest import MANIFEST_NAME, parse_manifest, merge_manifest
+
+# Parses the "module:attrs [extras]" value of an entry point.
+entry_point_re = re.compile(r'^\s*(?P<module>[\w.]+)\s*'
+                            r'(?::\s*(?P<attrs>[\w.]+))?\s*'
+                            r'(?:\[(?P<extras>[^\]]*)\])?\s*$')
+
+# Parses a requirement from distribution metadata ('Requires-Dist'),
+# eg. "foo (>=1.0) ; extra == 'bar'".
+requirement_re = re.compile(r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)'
+                            r'[^;]*(?:;\s*(?P<marker>.*))?$')
+extra_marker_re = re.compile(r'''extra\s*==\s*['"]([^'"]+)['"]''')
+
+
+def make_record(module, attrs, extras, dist):
+    """Return a command record as stored by CommandRegistry."""
+    return {'module': module,
+            'attrs': list(attrs),
+            'extras': list(extras),
+            'dist': dist}
+
+
+class PkgResourcesDiscovery(object):
+    """Finds entry points through pkg_resources."""
+
+    name = 'pkg_resources'
+
+    def scan(self, group):
+        """Return the dictionary mapping the names of the entry points
+        in 'group' to command records.  The first entry point registered
+        for a name wins.  Records are completed with the metadata found
+        in command manifests (see cmdhelper.manifest).
+        """
+        import pkg_resources
+
+        commands = {}
+        dists = {}
+        for ep in pkg_resources.iter_entry_points(group):
+            if ep.name in commands:
+                continue
+            if ep.dist is not None:
+                dist = ep.dist.project_name
+                dists[dist] = ep.dist
+            else:
+                dist = None
+            commands[ep.name] = make_record(ep.module_name, ep.attrs,
+                                            ep.extras, dist)
+
+        for (name, dist) in dists.items():
+            if dist.has_metadata(MANIFEST_NAME):
+                manifest = parse_manifest(dist.get_metadata(MANIFEST_NAME))
+                merge_manifest(commands, manifest, group, name)
+        return commands
+
+    def require(self, group, command, record):
+        """Make sure the extras required by 'command' are installed,
+        installing missing eggs if needed.
+        """
+        import pkg_resources
+        from setuptools.dist import Distribution
+        dist = Distribution()
+        for ep in pkg_resources.iter_entry_points(group, command):
+            ep.require(installer=dist.fetch_build_egg)
+            return
+        raise CMDHelperModuleError("invalid command '%s'" % command)
+
+
+class MetadataDiscovery(object):
+    """Finds entry points through importlib.metadata."""
+
+    name = 'metadata'
+
+    def __init__(self):
+        try:
+            from importlib import metadata
+        except ImportError:
+            try:
+                import importlib_metadata as metadata
+            except ImportError:
+                raise CMDHelperModuleError, \
+                      "'metadata' discovery requires importlib.metadata " \
+                      "or the importlib_metadata package"
+        self.metadata = metadata
+
+    def scan(self, group):
+        """Return the dictionary mapping the names of the entry points
+        in 'group' to command records.  The first entry point registered
+        for a name wins.  Records are completed with the metadata found
+        in command manifests (see cmdhelper.manifest).
+        """
+        commands = {}
+        seen = {}
+        for dist in self.metadata.distributions():
+            dist_name = dist.metadata['Name']
+            # the same distribution may be found on several sys.path
+            # entries, only the first one is importable
+            if dist_name in seen:
+                continue
+            seen[dist_name] = 1
+            found = 0
+            for ep in dist.entry_points:
+                if ep.group != group or ep.name in commands:
+                    continue
+                match = entry_point_re.match(ep.value)
+                if match is None:
+                    raise CMDHelperModuleError, \
+                          "invalid entry point '%s = %s' in %s" % \
+                          (ep.name, ep.value, dist_name)
+                attrs = match.group('attrs') or ''
+                extras = match.group('extras') or ''
+                commands[ep.name] = make_record(
+                    match.group('module'),
+                    filter(None, attrs.split('.')),
+                    filter(None, [e.strip() for e in extras.split(',')]),
+                    dist_name)
+                found = 1
+
+            if found:
+                manifest = dist.read_text(MANIFEST_NAME)
+                if manifest:
+                    merge_manifest(commands, parse_manifest(manifest),
+                                   group, dist_name)
+        return commands
+
+    def require(self, group, command, record):
+        """Make sure the extras required by 'command' are installed.
+        Only if some of them are missing do we hand over to
+        pkg_resources and setuptools to install them.
+        """
+        if self.get_missing(record):
+            PkgResourcesDiscovery().require(group, command, record)
+
+    def get_missing(self, record):
+        """Return the list of the distributions required by the extras
+        of 'record' that are not installed.  Versions are not checked.
+        """
+        try:
+            requires = self.metadata.distribution(record['dist']).requires
+        except Exception:
+            return []
+        missing = []
+        for requirement in requires or ():
+            match = requirement_re.match(requirement)
+            if match is None or not match.group('marker'):
+                continue
+            extras = extra_marker_re.findall(match.group('marker'))
+            for extra in extras:
+                if extra in record['extras']:
+                    break
+            else:
+                continue
+            try:
+                self.metadata.distribution(match.group('name'))
+            except self.metadata.PackageNotFoundError:
+                missing.append(match.group('name'))
+        return missing
+
+
+discovery_backends = {
+    PkgResourcesDiscovery.name: PkgResourcesDiscovery,
+    MetadataDiscovery.name: MetadataDiscovery,
+}
+
+
+def get_discovery(name=None):
+    """Return an instance of the discovery backend called 'name'.  If
+    'name' is None it is taken from the CMDHELPER_DISCOVERY environment
+    variable, "auto" picks 'metadata' if importlib.metadata is available
+    and 'pkg_resources' otherwise.
+    """
+    if name is None:
+        name = os.environ.get('CMDHELPER_DISCOVERY') or 'auto'
+    if name == 'auto':
+        try:
+            return MetadataDiscovery()
+        except CMDHelperModuleError:
+            return PkgResourcesDiscovery()
+    try:
+        klass = discovery_backends[name]
+    except KeyError:
+        raise CMDHelperOptionError, \
+              "unknown discovery backend '%s' (expected one of: %s)" % \
+              (name, ', '.join(['auto'] + sorted(discovery_backends)))
+    return klass()
@@ -0,0 +1,156 @@
+"""cmdhelper.fscache
+
+Filesystem metadata caching.
+
+Provides the StatCache class: a cache of 'os.stat()' results living for
+the duration of a single run of a command line utility (see
+'CMDHelper.get_stat_cache()'), so that the same path is stat-ed only
+once no matter how many Command helpers look at it.
+
+Only the metadata of existing paths is cached: a missing path is stat-ed
+again every time it is looked up, since it may have been created
+meanwhile.  The file helpers of Command ('copy_file()', 'move_file()',
+'mkpath()', 'copy_tree()', 'make_file()') invalidate the paths they
+write; the helpers running programs or arbitrary functions ('spawn()',
+'spawn_many()', 'execute()', ...) clear the whole cache, as does the
+start of every command.  Changes made any other way (eg. files written
+with 'open()') must be reported with 'StatCache.invalidate()'.
+On slow (eg. network) filesystems, the metadata of many paths can be
+fetched ahead of time by a pool of threads with 'StatCache.prefetch()'.
+"""
+
+import os, errno, threading
+from stat import S_ISREG, S_ISDIR, ST_MTIME
+
+# number of threads used by 'StatCache.prefetch()'
+DEFAULT_PREFETCH_THREADS = 8
+
+# below this number of paths to stat, 'StatCache.prefetch()' doesn't
+# bother starting threads
+PREFETCH_MIN_PATHS = 16
+
+
+class StatCache(object):
+    """Caches the results of 'os.stat()' for the paths which exist.
+    Paths are normalized, so that "./a/b" and "a/b" share their entry.
+    Entries must be invalidated when the corresponding path changes.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def stat(self, path):
+        """Return the os.stat() result for 'path', or None if it doesn't
+        exist.
+        """
+        path = os.path.normpath(path)
+        try:
+            return self.stats[path]
+        except KeyError:
+            pass
+        try:
+            result = os.stat(path)
+        except OSError:
+            # not cached: it may be created before the next lookup
+            return None
+        self.stats[path] = result
+        return result
+
+    def stat_many(self, paths):
+        """Return the list of 'stat()' results for 'paths'."""
+        self.prefetch(paths)
+        return map(self.stat, paths)
+
+    def prefetch(self, paths, threads=DEFAULT_PREFETCH_THREADS):
+        """Stat the paths of 'paths' which aren't cached yet, on up to
+        'threads' threads.
+        """
+        missing = {}
+        for path in paths:
+            path = os.path.normpath(path)
+            if path not in self.stats:
+                missing[path] = 1
+        missing = missing.keys()
+        if len(missing) < PREFETCH_MIN_PATHS or threads < 2:
+            map(self.stat, missing)
+            return
+
+        from cmdhelper.parallel import WorkerPool
+        pool = WorkerPool(min(threads, len(missing)))
+        try:
+            pool.wait([pool.submit(self.stat, path) for path in missing])
+        finally:
+            pool.close()
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and S_ISREG(st.st_mode)
+
+    def isdir(self, path):
+        st = self.stat(path)
+        return st is not None and S_ISDIR(st.st_mode)
+
+    def newer_group(self, sources, target, missing='error'):
+        """Same as 'distutils.dep_util.newer_group()', going through the
+        cache: return true if 'target' is missing or older than any file
+        of 'sources'.  'missing' tells what to do with missing sources:
+        "error" raises OSError, "ignore" skips them and "newer" makes
+        'target' out of date.
+        """
+        target_st = self.stat(target)
+        if target_st is None:
+            return 1
+        target_mtime = target_st[ST_MTIME]
+        for (source, st) in zip(sources, self.stat_many(sources)):
+            if st is None:
+                if missing == 'ignore':
+                    continue
+                elif missing == 'newer':
+                    return 1
+                raise OSError(errno.ENOENT, os.strerror(errno.ENOENT),
+                              source)
+            # whole seconds, like dep_util
+            if st[ST_MTIME] > target_mtime:
+                return 1
+        return 0
+
+    def invalidate(self, path):
+        """Forget what we know about 'path' and its parent directory,
+        which changes when 'path' is created or removed.
+        """
+        path = os.path.normpath(path)
+        parent = os.path.dirname(path) or os.curdir
+        self.lock.acquire()
+        try:
+            for name in (path, parent):
+                if name in self.stats:
+                    del self.stats[name]
+        finally:
+            self.lock.release()
+
+    def invalidate_tree(self, path):
+        """Forget what we know about 'path', everything below it and its
+        parent directory.
+        """
+        path = os.path.normpath(path)
+        prefix = os.path.join(path, '')
+        self.lock.acquire()
+        try:
+            for name in self.stats.keys():
+                if name.startswith(prefix):
+                    del self.stats[name]
+        finally:
+            self.lock.release()
+        self.invalidate(path)
+
+    def clear(self):
+        """Forget everything."""
+        self.lock.acquire()
+        try:
+            self.stats.clear()
+        finally:
+            self.lock.release()
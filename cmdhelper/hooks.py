@@ -0,0 +1,175 @@
+"""cmdhelper.hooks
+
+Observing the commands run by a command line utility.
+
+Provides the HookRegistry class: CMDHelper reports the progress of
+every command it runs (see 'CMDHelper.run_command()') to the hooks
+registered with it, as HookEvents:
+
+  before_finalize
+    the command object was created, 'finalize_options()' is next
+  before_run
+    the options are finalized, 'run()' is next
+  after_run
+    'run()' returned
+  on_error
+    'finalize_options()' or 'run()' raised an exception
+
+A hook is any object with methods named after (some of) the events,
+each taking the HookEvent.  Hooks are registered with
+'HookRegistry.register()' or through the 'cmdhelper.hooks' entry point
+group, whose entry points name callables returning a hook when called
+with the CMDHelper instance, eg.
+
+    entry_points={'cmdhelper.hooks': ['metrics = mymetrics:MetricsHook']}
+
+The hook entry points are found along with the commands, and cached
+with them, by the CommandRegistry of the utility.  When no hook is
+registered, reporting an event costs a single attribute check.
+
+JSONLinesExporter, the hook behind the --trace-file global option,
+appends the events to a file as JSON lines.
+"""
+
+import time, threading
+from distutils import log
+
+from cmdhelper.timings import get_cpu_time, get_max_rss
+
+# entry point group hooks are discovered from by default
+HOOKS_GROUP = 'cmdhelper.hooks'
+
+# names of the events, in the order they happen
+EVENTS = ('before_finalize', 'before_run', 'after_run', 'on_error')
+
+
+class HookEvent(object):
+    """Describes the 'event' (one of EVENTS) of the command 'command'.
+
+    'options' maps the command's options to their source (a file name,
+    "command line", ...); 'time' is when the event happened.  'duration',
+    'cpu' (CPU time of the process) and 'max_rss' (peak memory of the
+    process in kilobytes) measure the command since it started being
+    run, including the creation of the command object; they are None
+    for 'before_finalize'.  'error' is the exc_info tuple of the
+    exception of an 'on_error' event.
+    """
+
+    def __init__(self, event, command, options, started=None,
+                 cpu_started=None, error=None):
+        self.event = event
+        self.command = command
+        self.options = options
+        self.time = time.time()
+        self.duration = self.cpu = self.max_rss = None
+        if started is not None:
+            self.duration = self.time - started
+            self.cpu = get_cpu_time() - cpu_started
+            self.max_rss = get_max_rss()
+        self.error = error
+
+    def as_dict(self):
+        """Return the event as a dictionary of JSON-friendly values."""
+        data = {'event': self.event, 'command': self.command,
+                'options': self.options, 'time': self.time,
+                'duration': self.duration, 'cpu': self.cpu,
+                'max_rss': self.max_rss, 'error': None}
+        if self.error is not None:
+            data['error'] = '%s: %s' % (self.error[0].__name__,
+                                        self.error[1])
+        return data
+
+
+class HookRegistry(object):
+    """The hooks registered with a CMDHelper.  'active' is true as soon
+    as some hook handles some event.
+    """
+
+    def __init__(self):
+        self.hooks = []
+        self.handlers = {}
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def register(self, hook):
+        """Register 'hook', an object with methods named after events."""
+        self.lock.acquire()
+        try:
+            self.hooks.append(hook)
+            for event in EVENTS:
+                handler = getattr(hook, event, None)
+                if handler is not None:
+                    self.handlers.setdefault(event, []).append(handler)
+                    self.active = 1
+        finally:
+            self.lock.release()
+
+    def load_entry_points(self, registry, cmdutil):
+        """Register the hooks returned by the hook entry points of the
+        CommandRegistry 'registry' when called with 'cmdutil'.
+        """
+        for name in registry.hook_names():
+            self.register(registry.load_hook(name)(cmdutil))
+
+    def dispatch(self, event, command, cmdutil, started=None,
+                 cpu_started=None, error=None):
+        """Report 'event' of 'command' to the hooks handling it.  Hooks
+        which fail are reported and otherwise ignored: observing a
+        command mustn't break it.
+        """
+        handlers = self.handlers.get(event)
+        if not handlers:
+            return
+        options = {}
+        for (option, (source, value)) in \
+                cmdutil.command_options.get(command, {}).items():
+            options[option] = source
+        hook_event = HookEvent(event, command, options, started,
+                               cpu_started, error)
+        for handler in handlers:
+            try:
+                handler(hook_event)
+            except Exception, e:
+                log.warn("hook %r failed on %s of %s: %s",
+                         handler, event, command, e)
+
+    def close(self):
+        """Close the hooks which have a 'close()' method."""
+        for hook in self.hooks:
+            close = getattr(hook, 'close', None)
+            if close is not None:
+                close()
+
+
+class JSONLinesExporter(object):
+    """Hook appending every event, as returned by 'HookEvent.as_dict()',
+    to the file 'filename' as one line of JSON.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.lock = threading.Lock()
+
+    def export(self, event):
+        import json
+        line = json.dumps(event.as_dict()) + '\n'
+        self.lock.acquire()
+        try:
+            if self.file is None:
+                self.file = open(self.filename, 'a')
+            self.file.write(line)
+            self.file.flush()
+        finally:
+            self.lock.release()
+
+    before_finalize = before_run = after_run = on_error = export
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        finally:
+            self.lock.release()
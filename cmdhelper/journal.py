@@ -0,0 +1,206 @@
+"""cmdhelper.journal
+
+Recording file operations and running them in parallel batches.
+
+Between 'Command.begin_journal()' and 'Command.commit_journal()' the
+helpers 'mkpath()', 'copy_file()', 'move_file()' and 'execute()' of a
+command don't act: they record an Operation in the command's Journal
+and return it.  Committing the journal runs the plan built from the
+recorded operations:
+
+  - duplicates are dropped: 'mkpath()' of a directory already created
+    (or below one already created) by the journal, the same copy
+    recorded twice;
+  - operations are ordered in batches: an operation goes in the batch
+    after the last operation it depends on, ie. the last one writing a
+    path it reads or writes (or a directory above it), or reading or
+    writing a path it writes (or anything below it).  'execute()' can
+    do anything, so it gets a batch of its own;
+  - the operations of a batch run in parallel, on a pool of threads,
+    and batches run one after the other.
+
+With --dry-run nothing is run.  The plan -- the operations and their
+batch numbers -- is appended as a line of JSON to the file named by the
+--plan-file global option, if given, so that a dry run can be reviewed
+before the real one.
+"""
+
+import os
+
+from cmdhelper.fscache import StatCache
+
+# number of threads running a batch when --jobs doesn't ask for more
+DEFAULT_JOURNAL_THREADS = 8
+
+
+class Operation(object):
+    """A journaled call of 'func' with 'args', of the kind 'kind' (the
+    name of the helper which recorded it).  'reads' and 'writes' are the
+    paths it reads and writes; 'barrier' is true if it may touch any
+    path.  'batch' is the number of the batch it runs in, 'result' what
+    'func' returned once it ran.
+    """
+
+    def __init__(self, kind, func, args, reads=(), writes=(), barrier=0,
+                 details=None):
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.reads = list(reads)
+        self.writes = list(writes)
+        self.barrier = barrier
+        self.details = details or {}
+        self.batch = None
+        self.result = None
+
+    def run(self):
+        self.result = self.func(*self.args)
+        return self.result
+
+    def as_dict(self):
+        """Return the operation as a dictionary of JSON-friendly values."""
+        data = {'op': self.kind, 'batch': self.batch,
+                'reads': self.reads, 'writes': self.writes}
+        data.update(self.details)
+        return data
+
+    def __repr__(self):
+        return "<Operation %s %r -> %r (batch %s)>" % \
+               (self.kind, self.reads, self.writes, self.batch)
+
+
+class Journal(object):
+    """The operations recorded by a command, see the module
+    documentation.  'stats' is the StatCache telling which paths are
+    directories.
+    """
+
+    def __init__(self, stats=None):
+        if stats is None:
+            stats = StatCache()
+        self.stats = stats
+        self.operations = []
+
+        # operations recorded under a deduplication key, directories
+        # created by journaled 'mkpath()' calls (and their parents)
+        self.keys = {}
+        self.made = {}
+
+        # batch of the last operation writing each path, batch of the
+        # last operation touching each path or anything below it, last
+        # batch and last barrier batch
+        self.written = {}
+        self.touched = {}
+        self.last_batch = 0
+        self.barrier_batch = 0
+
+    def isdir(self, path):
+        """Return true if 'path' is a directory, or will be one once the
+        journaled operations ran.
+        """
+        return os.path.abspath(path) in self.made or self.stats.isdir(path)
+
+    def add(self, operation, key=None):
+        """Record 'operation' and return it -- or, if 'key' is given and
+        an operation was already recorded with it, return that one.
+        """
+        if key is not None:
+            recorded = self.keys.get(key)
+            if recorded is not None:
+                return recorded
+            self.keys[key] = operation
+        self._place(operation)
+        self.operations.append(operation)
+        return operation
+
+    def mkpath(self, operation):
+        """Record the 'mkpath()' 'operation', unless the directory it
+        creates is created by the journal already.
+        """
+        path = os.path.abspath(operation.writes[0])
+        recorded = self.made.get(path)
+        if recorded is not None:
+            return recorded
+        self._place(operation)
+        self.operations.append(operation)
+        for parent in _self_and_parents(path):
+            self.made.setdefault(parent, operation)
+        return operation
+
+    def _place(self, operation):
+        """Set the batch of 'operation', recorded after all the others."""
+        reads = map(os.path.abspath, operation.reads)
+        writes = map(os.path.abspath, operation.writes)
+        if operation.barrier:
+            batch = self.last_batch + 1
+        else:
+            batch = self.barrier_batch + 1
+            for path in reads + writes:
+                for parent in _self_and_parents(path):
+                    batch = max(batch, self.written.get(parent, 0) + 1)
+            for path in writes:
+                batch = max(batch, self.touched.get(path, 0) + 1)
+
+        operation.batch = batch
+        for path in writes:
+            self.written[path] = batch
+        for path in reads + writes:
+            for parent in _self_and_parents(path):
+                if self.touched.get(parent, 0) < batch:
+                    self.touched[parent] = batch
+        self.last_batch = max(self.last_batch, batch)
+        if operation.barrier:
+            self.barrier_batch = batch
+
+    def get_batches(self):
+        """Return the list of batches, each the list of its operations
+        in the order they were recorded.
+        """
+        batches = []
+        for i in range(self.last_batch):
+            batches.append([])
+        for operation in self.operations:
+            batches[operation.batch - 1].append(operation)
+        return batches
+
+    def as_list(self):
+        """Return the plan as a list of dictionaries, see
+        'Operation.as_dict()'.
+        """
+        return [operation.as_dict() for operation in self.operations]
+
+    def run(self, threads=DEFAULT_JOURNAL_THREADS):
+        """Run the batches one after the other, the operations of each
+        on up to 'threads' threads.  If an operation fails, the others
+        of its batch still run, then its exception is raised.
+        """
+        from cmdhelper.parallel import WorkerPool
+
+        pool = None
+        try:
+            for batch in self.get_batches():
+                if len(batch) == 1 or threads < 2:
+                    for operation in batch:
+                        operation.run()
+                    continue
+                if pool is None:
+                    pool = WorkerPool(threads)
+                jobs = [pool.submit(operation.run) for operation in batch]
+                pool.wait(jobs)
+                for job in jobs:
+                    job.get()
+        finally:
+            if pool is not None:
+                pool.close()
+
+
+def _self_and_parents(path):
+    """Yield 'path' (absolute and normalized) and its parent
+    directories.
+    """
+    while 1:
+        yield path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return
+        path = parent
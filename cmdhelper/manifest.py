@@ -0,0 +1,117 @@
+"""cmdhelper.manifest
+
+Static command metadata.
+
+Listing the available commands (--help-commands) needs nothing but the
+names and descriptions of the commands, yet getting the description out
+of a command class means importing its module and everything the module
+imports.  To avoid that, a distribution providing commands can ship a
+manifest -- the 'cmdhelper_commands.json' file in its metadata
+directory -- which describes its commands statically:
+
+    {"<entry point group>": {"<command>": {"description": "...",
+                                           "user_options": [...]}}}
+
+The manifest is written by the egg_info command when the distribution's
+setup() call lists the entry point groups to describe:
+
+    setup(...,
+          setup_requires=['cmdhelper'],
+          cmdhelper_manifest=['myutility.commands'],
+          entry_points={'myutility.commands': [...]})
+
+The command classes are imported once, at build time, to collect their
+'description' and 'user_options'.  Commands without an entry in the
+manifest are still imported when their description is needed.
+"""
+
+from cmdhelper.errors import *
+
+# Name of the manifest file in the distribution metadata directory.
+MANIFEST_NAME = 'cmdhelper_commands.json'
+
+# Command class attributes copied into the manifest.
+MANIFEST_ATTRS = ('description', 'user_options')
+
+
+def describe_command(klass):
+    """Return the manifest entry describing the command class 'klass'."""
+    info = {}
+    for attr in MANIFEST_ATTRS:
+        if hasattr(klass, attr):
+            info[attr] = getattr(klass, attr)
+    return info
+
+
+def parse_manifest(text):
+    """Parse the manifest 'text' and return the dictionary it holds;
+    returns an empty dictionary if the manifest is broken.
+    """
+    import json
+    try:
+        manifest = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+
+def merge_manifest(commands, manifest, group, dist):
+    """Add the metadata 'manifest' declares for the commands of 'group'
+    coming from the distribution 'dist' to the matching records in
+    'commands'.
+    """
+    described = manifest.get(group)
+    if not isinstance(described, dict):
+        return
+    for (name, info) in described.items():
+        record = commands.get(name)
+        if record is None or record['dist'] != dist or \
+           not isinstance(info, dict):
+            continue
+        for attr in MANIFEST_ATTRS:
+            if attr in info:
+                record[attr] = info[attr]
+
+
+def assert_groups(dist, attr, value):
+    """setuptools keyword validator for 'cmdhelper_manifest'."""
+    from distutils.errors import DistutilsSetupError
+    if isinstance(value, basestring) or \
+       [group for group in value if not isinstance(group, basestring)]:
+        raise DistutilsSetupError, \
+              "%r must be a list of entry point group names (got %r)" % \
+              (attr, value)
+
+
+def write_manifest(cmd, basename, filename):
+    """egg_info writer producing the command manifest for the groups
+    listed in the 'cmdhelper_manifest' setup() keyword.
+    """
+    import json
+    import pkg_resources
+    from distutils import log
+
+    groups = getattr(cmd.distribution, 'cmdhelper_manifest', None)
+    if groups is None:
+        cmd.write_or_delete_file('cmdhelper manifest', filename, None)
+        return
+
+    entry_points = pkg_resources.EntryPoint.parse_map(
+        cmd.distribution.entry_points or {})
+    manifest = {}
+    for group in groups:
+        described = manifest[group] = {}
+        for (name, ep) in entry_points.get(group, {}).items():
+            try:
+                klass = ep.resolve()
+            except (ImportError, AttributeError), msg:
+                log.warn("can't describe command '%s' in %s manifest: %s",
+                         name, group, msg)
+                continue
+            described[name] = describe_command(klass)
+
+    cmd.write_or_delete_file('cmdhelper manifest', filename,
+                             json.dumps(manifest, indent=2, sort_keys=True),
+                             force=True)
@@ -0,0 +1,202 @@
+"""cmdhelper.options
+
+Precompiled per-command-class option tables.
+
+Parsing the options of a command needs the command's option table
+(global options + 'user_options' + 'help_options'), its negative aliases
+and FancyGetopt's long/short option maps built from them.  Likewise,
+applying option values to a command object needs its boolean and
+negative options.  None of that depends on the command line or the
+config files, so it is computed once per command class and memoized for
+the lifetime of the process.
+"""
+
+from types import *
+
+from distutils.fancy_getopt import FancyGetopt, translate_longopt
+
+from cmdhelper.errors import *
+
+
+def fix_help_options(options):
+    """Convert a 4-tuple 'help_options' list as found in various command
+    classes to the 3-tuple form required by FancyGetopt.  Same as
+    distutils.dist.fix_help_options(), without importing distutils.dist.
+    """
+    new_options = []
+    for help_tuple in options:
+        new_options.append(help_tuple[0:3])
+    return new_options
+
+
+class CompiledGetopt(FancyGetopt):
+    """FancyGetopt which digests its option table only once, no matter
+    how many times 'getopt()' is called.  The option table and aliases
+    must not be changed after the first 'getopt()' call.
+    """
+
+    grokked = 0
+
+    def _grok_option_table(self):
+        if not self.grokked:
+            FancyGetopt._grok_option_table(self)
+            self.grokked = 1
+
+    def getopt(self, args=None, object=None):
+        # 'option_order' is per command line, not per parser
+        self.option_order = []
+        return FancyGetopt.getopt(self, args, object)
+
+
+class CommandOptions(object):
+    """The compiled command-line interface of a command class.
+
+    'parser' is a ready to use CompiledGetopt for the command's options
+    (global options included), 'negative_opt' the merged negative
+    aliases and 'help_options' the list of (attribute, option, function)
+    tuples of the command's extra help options.
+    """
+
+    def __init__(self, cmd_class, global_options, negative_opt):
+        # late import because of mutual dependence between these modules
+        from cmdhelper.cmd import Command
+
+        # Require that the command class be derived from Command -- want
+        # to be sure that the basic "command" interface is implemented.
+        if not issubclass(cmd_class, Command):
+            raise CMDHelperClassError, \
+                  "command class %s must subclass Command" % cmd_class
+
+        # Also make sure that the command object provides a list of its
+        # known options.
+        if not (hasattr(cmd_class, 'user_options') and
+                type(cmd_class.user_options) is ListType):
+            raise CMDHelperClassError, \
+                  ("command class %s must provide " +
+                   "'user_options' attribute (a list of tuples)") % \
+                  cmd_class
+
+        # If the command class has a list of negative alias options,
+        # merge it in with the global negative aliases.
+        self.negative_opt = dict(negative_opt)
+        if hasattr(cmd_class, 'negative_opt'):
+            self.negative_opt.update(cmd_class.negative_opt)
+
+        # Check for help_options in command class.  They have a different
+        # format (tuple of four) so we need to preprocess them here.
+        if (hasattr(cmd_class, 'help_options') and
+            type(cmd_class.help_options) is ListType):
+            help_table = fix_help_options(cmd_class.help_options)
+            help_options = cmd_class.help_options
+        else:
+            help_table = help_options = []
+
+        # All commands support the global options too, just by adding
+        # in 'global_options'.
+        self.parser = CompiledGetopt(list(global_options) +
+                                     cmd_class.user_options +
+                                     help_table)
+        self.parser.set_negative_aliases(self.negative_opt)
+
+        self.help_options = []
+        for (help_option, short, desc, func) in help_options:
+            self.help_options.append(
+                (self.parser.get_attr_name(help_option), help_option, func))
+
+
+# Maps (command class, global options, negative aliases) to the
+# CommandOptions compiled for them.
+_compiled = {}
+
+def get_command_options(cmd_class, global_options, negative_opt):
+    """Return the (memoized) CommandOptions of 'cmd_class' used with the
+    given global options and negative aliases.
+    """
+    key = (cmd_class, tuple(global_options),
+           tuple(sorted(negative_opt.items())))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = _compiled[key] = CommandOptions(cmd_class, global_options,
+                                                   negative_opt)
+    return compiled
+
+
+class OptionDescriptor(object):
+    """Knows how to apply option values to the objects of a command
+    class: which options are boolean ('boolean'), which are negative
+    aliases of some other option ('negative_opt') and which attributes
+    are declared in 'user_options' ('known').  Boolean conversions of
+    string values are cached per (option, value).
+    """
+
+    def __init__(self, cmd_class, negative_opt):
+        self.negative_opt = dict(negative_opt)
+        self.boolean = {}
+        for option in getattr(cmd_class, 'boolean_options', []):
+            self.boolean[translate_longopt(option)] = 1
+        self.known = {}
+        for option in getattr(cmd_class, 'user_options', []):
+            long = option[0]
+            if long[-1] == '=':
+                long = long[:-1]
+            self.known[translate_longopt(long)] = 1
+        self.converted = {}
+
+    def to_bool(self, option, value):
+        """Return the boolean value of the string 'value' given for
+        'option'; raises CMDHelperOptionError if it isn't one.
+        """
+        key = (option, value)
+        try:
+            return self.converted[key]
+        except KeyError:
+            pass
+        from distutils.util import strtobool
+        try:
+            result = self.converted[key] = strtobool(value)
+        except ValueError, msg:
+            raise CMDHelperOptionError, msg
+        return result
+
+    def apply(self, command_obj, option_dict, command_name):
+        """Copy the values in 'option_dict' (mapping option names to
+        (source, value) tuples) to the attributes of 'command_obj'.
+        """
+        negative_opt = self.negative_opt
+        boolean = self.boolean
+        known = self.known
+        for (option, (source, value)) in option_dict.items():
+            if type(value) is StringType:
+                alias = negative_opt.get(option)
+                if alias is not None:
+                    setattr(command_obj, alias,
+                            not self.to_bool(option, value))
+                    continue
+                if option in boolean:
+                    setattr(command_obj, option, self.to_bool(option, value))
+                    continue
+            if option in known or hasattr(command_obj, option):
+                setattr(command_obj, option, value)
+            else:
+                raise CMDHelperOptionError, \
+                      ("error in %s: command '%s' has no such option '%s'"
+                       % (source, command_name, option))
+
+
+# Maps (command class, negative aliases) to the OptionDescriptor built
+# for them.
+_descriptors = {}
+
+def get_option_descriptor(command_obj):
+    """Return the (memoized) OptionDescriptor for the class of the
+    command object 'command_obj'.
+    """
+    # negative aliases may come from the command class or, through
+    # Command.__getattr__, from the command line utility
+    negative_opt = getattr(command_obj, 'negative_opt', {})
+    key = (command_obj.__class__, tuple(sorted(negative_opt.items())))
+    descriptor = _descriptors.get(key)
+    if descriptor is None:
+        descriptor = _descriptors[key] = OptionDescriptor(
+            command_obj.__class__, negative_opt)
+    return descriptor
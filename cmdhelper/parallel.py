@@ -0,0 +1,470 @@
+"""cmdhelper.parallel
+
+Running commands concurrently.
+
+Provides a small thread pool (WorkerPool), per-thread capturing of
+sys.stdout and sys.stderr (CapturedOutput), 'run_all()' used to fan out
+sub-commands and the CommandScheduler used by 'CMDHelper.run_commands()'
+when the --jobs global option asks for more than one job.
+
+Commands run in threads rather than processes because command objects
+share their state -- options, 'command_obj', 'have_run' -- with the
+CMDHelper instance and with each other.  Only output written through
+sys.stdout and sys.stderr (print statements, distutils.log) is captured;
+output of spawned programs goes straight to the terminal.
+"""
+
+import sys, threading
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from cmdhelper.errors import *
+
+
+class Job(object):
+    """A call of 'func' with 'args' submitted to a WorkerPool.
+    'commands' is the stack of the commands the submitting thread was
+    running (see 'CMDHelper.run_command()').
+    """
+
+    def __init__(self, func, args, commands=()):
+        self.func = func
+        self.args = args
+        self.commands = commands
+        self.result = None
+        self.exc_info = None
+        self.finished = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.started = self.cancelled = 0
+
+    def cancel(self):
+        """Make sure the job never starts; return false if it already
+        did (a running call can't be interrupted).
+        """
+        self.lock.acquire()
+        try:
+            if self.started:
+                return 0
+            self.cancelled = 1
+        finally:
+            self.lock.release()
+        self.finished.set()
+        return 1
+
+    def run(self):
+        self.lock.acquire()
+        try:
+            if self.cancelled:
+                return
+            self.started = 1
+        finally:
+            self.lock.release()
+        try:
+            self.result = self.func(*self.args)
+        except:
+            self.exc_info = sys.exc_info()
+        self.finished.set()
+        for callback in self.callbacks:
+            callback(self)
+
+    def get(self):
+        """Wait for the job and return its result, or re-raise the
+        exception it raised.
+        """
+        self.finished.wait()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class WorkerPool(object):
+    """A pool of 'size' daemon threads running submitted jobs in
+    submission order.  Jobs may submit more jobs and wait for them with
+    'wait()' without starving the pool.
+
+    If 'running' is given, it is the thread-local object whose
+    'commands' attribute holds the stack of the commands a thread is
+    running (the 'running' attribute of CMDHelper): every job runs with
+    a copy of the stack of the thread which submitted it, so circular
+    dependencies are caught across threads too.
+    """
+
+    def __init__(self, size, running=None):
+        self.size = size
+        self.running = running
+        self.queue = Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # workers blocked in 'wait()' without running jobs themselves
+        self.blocked = 0
+
+    def _start(self):
+        self.lock.acquire()
+        try:
+            while len(self.threads) < self.size + self.blocked:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(1)
+                thread.start()
+                self.threads.append(thread)
+        finally:
+            self.lock.release()
+
+    def _work(self):
+        self.local.worker = 1
+        while 1:
+            job = self.queue.get()
+            if job is None:
+                break
+            self._run(job)
+            # the threads started for blocked workers leave once these
+            # are back at work
+            self.lock.acquire()
+            try:
+                if len(self.threads) > self.size + self.blocked:
+                    self.threads.remove(threading.currentThread())
+                    break
+            finally:
+                self.lock.release()
+
+    def _run(self, job):
+        running = self.running
+        if running is None:
+            job.run()
+            return
+        saved = getattr(running, 'commands', None)
+        running.commands = list(job.commands)
+        try:
+            job.run()
+        finally:
+            running.commands = saved
+
+    def _get_commands(self):
+        if self.running is None:
+            return ()
+        return tuple(getattr(self.running, 'commands', None) or ())
+
+    def submit(self, func, *args):
+        """Schedule 'func(*args)' and return its Job."""
+        return self.submit_job(Job(func, args, self._get_commands()))
+
+    def submit_job(self, job):
+        """Schedule the Job 'job', eg. one created on behalf of other
+        commands than those of the calling thread, and return it.
+        """
+        self._start()
+        self.queue.put(job)
+        return job
+
+    def wait(self, jobs):
+        """Wait for all of 'jobs' to finish.  While waiting, the calling
+        thread runs queued jobs itself, so that jobs waiting for other
+        jobs can't deadlock the pool -- unless it is running commands:
+        it holds their locks, which the jobs could enter again, so a
+        worker thread is added for the time it waits instead.
+        """
+        if self._get_commands():
+            self.blocking(self._wait_all, jobs)
+            return
+        for job in jobs:
+            while not job.finished.isSet():
+                try:
+                    other = self.queue.get_nowait()
+                except Empty:
+                    # 'job' is running: whoever runs it helps in turn
+                    job.finished.wait()
+                    break
+                if other is None:
+                    # the pool is being closed, leave that to a worker
+                    self.queue.put(None)
+                    job.finished.wait()
+                    break
+                self._run(other)
+
+    def _wait_all(self, jobs):
+        for job in jobs:
+            job.finished.wait()
+
+    def blocking(self, func, *args):
+        """Call 'func(*args)', which blocks the calling thread until
+        other jobs progress, and return its result.  If the calling
+        thread is a worker of the pool, a spare worker is started for
+        the time it is blocked.
+        """
+        worker = getattr(self.local, 'worker', 0)
+        if worker:
+            self.lock.acquire()
+            self.blocked = self.blocked + 1
+            self.lock.release()
+            self._start()
+        try:
+            return func(*args)
+        finally:
+            if worker:
+                self.lock.acquire()
+                self.blocked = self.blocked - 1
+                self.lock.release()
+
+    def close(self):
+        """Stop the worker threads once the submitted jobs are done."""
+        self.lock.acquire()
+        try:
+            threads = self.threads[:]
+        finally:
+            self.lock.release()
+        for thread in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join()
+        self.threads = []
+
+
+class OutputRouter(object):
+    """Stands in for a stream (sys.stdout or sys.stderr, named 'name')
+    and diverts what threads write into the buffer they registered with
+    'CapturedOutput.capture()', if any.
+    """
+
+    def __init__(self, name, stream, local):
+        self.name = name
+        self.stream = stream
+        self.local = local
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            self.stream.write(text)
+        else:
+            buffer.append((self.name, text))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+
+class CapturedOutput(object):
+    """Replaces sys.stdout and sys.stderr with OutputRouters while
+    installed (installations nest).  Threads then call 'capture()' to
+    start buffering their output as a list of (stream name, text)
+    chunks, which 'replay()' writes out again -- into the buffer of the
+    replaying thread, if it is capturing itself.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.installed = 0
+        self.saved = None
+
+    def install(self):
+        self.lock.acquire()
+        try:
+            if not self.installed:
+                self.saved = (sys.stdout, sys.stderr)
+                sys.stdout = OutputRouter('stdout', sys.stdout, self.local)
+                sys.stderr = OutputRouter('stderr', sys.stderr, self.local)
+            self.installed = self.installed + 1
+        finally:
+            self.lock.release()
+
+    def uninstall(self):
+        self.lock.acquire()
+        try:
+            self.installed = self.installed - 1
+            if not self.installed:
+                (sys.stdout, sys.stderr) = self.saved
+        finally:
+            self.lock.release()
+
+    def capture(self):
+        """Start buffering the output of the calling thread; return
+        '(buffer, previous)' where 'previous' must be passed to
+        'release()'.
+        """
+        previous = getattr(self.local, 'buffer', None)
+        buffer = self.local.buffer = []
+        return buffer, previous
+
+    def release(self, previous):
+        self.local.buffer = previous
+
+    def replay(self, buffer):
+        for (name, text) in buffer:
+            getattr(sys, name).write(text)
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+# There is only one sys.stdout, so there is only one CapturedOutput.
+output = CapturedOutput()
+
+
+def _run_captured(func, args):
+    (buffer, previous) = output.capture()
+    try:
+        try:
+            result = func(*args)
+        except:
+            return None, sys.exc_info(), buffer
+    finally:
+        output.release(previous)
+    return result, None, buffer
+
+
+def run_all(pool, func, items):
+    """Call 'func(item)' for every item of 'items' on the worker pool
+    'pool' and wait for all calls to finish.  Return the list of
+    '(result, exc_info)' tuples in the order of 'items'; 'exc_info' is
+    None unless the call raised an exception.  The output of the calls
+    is written out in the order of 'items' too.
+    """
+    output.install()
+    try:
+        jobs = []
+        for item in items:
+            jobs.append(pool.submit(_run_captured, func, (item,)))
+        pool.wait(jobs)
+        results = []
+        for job in jobs:
+            (result, exc_info, buffer) = job.get()
+            output.replay(buffer)
+            results.append((result, exc_info))
+    finally:
+        output.uninstall()
+    return results
+
+
+class CommandScheduler(object):
+    """Runs the commands of a command line concurrently on the worker
+    pool 'pool', respecting dependencies between them.
+
+    Command X waits for command Y if Y is listed in the 'depends_on'
+    attribute of X's class (Y doesn't have to be on the command line).
+    Commands related through 'sub_commands' are never run concurrently:
+    the one coming later on the command line waits for the other one,
+    just as it would when running sequentially.  The output of every
+    command is buffered and written out in the order the commands would
+    run sequentially, so it never interleaves with the output of other
+    commands.
+    """
+
+    def __init__(self, cmdutil, pool):
+        self.cmdutil = cmdutil
+        self.pool = pool
+
+    def build_graph(self, commands):
+        """Return '(order, deps)': the list of the commands to run,
+        dependencies first and otherwise in command line order, and the
+        dictionary mapping every command to the list of the commands it
+        waits for.
+        """
+        order = []
+        deps = {}
+        visiting = []
+
+        def visit(command):
+            if command in deps:
+                return
+            if command in visiting:
+                raise CMDHelperClassError, \
+                      "circular dependency between commands: %s" % \
+                      " -> ".join(visiting + [command])
+            visiting.append(command)
+            klass = self.cmdutil.get_command_class(command)
+            depends_on = list(getattr(klass, 'depends_on', []))
+            for dependency in depends_on:
+                visit(dependency)
+            visiting.pop()
+            deps[command] = depends_on
+            order.append(command)
+
+        for command in commands:
+            visit(command)
+
+        # serialize the commands related through 'sub_commands'
+        position = {}
+        for i in range(len(order)):
+            position[order[i]] = i
+        for command in order:
+            klass = self.cmdutil.get_command_class(command)
+            for (sub_command, method) in getattr(klass, 'sub_commands', []):
+                if sub_command == command or sub_command not in position:
+                    continue
+                if position[sub_command] < position[command]:
+                    deps[command].append(sub_command)
+                else:
+                    deps[sub_command].append(command)
+        return order, deps
+
+    def run(self, commands):
+        """Run 'commands' and all their dependencies."""
+        (order, deps) = self.build_graph(commands)
+
+        waiting = {}        # command -> number of unfinished dependencies
+        dependents = {}     # command -> commands waiting for it
+        for command in order:
+            waiting[command] = len(deps[command])
+            for dependency in deps[command]:
+                dependents.setdefault(dependency, []).append(command)
+
+        pool = self.pool
+        finished = Queue()
+        buffers = {}
+        failure = None
+        running = 0
+        flushed = 0
+
+        output.install()
+        try:
+            for command in order:
+                if not waiting[command]:
+                    pool.submit(self._run_command, command, finished)
+                    running = running + 1
+
+            while running:
+                (command, buffer, exc_info) = finished.get()
+                running = running - 1
+                buffers[command] = buffer
+
+                # write out the output of every finished command whose
+                # predecessors in 'order' are already written out
+                while flushed < len(order) and order[flushed] in buffers:
+                    output.replay(buffers[order[flushed]])
+                    flushed = flushed + 1
+
+                if exc_info is not None:
+                    if failure is None:
+                        failure = exc_info
+                    continue
+                if failure is not None:
+                    continue    # don't start anything new, just drain
+                for dependent in dependents.get(command, []):
+                    waiting[dependent] = waiting[dependent] - 1
+                    if not waiting[dependent]:
+                        pool.submit(self._run_command, dependent, finished)
+                        running = running + 1
+
+            # some commands may never have started because of a failure
+            for command in order[flushed:]:
+                if command in buffers:
+                    output.replay(buffers[command])
+        finally:
+            output.uninstall()
+
+        if failure is not None:
+            raise failure[0], failure[1], failure[2]
+
+    def _run_command(self, command, finished):
+        (result, exc_info, buffer) = _run_captured(self.cmdutil.run_command,
+                                                   (command,))
+        finished.put((command, buffer, exc_info))
@@ -0,0 +1,278 @@
+"""cmdhelper.registry
+
+Provides the CommandRegistry class, a persistent on-disk cache of the
+commands registered under some entry point group.
+
+Walking the entry points means scanning the metadata of every installed
+distribution, which gets slow once a lot of plugin distributions are
+installed.  The registry does this scan once, stores the result together
+with a fingerprint of the installed distributions and afterwards looks
+commands up in a plain dictionary.
+The scan is repeated only when the fingerprint changes, ie. when some
+distribution was installed, removed or upgraded.  The hooks observing
+the commands (see cmdhelper.hooks) are found by the same scan and stored
+in the same cache.
+"""
+
+import sys, os, re
+
+from cmdhelper.debug import DEBUG
+from cmdhelper.errors import *
+from cmdhelper.discovery import get_discovery
+from cmdhelper.util import write_file_atomic
+
+# Bumped every time the layout of the cache file changes, so that cache
+# files written by older versions of cmdhelper get silently rebuilt.
+REGISTRY_FORMAT = 3
+
+# Suffixes of the sys.path entries holding distribution metadata.
+METADATA_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link', '.egg')
+
+_unsafe_chars = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def get_cache_dir():
+    """Return the directory registry caches are stored in.  Taken from
+    the CMDHELPER_CACHE_DIR environment variable, falls back to
+    ~/.cache/cmdhelper.
+    """
+    cache_dir = os.environ.get('CMDHELPER_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'cmdhelper')
+    return cache_dir
+
+
+# fingerprints computed by 'path_fingerprint()' for sys.path, by value of
+# sys.path: registries of several groups share them
+_fingerprints = {}
+
+def path_fingerprint(path=None):
+    """Return a string identifying the set of distributions installed on
+    'path' (defaults to sys.path).  It is built from the modification
+    times of every sys.path entry, of the *.dist-info/*.egg-info
+    directories found in them and of the 'entry_points.txt' files those
+    directories contain.  The fingerprint of sys.path is computed once
+    per process, unless 'clear_fingerprints()' is called.
+    """
+    if path is None:
+        key = tuple(sys.path)
+        fingerprint = _fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = _fingerprints[key] = _path_fingerprint(sys.path)
+        return fingerprint
+    return _path_fingerprint(path)
+
+def clear_fingerprints():
+    """Forget the fingerprints computed so far."""
+    _fingerprints.clear()
+
+def _path_fingerprint(path):
+    try:
+        from hashlib import md5
+    except ImportError:
+        from md5 import new as md5
+
+    digest = md5()
+    for entry in path:
+        digest.update(entry + '\0')
+        try:
+            digest.update('%r\0' % os.stat(entry or os.curdir).st_mtime)
+            names = os.listdir(entry or os.curdir)
+        except OSError:
+            # missing entry or zipped egg: its own mtime (if any) is enough
+            continue
+        names.sort()
+        for name in names:
+            if not name.endswith(METADATA_SUFFIXES):
+                continue
+            metadata = os.path.join(entry, name)
+            for filename in (metadata,
+                             os.path.join(metadata, 'entry_points.txt')):
+                try:
+                    mtime = os.stat(filename).st_mtime
+                except OSError:
+                    continue
+                digest.update('%s\0%r\0' % (filename, mtime))
+    return digest.hexdigest()
+
+
+class CommandRegistry(object):
+    """Maps command names of the entry point group 'group' to the
+    locations of the command classes implementing them.
+
+    Every command is described by a record -- a dictionary with
+    'module', 'attrs', 'extras' and 'dist' keys, describing the entry
+    point, and optional 'description' and 'user_options' keys taken from
+    the command manifest of the distribution (see cmdhelper.manifest).
+    Records are kept in memory and, unless 'cache_dir' is
+    false, in a cache file under 'cache_dir' (see 'get_cache_dir()').
+    Entry points are found by the discovery backend named 'discovery'
+    (see cmdhelper.discovery).  The entry points of the group
+    'hooks_group', if given, are recorded too, as hooks.
+    """
+
+    def __init__(self, group, cache_dir=None, discovery=None,
+                 hooks_group=None):
+        self.group = group
+        self.hooks_group = hooks_group
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+        self.cache_dir = cache_dir
+        self.discovery = get_discovery(discovery)
+
+        # 'commands' and 'hooks' map command and hook names to records,
+        # they stay None until the registry is loaded either from disk
+        # or by a scan
+        self.commands = None
+        self.hooks = None
+        self.fingerprint = None
+
+    def get_cache_file(self):
+        """Return the name of the file the registry of this group is
+        stored in, or None if the registry is not persistent.
+        """
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir,
+                            _unsafe_chars.sub('_', self.group) + '.json')
+
+    def ensure_loaded(self):
+        """Make sure 'commands' is up to date with the installed
+        distributions: use the cache file if its fingerprint matches,
+        rescan the entry points otherwise.
+        """
+        if self.commands is not None:
+            return
+        self.fingerprint = path_fingerprint()
+        if not self._read_cache():
+            self.refresh()
+
+    def refresh(self):
+        """Rescan the entry point group and rewrite the cache file."""
+        if self.fingerprint is None:
+            clear_fingerprints()
+            self.fingerprint = path_fingerprint()
+        self.commands = self.scan()
+        self.hooks = {}
+        if self.hooks_group:
+            if DEBUG: print "CommandRegistry.refresh(): scanning '%s'" % \
+                            self.hooks_group
+            self.hooks = self.discovery.scan(self.hooks_group)
+        self._write_cache()
+
+    def scan(self):
+        """Walk the entry points of our group and return the dictionary
+        of command records.
+        """
+        if DEBUG: print "CommandRegistry.scan(): scanning '%s' using %s" % \
+                        (self.group, self.discovery.name)
+        return self.discovery.scan(self.group)
+
+    def _read_cache(self):
+        filename = self.get_cache_file()
+        if not filename:
+            return 0
+        try:
+            import json
+            f = open(filename)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), msg:
+            if DEBUG: print "  can't read registry cache %s: %s" % \
+                            (filename, msg)
+            return 0
+
+        if (not isinstance(data, dict) or
+            data.get('format') != REGISTRY_FORMAT or
+            data.get('group') != self.group or
+            data.get('hooks_group') != self.hooks_group or
+            data.get('fingerprint') != self.fingerprint):
+            return 0
+        self.commands = data['commands']
+        self.hooks = data['hooks']
+        return 1
+
+    def _write_cache(self):
+        """Store the registry on disk.  The cache file is replaced
+        atomically, so that concurrently started utilities never see a
+        half-written file.  Failures are ignored: the registry works
+        without its cache, just slower.
+        """
+        filename = self.get_cache_file()
+        if not filename:
+            return
+        import json
+        try:
+            write_file_atomic(filename, json.dumps({
+                'format': REGISTRY_FORMAT,
+                'group': self.group,
+                'hooks_group': self.hooks_group,
+                'fingerprint': self.fingerprint,
+                'commands': self.commands,
+                'hooks': self.hooks}))
+        except (IOError, OSError), msg:
+            if DEBUG: print "  can't write registry cache %s: %s" % \
+                            (filename, msg)
+
+    def names(self):
+        """Return the sorted list of command names in the registry."""
+        self.ensure_loaded()
+        names = self.commands.keys()
+        names.sort()
+        return names
+
+    def get(self, command):
+        """Return the record for 'command', or None if there is no such
+        command.
+        """
+        self.ensure_loaded()
+        return self.commands.get(command)
+
+    def __contains__(self, command):
+        return self.get(command) is not None
+
+    def load(self, command, require=1):
+        """Import and return the class implementing 'command'.  If the
+        entry point declares extras and 'require' is true, they are
+        resolved (and installed, if needed) by the discovery backend, just
+        as 'EntryPoint.load()' does.  Raises CMDHelperModuleError if
+        there is no such command or its class can't be imported.
+        """
+        record = self.get(command)
+        if record is None:
+            raise CMDHelperModuleError("invalid command '%s'" % command)
+        return self._load(self.group, 'command', command, record, require)
+
+    def hook_names(self):
+        """Return the sorted list of hook names in the registry."""
+        self.ensure_loaded()
+        names = self.hooks.keys()
+        names.sort()
+        return names
+
+    def load_hook(self, name, require=1):
+        """Import and return the callable of the hook 'name', see
+        'load()'.
+        """
+        self.ensure_loaded()
+        record = self.hooks.get(name)
+        if record is None:
+            raise CMDHelperModuleError("invalid hook '%s'" % name)
+        return self._load(self.hooks_group, 'hook', name, record, require)
+
+    def _load(self, group, kind, name, record, require):
+        if require and record['extras']:
+            self.discovery.require(group, name, record)
+
+        try:
+            obj = __import__(record['module'], {}, {}, ['__name__'])
+            for attr in record['attrs']:
+                obj = getattr(obj, attr)
+        except (ImportError, AttributeError), msg:
+            raise CMDHelperModuleError, \
+                  "can't load %s '%s' from %s: %s" % \
+                  (kind, name, record['module'], msg)
+        return obj
@@ -0,0 +1,170 @@
+"""cmdhelper.resume
+
+Resuming a chain of commands where a previous run stopped.
+
+With the --resume global option, every command run successfully is
+recorded in a state file, under its name and a digest of its finalized
+options (see 'get_options_digest()').  The next run with --resume skips
+the commands recorded with the same options, as if they had already run
+in this process -- so a long chain which failed half way restarts at the
+command which failed.  A command whose options changed is run again.
+Once all the commands of a run with --resume succeeded, the state file
+is removed: the next run starts over.
+
+The state file is named by the --state-file global option; it defaults
+to a file in the "resume" directory of the cmdhelper cache location,
+one per entry point group and working directory.  It is rewritten
+atomically after every command, so a crash never leaves it half
+written.  Remove it, or run without --resume, to start over.  Nothing
+is recorded (or removed) with --dry-run.
+"""
+
+import os, re, errno, string, threading
+
+from cmdhelper.debug import DEBUG
+from cmdhelper.util import write_file_atomic
+
+# Bumped every time the layout of the state files changes.
+RESUME_STATE_FORMAT = 1
+
+# repr() of an object shown with its address, which another object may
+# have in another run
+_address_re = re.compile(r' at 0x[0-9a-fA-F]+>')
+
+
+def _md5(data):
+    try:
+        from hashlib import md5
+    except ImportError:
+        from md5 import new as md5
+    return md5(data)
+
+
+def get_state_file(cache_dir, entry_point, directory=None):
+    """Return the name of the default state file, in 'cache_dir', of the
+    utility of the entry point group 'entry_point' run in 'directory'
+    (defaults to the current directory).
+    """
+    if directory is None:
+        directory = os.getcwd()
+    name = _md5('%s\0%s' % (entry_point, os.path.abspath(directory)))
+    return os.path.join(cache_dir, 'resume', name.hexdigest() + '.json')
+
+
+def _stable_repr(value):
+    """repr() of 'value' which doesn't depend on the order of dictionary
+    keys.
+    """
+    if isinstance(value, dict):
+        items = map(lambda (k, v): '%s: %s' % (_stable_repr(k),
+                                              _stable_repr(v)),
+                    value.items())
+        items.sort()
+        return '{%s}' % string.join(items, ', ')
+    if isinstance(value, (list, tuple)):
+        return '%s(%s)' % (type(value).__name__,
+                           string.join(map(_stable_repr, value), ', '))
+    return repr(value)
+
+
+def get_options_digest(cmd_obj):
+    """Return the digest of the finalized options of the command object
+    'cmd_obj': its class and the values of the attributes named by its
+    'user_options'.  Return None if the value of an option has no
+    stable repr() (eg. an object shown with its address): the command
+    can't be matched with a previous run, so it is always run.
+    """
+    from distutils.fancy_getopt import translate_longopt
+
+    cls = cmd_obj.__class__
+    lines = ['%s.%s' % (cls.__module__, cls.__name__)]
+    for option in cmd_obj.user_options:
+        attr = translate_longopt(option[0])
+        if attr[-1] == '=':
+            attr = attr[:-1]
+        value = _stable_repr(getattr(cmd_obj, attr, None))
+        if _address_re.search(value):
+            return None
+        lines.append('%s=%s' % (attr, value))
+    return _md5(string.join(lines, '\n')).hexdigest()
+
+
+class RunState(object):
+    """The commands completed by previous runs, stored in the file
+    'filename': command names mapped to the digest of the options they
+    ran with.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.completed = None
+
+    def _read(self):
+        """Return the commands recorded in the state file, an empty
+        dictionary if it can't be read.
+        """
+        try:
+            import json
+            f = open(self.filename)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), msg:
+            if DEBUG: print "  can't read resume state %s: %s" % \
+                            (self.filename, msg)
+            return {}
+        if isinstance(data, dict) and \
+           data.get('format') == RESUME_STATE_FORMAT:
+            return data['completed']
+        return {}
+
+    def load(self):
+        self.lock.acquire()
+        try:
+            if self.completed is None:
+                self.completed = self._read()
+        finally:
+            self.lock.release()
+
+    def is_completed(self, command, digest):
+        """Return true if 'command' was completed with the options whose
+        digest is 'digest'.
+        """
+        self.load()
+        return self.completed.get(command) == digest
+
+    def mark_completed(self, command, digest):
+        """Record that 'command' was completed with the options whose
+        digest is 'digest', and write the state file.  Commands recorded
+        in the file meanwhile (by another process) are kept.  Raises
+        IOError or OSError if the file can't be written.
+        """
+        import json
+
+        self.lock.acquire()
+        try:
+            self.load()
+            completed = self._read()
+            completed.update(self.completed)
+            completed[command] = digest
+            write_file_atomic(self.filename, json.dumps({
+                'format': RESUME_STATE_FORMAT,
+                'completed': completed}, sort_keys=True))
+            self.completed = completed
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Forget all the completed commands and remove the state file."""
+        self.lock.acquire()
+        try:
+            self.completed = {}
+            try:
+                os.remove(self.filename)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        finally:
+            self.lock.release()
@@ -0,0 +1,334 @@
+"""cmdhelper.server
+
+Long-running command server.
+
+Every run of a command line utility pays for starting the interpreter,
+importing distutils and finding and importing the command classes.  The
+command server pays that once: it imports all the commands of an entry
+point group up front and then listens on a Unix socket for command lines
+sent by the thin client in cmdhelper.client.
+
+Each request is served by a forked copy of the server, so commands run
+in a warm process but with their own CMDHelper instance (and thus their
+own 'command_obj' and 'have_run' state), environment, working directory
+and file descriptors.  The client's stdin is streamed to them, their
+stdout and stderr -- including the output of spawned programs -- are
+streamed back to the client, followed by the exit status.
+
+Before serving a request, the server checks the fingerprint of the
+installed distributions (see cmdhelper.registry): when some distribution
+was installed, removed or upgraded, the modules it preloaded are
+forgotten and the commands are found and imported again.
+
+Start a server with
+
+    python -m cmdhelper.server ENTRY_POINT SOCKET
+
+This only works on platforms having fork() and Unix sockets.
+"""
+
+import sys, os, socket, errno, signal, stat, threading
+from distutils.errors import DistutilsError
+
+from cmdhelper import CMDHelper
+from cmdhelper.debug import DEBUG
+from cmdhelper.errors import *
+from cmdhelper.registry import path_fingerprint, clear_fingerprints
+from cmdhelper.client import send_frame, recv_frame, STDIN, STDOUT, \
+     STDERR, EXIT
+
+
+def _to_str(value):
+    """JSON gives us unicode strings, command line utilities expect
+    plain ones.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class CommandServer(object):
+    """Serves the commands of the entry point group 'entry_point' on the
+    Unix socket 'socket_path'.  Requests are run by instances of
+    'helper_class' (CMDHelper by default) created with 'attrs'.
+    """
+
+    # size of the socket's pending connections queue
+    backlog = 128
+
+    def __init__(self, entry_point, socket_path, helper_class=CMDHelper,
+                 attrs=None):
+        self.entry_point = entry_point
+        self.socket_path = socket_path
+        self.helper_class = helper_class
+        self.attrs = attrs or {}
+        self.socket = None
+
+        # warm state shared (copy-on-write) by all the forked workers,
+        # and the names of the modules imported to build it
+        self.registry = None
+        self.cmdclass = {}
+        self.preloaded_modules = []
+
+    def preload(self):
+        """Find and import all the commands of our entry point group."""
+        modules = sys.modules.copy()
+        helper = self.make_helper()
+        self.registry = registry = helper.get_registry()
+        for name in registry.names():
+            try:
+                self.cmdclass[name] = registry.load(name)
+            except CMDHelperError, msg:
+                sys.stderr.write("warning: can't preload command '%s': %s\n"
+                                 % (name, msg))
+        self.preloaded_modules = [name for name in sys.modules.keys()
+                                  if name not in modules]
+
+    def check_fingerprint(self):
+        """Preload the commands again if distributions were installed,
+        removed or upgraded since they were preloaded: the modules the
+        preloading imported are forgotten first, so they are imported
+        again from the installed distributions.
+        """
+        clear_fingerprints()
+        if path_fingerprint() == self.registry.fingerprint:
+            return
+        if DEBUG: print "CommandServer: distributions changed, reloading"
+        for name in self.preloaded_modules:
+            if name in sys.modules:
+                del sys.modules[name]
+        self.registry = None
+        self.cmdclass = {}
+        self.preload()
+
+    def make_helper(self, argv=None):
+        """Return a new, pristine 'helper_class' instance for the command
+        line 'argv', reusing the preloaded command classes.
+        """
+        helper = self.helper_class(self.entry_point, dict(self.attrs))
+        if argv:
+            helper.script_name = os.path.basename(argv[0])
+            helper.script_args = list(argv[1:])
+        if self.registry is not None:
+            helper.registry = self.registry
+        for (name, klass) in self.cmdclass.items():
+            helper.cmdclass.setdefault(name, klass)
+        return helper
+
+    def serve_forever(self):
+        """Preload the commands, bind the socket and serve requests until
+        interrupted.
+        """
+        self.preload()
+        self.remove_stale_socket()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.socket_path)
+        self.socket.listen(self.backlog)
+        bound = os.stat(self.socket_path)
+        signal.signal(signal.SIGCHLD, self._reap_children)
+        signal.signal(signal.SIGTERM, self._terminate)
+        if DEBUG: print "CommandServer: serving %s on %s" % \
+                        (self.entry_point, self.socket_path)
+        try:
+            while 1:
+                try:
+                    (conn, address) = self.socket.accept()
+                except socket.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.check_fingerprint()
+                    pid = os.fork()
+                    if pid == 0:
+                        self.socket.close()
+                        status = 1
+                        try:
+                            status = self.handle(conn)
+                        finally:
+                            os._exit(status)
+                finally:
+                    conn.close()
+        finally:
+            self.socket.close()
+            # unless another server took the path over meanwhile
+            try:
+                st = os.stat(self.socket_path)
+            except OSError:
+                pass
+            else:
+                if (st.st_dev, st.st_ino) == (bound.st_dev, bound.st_ino):
+                    os.remove(self.socket_path)
+
+    def remove_stale_socket(self):
+        """Remove the socket left behind at 'socket_path' by a server
+        which is gone.  Raises CMDHelperFileError if a server is listening
+        there, or if the path isn't a socket.
+        """
+        try:
+            st = os.stat(self.socket_path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        if not stat.S_ISSOCK(st.st_mode):
+            raise CMDHelperFileError, \
+                  "%s exists and is not a socket" % self.socket_path
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                probe.connect(self.socket_path)
+            except socket.error, e:
+                if e.args[0] not in (errno.ECONNREFUSED, errno.ENOENT):
+                    raise
+            else:
+                raise CMDHelperFileError, \
+                      "a server is already listening on %s" % \
+                      self.socket_path
+        finally:
+            probe.close()
+        if DEBUG: print "CommandServer: removing stale socket %s" % \
+                        self.socket_path
+        try:
+            os.remove(self.socket_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _terminate(self, signum, frame):
+        raise SystemExit(0)
+
+    def _reap_children(self, signum, frame):
+        while 1:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if not pid:
+                return
+
+    def handle(self, conn):
+        """Serve the request waiting on 'conn', running in a forked
+        worker.  Return the exit status of the worker.
+        """
+        import json
+
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        (channel, data) = recv_frame(conn)
+        request = json.loads(data)
+        argv = map(_to_str, request['argv'])
+        os.environ.clear()
+        for (key, value) in request['env'].items():
+            os.environ[_to_str(key)] = _to_str(value)
+        os.chdir(_to_str(request['cwd']))
+
+        # Feed the file descriptor 0 from the client's stdin, and
+        # redirect the file descriptors 1 and 2 to pipes pumped to the
+        # client, so that spawned programs get them too
+        (read_fd, write_fd) = os.pipe()
+        os.dup2(read_fd, 0)
+        os.close(read_fd)
+        feeder = threading.Thread(target=self._feed, args=(conn, write_fd))
+        feeder.setDaemon(1)
+        feeder.start()
+
+        lock = threading.Lock()
+        pumps = []
+        for (fd, channel) in ((1, STDOUT), (2, STDERR)):
+            (read_fd, write_fd) = os.pipe()
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            pump = threading.Thread(target=self._pump,
+                                    args=(read_fd, conn, channel, lock))
+            pump.setDaemon(1)
+            pump.start()
+            pumps.append(pump)
+
+        status = self.run_command_line(argv)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        for pump in pumps:
+            pump.join()
+        send_frame(conn, EXIT, str(status))
+        return 0
+
+    def _feed(self, conn, write_fd):
+        """Write the STDIN frames received on 'conn' to 'write_fd'; an
+        empty frame or a closed connection ends stdin.
+        """
+        try:
+            try:
+                while 1:
+                    (channel, data) = recv_frame(conn)
+                    if channel != STDIN or not data:
+                        break
+                    os.write(write_fd, data)
+            except (EOFError, socket.error, OSError):
+                # the client went away, or the command stopped reading
+                pass
+        finally:
+            os.close(write_fd)
+
+    def _pump(self, read_fd, conn, channel, lock):
+        while 1:
+            data = os.read(read_fd, 65536)
+            if not data:
+                break
+            lock.acquire()
+            try:
+                send_frame(conn, channel, data)
+            finally:
+                lock.release()
+        os.close(read_fd)
+
+    def run_command_line(self, argv):
+        """Run the command line 'argv' with a fresh helper; return its
+        exit status.  Errors are reported the way 'distutils.core.setup()'
+        reports them.
+        """
+        try:
+            self.make_helper(argv).run()
+        except SystemExit, e:
+            code = e.code
+            if code is None:
+                return 0
+            if isinstance(code, int):
+                return code
+            sys.stderr.write("%s\n" % code)
+            return 1
+        except KeyboardInterrupt:
+            sys.stderr.write("interrupted\n")
+            return 1
+        except (CMDHelperError, DistutilsError, EnvironmentError), msg:
+            sys.stderr.write("error: %s\n" % msg)
+            return 1
+        except:
+            import traceback
+            traceback.print_exc()
+            return 1
+        return 0
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 2:
+        sys.stderr.write("usage: python -m cmdhelper.server ENTRY_POINT "
+                         "SOCKET\n")
+        return 2
+    try:
+        CommandServer(args[0], args[1]).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except CMDHelperError, msg:
+        sys.stderr.write("error: %s\n" % msg)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""cmdhelper.spawnpool
+
+Running many external programs concurrently.
+
+Provides the SpawnPool class used by 'Command.spawn_many()', and
+SpawnResult, the record of one program run.  Programs are started by a
+pool of threads, each of which waits for its child with
+'Popen.communicate()', which reads stdout and stderr together so that a
+child filling one of its pipes can't block.
+"""
+
+import os, time
+import subprocess
+
+from cmdhelper.parallel import WorkerPool
+
+
+class SpawnResult(object):
+    """The outcome of running the argument list 'cmd'.
+
+    'returncode' is the exit status (negative if the program was killed
+    by a signal), or None if the program wasn't run: because of the
+    dry-run flag, or because it couldn't be started, in which case
+    'error' holds the reason.  'stdout' and 'stderr' hold the output of
+    the program if it was captured.  'start' and 'elapsed' are wall
+    clock times, in seconds.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.returncode = None
+        self.error = None
+        self.stdout = None
+        self.stderr = None
+        self.start = None
+        self.elapsed = None
+
+    def failed(self):
+        return self.error is not None or bool(self.returncode)
+
+    def describe(self):
+        """Return a message describing the outcome, worded like the
+        errors of 'distutils.spawn.spawn()'.
+        """
+        if self.error is not None:
+            return "command '%s' failed: %s" % (self.cmd[0], self.error)
+        if self.returncode is None:
+            return "command '%s' not run" % self.cmd[0]
+        if self.returncode < 0:
+            return "command '%s' terminated by signal %d" % \
+                   (self.cmd[0], -self.returncode)
+        if self.returncode:
+            return "command '%s' failed with exit status %d" % \
+                   (self.cmd[0], self.returncode)
+        return "command '%s' succeeded" % self.cmd[0]
+
+    def __repr__(self):
+        return "<SpawnResult %r: %s>" % (self.cmd, self.describe())
+
+
+class SpawnPool(object):
+    """Runs programs on 'size' threads, ie. at most 'size' children at
+    a time.  If 'capture' is true the output of the children is
+    collected in their SpawnResult, otherwise it goes to the terminal.
+    If 'dry_run' is true nothing is run.
+    """
+
+    def __init__(self, size, capture=1, search_path=1, dry_run=0):
+        self.pool = WorkerPool(size)
+        self.capture = capture
+        self.search_path = search_path
+        self.dry_run = dry_run
+        self.jobs = []
+
+    def submit(self, cmd, cwd=None, env=None):
+        """Schedule running the argument list 'cmd' in the directory
+        'cwd' with the environment 'env' (both default to those of this
+        process).  Returns the SpawnResult, which is filled in once the
+        program finished.
+        """
+        result = SpawnResult(cmd)
+        if not self.dry_run:
+            self.jobs.append(self.pool.submit(self._run, result, cwd, env))
+        return result
+
+    def _run(self, result, cwd, env):
+        cmd = result.cmd
+        executable = cmd[0]
+        if not self.search_path and os.sep not in executable:
+            # don't look the program up on $PATH
+            executable = os.path.join(os.curdir, executable)
+        pipe = None
+        if self.capture:
+            pipe = subprocess.PIPE
+
+        result.start = time.time()
+        try:
+            # close_fds: a child must not keep the pipes of another open
+            process = subprocess.Popen(cmd, executable=executable,
+                                       cwd=cwd, env=env,
+                                       stdout=pipe, stderr=pipe,
+                                       close_fds=(os.name == 'posix'))
+            result.stdout, result.stderr = process.communicate()
+            result.returncode = process.returncode
+        except OSError, e:
+            result.error = e.strerror
+        result.elapsed = time.time() - result.start
+
+    def wait(self):
+        """Wait for all the programs submitted so far."""
+        jobs = self.jobs
+        self.jobs = []
+        self.pool.wait(jobs)
+        for job in jobs:
+            job.get()
+
+    def close(self):
+        self.wait()
+        self.pool.close()
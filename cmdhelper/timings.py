@@ -0,0 +1,156 @@
+"""cmdhelper.timings
+
+Measuring where the time of a run goes.
+
+Provides the Timings class.  CMDHelper records in it the wall clock
+time, CPU time and peak memory use of the phases of a run -- importing
+cmdhelper, reading the configuration, parsing the command line,
+importing and running each command -- and reports them at the end of
+the run when the --timings global option is given.
+
+CPU time and memory are those of the whole process: when commands run
+in parallel (--jobs) the CPU time of a command includes that of the
+commands running at the same time.
+"""
+
+import sys, os, time, threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# formats accepted by the --timings option
+TIMINGS_FORMATS = ('table', 'json')
+
+
+def get_cpu_time():
+    """Return the user and system CPU time used by the process so far."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def get_max_rss():
+    """Return the peak resident set size of the process in kilobytes, or
+    None where it isn't known.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss = rss / 1024            # bytes there
+    return rss
+
+
+class Timing(object):
+    """The measurements of one phase: 'kind' is one of "import",
+    "phase" and "command", 'depth' the number of phases it is nested
+    in (eg. a command run by another one).
+    """
+
+    def __init__(self, kind, name, depth):
+        self.kind = kind
+        self.name = name
+        self.depth = depth
+        self.wall = None
+        self.cpu = None
+        self.max_rss = None
+        self.started = time.time()
+        self.cpu_started = get_cpu_time()
+
+    def as_dict(self):
+        return {'kind': self.kind, 'name': self.name, 'depth': self.depth,
+                'wall': self.wall, 'cpu': self.cpu, 'max_rss': self.max_rss}
+
+
+class Timings(object):
+    """The Timing records of a run, in the order the phases started."""
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.cpu_started = get_cpu_time()
+
+    def add(self, kind, name, wall, cpu):
+        """Record a phase measured by the caller."""
+        timing = Timing(kind, name, 0)
+        timing.wall = wall
+        timing.cpu = cpu
+        timing.max_rss = get_max_rss()
+        self.lock.acquire()
+        try:
+            self.records.append(timing)
+        finally:
+            self.lock.release()
+
+    def start(self, kind, name):
+        """Start measuring a phase; returns the Timing to pass to
+        'stop()'.
+        """
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        timing = Timing(kind, name, depth)
+        self.lock.acquire()
+        try:
+            self.records.append(timing)
+        finally:
+            self.lock.release()
+        return timing
+
+    def stop(self, timing):
+        timing.wall = time.time() - timing.started
+        timing.cpu = get_cpu_time() - timing.cpu_started
+        timing.max_rss = get_max_rss()
+        self.local.depth = timing.depth
+
+    def abort(self, timing):
+        """Stop measuring a phase which failed: its measurements are
+        left unset (it is reported as still running), but the phases
+        started next are no longer nested in it.
+        """
+        self.local.depth = timing.depth
+
+    def get_total(self):
+        """Return the Timing of the whole run so far."""
+        total = Timing('total', '', 0)
+        total.wall = time.time() - self.started
+        total.cpu = get_cpu_time() - self.cpu_started
+        total.max_rss = get_max_rss()
+        return total
+
+    def format_table(self):
+        lines = ["%-8s %-30s %10s %10s %12s" %
+                 ('kind', 'name', 'wall (s)', 'cpu (s)', 'max rss (kB)')]
+        for timing in self.records + [self.get_total()]:
+            if timing.wall is None:
+                # still running, eg. the command which failed
+                wall = cpu = '-'
+            else:
+                wall = '%.4f' % timing.wall
+                cpu = '%.4f' % timing.cpu
+            rss = timing.max_rss
+            if rss is None:
+                rss = '-'
+            name = '  ' * timing.depth + timing.name
+            lines.append("%-8s %-30s %10s %10s %12s" %
+                         (timing.kind, name, wall, cpu, rss))
+        return '\n'.join(lines)
+
+    def format_json(self):
+        import json
+        return json.dumps({
+            'phases': [timing.as_dict() for timing in self.records],
+            'total': self.get_total().as_dict()}, indent=2)
+
+    def report(self, format, stream=None):
+        """Write the measurements to 'stream' (defaults to sys.stderr)
+        in 'format', one of TIMINGS_FORMATS.
+        """
+        if stream is None:
+            stream = sys.stderr
+        if format == 'json':
+            stream.write(self.format_json() + '\n')
+        else:
+            stream.write(self.format_table() + '\n')
@@ -0,0 +1,52 @@
+"""cmdhelper.util
+
+Miscellaneous utility functions used by the cmdhelper modules.
+"""
+
+import os
+
+try:
+    from thread import get_ident
+except ImportError:
+    from threading import get_ident
+
+
+def write_file_atomic(filename, data, mode=None):
+    """Write the string 'data' to 'filename' so that readers see either
+    the old or the new contents, never a partially written file: 'data'
+    is written to a temporary file in the same directory, which is then
+    renamed over 'filename'.  Creates the directory if needed.  If 'mode'
+    is given, the file is created with these permission bits (eg. 0600)
+    instead of the default ones.  Raises IOError or OSError on failure.
+    """
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # somebody else may have created it meanwhile
+            if not os.path.isdir(dirname):
+                raise
+
+    tmp_filename = '%s.%d.%d.tmp' % (filename, os.getpid(), get_ident())
+    if mode is None:
+        f = open(tmp_filename, 'wb')
+    else:
+        fd = os.open(tmp_filename,
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                     getattr(os, 'O_BINARY', 0), mode)
+        f = os.fdopen(fd, 'wb')
+    try:
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if os.name != 'posix' and os.path.exists(filename):
+            os.remove(filename)    # rename() won't replace it here
+        os.rename(tmp_filename, filename)
+    except:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
@@ -25,9 +25,18 @@ setup(name='cmdhelper',
           'setuptools',
           # -*- Extra requirements: -*-
       ],
+      extras_require={
+          'async': ['trollius'],
+      },
       entry_points={
           'cmdhelper.demo': [
               'demoprint = cmdhelper.command.demo:Demo',
           ],
+          'distutils.setup_keywords': [
+              'cmdhelper_manifest = cmdhelper.manifest:assert_groups',
+          ],
+          'egg_info.writers': [
+              'cmdhelper_commands.json = cmdhelper.manifest:write_manifest',
+          ],
       }
 )
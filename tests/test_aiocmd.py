@@ -0,0 +1,267 @@
+"""Tests of asynchronous commands (cmdhelper.aiocmd), skipped without
+trollius.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import threading, traceback, unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperClassError
+
+try:
+    from cmdhelper.aiocmd import AsyncCommand, coroutine, From, asyncio
+    from cmdhelper.aiocmd import ThreadedChildWatcher
+except ImportError:
+    AsyncCommand = None
+
+# seconds a run may take before it is considered hung
+TIMEOUT = 20
+
+
+def make_cmdutil(cmdclass, args):
+    cmdutil = CMDHelper('cmdhelper.tests',
+                        {'cmdclass': cmdclass, 'hooks_entry_point': None,
+                         'registry_cache_dir': ''})
+    cmdutil.verbose = 0
+    cmdutil.script_args = args
+    cmdutil.parse_command_line()
+    return cmdutil
+
+
+def run_with_timeout(func):
+    """Call 'func()' in a thread; return its exception, or the string
+    "hung" if it didn't return within TIMEOUT seconds.
+    """
+    result = []
+
+    def run():
+        try:
+            func()
+        except Exception, e:
+            result.append(e)
+        else:
+            result.append(None)
+
+    thread = threading.Thread(target=run)
+    thread.setDaemon(1)
+    thread.start()
+    thread.join(TIMEOUT)
+    if thread.isAlive():
+        return "hung"
+    return result[0]
+
+
+if AsyncCommand is not None:
+
+    class SpawningCommand(AsyncCommand):
+        user_options = []
+
+        def initialize_options(self):
+            pass
+
+        def finalize_options(self):
+            pass
+
+        @coroutine
+        def run(self):
+            yield From(asyncio.gather(self.spawn_async(['true']),
+                                      self.spawn_async(['true'])))
+            self.ran.append(self.get_command_name())
+
+    class RunningCommand(AsyncCommand):
+        """Runs its 'targets' concurrently with 'run_command_async()'."""
+        user_options = []
+
+        def initialize_options(self):
+            pass
+
+        def finalize_options(self):
+            pass
+
+        @coroutine
+        def run(self):
+            yield From(asyncio.gather(*[self.run_command_async(target)
+                                        for target in self.targets]))
+            self.ran.append(self.get_command_name())
+
+    class SequentialCommand(RunningCommand):
+        """Runs its 'targets' one after the other."""
+
+        @coroutine
+        def run(self):
+            for target in self.targets:
+                yield From(self.run_command_async(target))
+            self.ran.append(self.get_command_name())
+
+    class CancellingCommand(AsyncCommand):
+        """Runs 'blocker' and cancels running 'never' while the worker
+        pool is busy with it.
+        """
+        user_options = []
+
+        def initialize_options(self):
+            pass
+
+        def finalize_options(self):
+            pass
+
+        @coroutine
+        def run(self):
+            blocker = asyncio.ensure_future(
+                self.run_command_async('blocker'))
+            never = asyncio.ensure_future(self.run_command_async('never'))
+            yield From(asyncio.sleep(0.1))
+            never.cancel()
+            try:
+                yield From(never)
+            except asyncio.CancelledError:
+                pass
+            self.release.set()
+            yield From(blocker)
+            self.ran.append(self.get_command_name())
+
+
+class RecordingCommand(Command):
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        self.ran.append(self.get_command_name())
+
+
+class FailingCommand(RecordingCommand):
+
+    def run(self):
+        raise RuntimeError("failed")
+
+
+class BlockingCommand(RecordingCommand):
+
+    def run(self):
+        self.release.wait(TIMEOUT)
+        RecordingCommand.run(self)
+
+
+class EventLoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if AsyncCommand is None:
+            self.skipTest("trollius is not installed")
+        self.ran = []
+        self.cmdclass = {}
+        for name in ('a1', 'a2'):
+            self.cmdclass[name] = type(name, (SpawningCommand,),
+                                       {'ran': self.ran})
+
+    def check_run(self, args):
+        cmdutil = make_cmdutil(self.cmdclass, args)
+        self.assertEqual(run_with_timeout(cmdutil.run_commands), None)
+        self.assertEqual(sorted(self.ran), ['a1', 'a2'])
+        self.assertEqual(cmdutil.event_loop, None)
+
+    def test_spawning_commands(self):
+        self.check_run(['a1', 'a2'])
+
+    def test_spawning_commands_with_jobs(self):
+        self.check_run(['-j', '2', 'a1', 'a2'])
+
+    def test_child_watcher_of_process_untouched(self):
+        self.check_run(['a1', 'a2'])
+        policy = asyncio.get_event_loop_policy()
+        self.assert_(not isinstance(getattr(policy, '_watcher', None),
+                                    ThreadedChildWatcher))
+
+
+class RunCommandAsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if AsyncCommand is None:
+            self.skipTest("trollius is not installed")
+        self.ran = []
+
+    def make_class(self, name, base, **attrs):
+        attrs['ran'] = self.ran
+        return type(name, (base,), attrs)
+
+    def test_same_path_as_run_command(self):
+        cmdclass = {
+            'outer': self.make_class('outer', RunningCommand,
+                                     targets=['s1', 's1', 'a1']),
+            's1': self.make_class('s1', RecordingCommand, depends_on=['s0']),
+            's0': self.make_class('s0', RecordingCommand),
+            'a1': self.make_class('a1', SpawningCommand)}
+        cmdutil = make_cmdutil(cmdclass, ['outer'])
+        self.assertEqual(run_with_timeout(cmdutil.run_commands), None)
+        # dependencies first, every command once, 'outer' last
+        self.assertEqual(sorted(self.ran), ['a1', 'outer', 's0', 's1'])
+        self.assert_(self.ran.index('s0') < self.ran.index('s1'))
+        self.assertEqual(self.ran[-1], 'outer')
+        timed = [timing.name for timing in cmdutil.timer.records
+                 if timing.kind == 'command']
+        self.assertEqual(sorted(timed), ['a1', 'outer', 's0', 's1'])
+
+    def test_nested_on_one_worker(self):
+        # 'mid' waits for the loop on the only worker while its coroutine
+        # runs 'leaf' on the pool
+        cmdclass = {
+            'outer': self.make_class('outer', RunningCommand,
+                                     targets=['mid']),
+            'mid': self.make_class('mid', RunningCommand,
+                                   targets=['leaf']),
+            'leaf': self.make_class('leaf', RecordingCommand)}
+        cmdutil = make_cmdutil(cmdclass, ['outer'])
+        self.assertEqual(run_with_timeout(cmdutil.run_commands), None)
+        self.assertEqual(self.ran, ['leaf', 'mid', 'outer'])
+
+    def test_traceback_kept(self):
+        cmdclass = {
+            'outer': self.make_class('outer', SequentialCommand,
+                                     targets=['failing']),
+            'failing': self.make_class('failing', FailingCommand)}
+        cmdutil = make_cmdutil(cmdclass, ['outer'])
+        tracebacks = []
+
+        def run():
+            try:
+                cmdutil.run_commands()
+            except RuntimeError:
+                tracebacks.append(traceback.format_exc())
+                raise
+
+        self.assert_(isinstance(run_with_timeout(run), RuntimeError))
+        self.assert_('in run\n    raise RuntimeError("failed")' in
+                     tracebacks[0], tracebacks[0])
+
+    def test_cancelled_before_start(self):
+        release = threading.Event()
+        cmdclass = {
+            'outer': self.make_class('outer', CancellingCommand,
+                                     release=release),
+            'blocker': self.make_class('blocker', BlockingCommand,
+                                       release=release),
+            'never': self.make_class('never', RecordingCommand)}
+        cmdutil = make_cmdutil(cmdclass, ['outer'])
+        self.assertEqual(run_with_timeout(cmdutil.run_commands), None)
+        self.assertEqual(self.ran, ['blocker', 'outer'])
+
+    def test_cycle(self):
+        cmdclass = {
+            'outer': self.make_class('outer', RunningCommand,
+                                     targets=['back']),
+            'back': self.make_class('back', RecordingCommand,
+                                    depends_on=['outer'])}
+        cmdutil = make_cmdutil(cmdclass, ['outer'])
+        error = run_with_timeout(cmdutil.run_commands)
+        self.assert_(isinstance(error, CMDHelperClassError), error)
+        self.assertEqual(self.ran, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
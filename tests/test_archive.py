@@ -0,0 +1,145 @@
+"""Tests of the streamed archives compressed on a pool of threads
+(cmdhelper.archive) and of the formats left to distutils.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, gzip, shutil, tarfile, tempfile, zipfile, unittest
+from StringIO import StringIO
+from distutils import archive_util
+
+from cmdhelper import archive
+from cmdhelper.archive import make_archive
+
+
+class StreamWriter(object):
+    """A file object which can only be written to, like a pipe."""
+
+    def __init__(self):
+        self.data = StringIO()
+
+    def write(self, data):
+        self.data.write(data)
+
+    def flush(self):
+        pass
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.root = self.path('root')
+        # several chunks per file, more chunks than the window
+        self.saved = (archive.CHUNK_SIZE, archive.WINDOW_PER_THREAD,
+                      archive_util.ARCHIVE_FORMATS.copy())
+        archive.CHUNK_SIZE = 1000
+        archive.WINDOW_PER_THREAD = 1
+        self.files = {
+            'tree/a.txt': 'a' * 10,
+            'tree/sub/b.bin': ''.join([chr(i % 251) for i in range(25000)]),
+            'tree/sub/empty': '',
+            'tree/sub/deeper/c.txt': 'c\n' * 3000}
+        for (name, data) in self.files.items():
+            filename = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            f = open(filename, 'wb')
+            f.write(data)
+            f.close()
+
+    def tearDown(self):
+        (archive.CHUNK_SIZE, archive.WINDOW_PER_THREAD, formats) = self.saved
+        archive_util.ARCHIVE_FORMATS.clear()
+        archive_util.ARCHIVE_FORMATS.update(formats)
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def make(self, format, **kw):
+        return make_archive(self.path('out', 'archive'), format, self.root,
+                            'tree', threads=3, **kw)
+
+    def check_tar(self, tar):
+        contents = {}
+        for member in tar:
+            if member.isfile():
+                contents[member.name] = tar.extractfile(member).read()
+        tar.close()
+        self.assertEqual(contents, self.files)
+
+    def check_zip(self, zip):
+        self.assertEqual(zip.testzip(), None)
+        contents = {}
+        for name in zip.namelist():
+            if not name.endswith('/'):
+                contents[name] = zip.read(name)
+        self.assertEqual(contents, self.files)
+        return zip.namelist()
+
+    def test_gztar(self):
+        archive_name = self.make('gztar')
+        self.assertEqual(archive_name, self.path('out', 'archive.tar.gz'))
+        self.check_tar(tarfile.open(archive_name))
+        # a plain gzip file, with its name in the header
+        f = gzip.open(archive_name)
+        f.read()
+        self.assertEqual(f.name, archive_name)
+        f.close()
+
+    def test_other_tar_formats(self):
+        self.check_tar(tarfile.open(self.make('bztar')))
+        self.check_tar(tarfile.open(self.make('tar')))
+
+    def test_zip_names_as_distutils(self):
+        names = self.check_zip(zipfile.ZipFile(self.make('zip')))
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            expected = archive_util.make_zipfile(self.path('expected'),
+                                                 'tree')
+        finally:
+            os.chdir(cwd)
+        zip = zipfile.ZipFile(expected)
+        self.assertEqual(sorted(names), sorted(zip.namelist()))
+
+    def test_streamed(self):
+        for format in ('gztar', 'zip'):
+            out = StreamWriter()
+            self.assertEqual(self.make(format, fileobj=out), None)
+            data = StringIO(out.data.getvalue())
+            if format == 'zip':
+                self.check_zip(zipfile.ZipFile(data))
+            else:
+                self.check_tar(tarfile.open(fileobj=data))
+        self.assert_(not os.path.exists(self.path('out')))
+
+    def test_owner(self):
+        tar = tarfile.open(self.make('tar', owner='root', group='root'))
+        for member in tar:
+            self.assertEqual((member.uname, member.gname), ('root', 'root'))
+        tar.close()
+
+    def test_dry_run(self):
+        self.assertEqual(self.make('gztar', dry_run=1),
+                         self.path('out', 'archive.tar.gz'))
+        self.assert_(not os.path.exists(self.path('out',
+                                                  'archive.tar.gz')))
+
+    def test_other_formats_left_to_distutils(self):
+        calls = []
+        def make_test_archive(base_name, base_dir, **kw):
+            calls.append((base_name, base_dir))
+            return base_name + '.test'
+        archive_util.ARCHIVE_FORMATS['test'] = (make_test_archive, [],
+                                                "test archive")
+        self.assertEqual(self.make('test'),
+                         self.path('out', 'archive.test'))
+        self.assertEqual(calls, [(self.path('out', 'archive'), 'tree')])
+        self.assertRaises(ValueError, self.make, 'test',
+                          fileobj=StreamWriter())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Tests of the batch mode (cmdhelper.batch and CMDHelper.run_batch()).
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, unittest
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperOptionError
+from cmdhelper.batch import read_batch
+
+
+class EchoCommand(Command):
+    user_options = [('message=', 'm', "message to print")]
+
+    def initialize_options(self):
+        self.message = None
+
+    def finalize_options(self):
+        if self.message is None:
+            self.message = 'default'
+
+    def run(self):
+        print self.message, self.dry_run
+
+
+class FailCommand(EchoCommand):
+
+    def run(self):
+        raise RuntimeError(self.message)
+
+
+class ExitCommand(EchoCommand):
+
+    def run(self):
+        raise SystemExit(int(self.message))
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def make_cmdutil(self, *args):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': {'echo': EchoCommand,
+                                          'fail': FailCommand,
+                                          'exit': ExitCommand},
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.script_args = ['-q', '--batch', '-'] + list(args)
+        cmdutil.parse_command_line()
+        return cmdutil
+
+    def run_batch(self, lines, *args):
+        """Run the batch 'lines'; return the number of failures and the
+        results.
+        """
+        output = StringIO()
+        failed = self.make_cmdutil(*args).run_batch(lines, output)
+        return failed, [json.loads(line)
+                        for line in output.getvalue().splitlines()]
+
+    def test_read_batch(self):
+        self.assertEqual(list(read_batch(['echo -m "a b"\n', '\n',
+                                          '# comment\n', 'echo "a\n'])),
+                         [(1, ['echo', '-m', 'a b'], None),
+                          (4, None, "can't split command line: "
+                                    "No closing quotation")])
+
+    def test_results(self):
+        (failed, results) = self.run_batch(['echo -m first',
+                                            'fail -m broken',
+                                            '',
+                                            'echo "unclosed',
+                                            'exit -m 3',
+                                            'exit -m 0',
+                                            'unknown',
+                                            'echo'])
+        self.assertEqual(failed, 4)
+        self.assertEqual([(result['line'], result['status'])
+                          for result in results],
+                         [(1, 0), (2, 1), (4, 1), (5, 3), (6, 0), (7, 1),
+                          (8, 0)])
+        self.assertEqual(results[0]['args'], ['echo', '-m', 'first'])
+        self.assertEqual(results[0]['output'], 'first 0\n')
+        self.assertEqual(results[0]['error'], None)
+        self.assertEqual(results[1]['error'], 'RuntimeError: broken')
+        self.assert_(results[2]['error'].startswith("can't split"))
+        self.assert_('unknown' in results[5]['error'], results[5])
+        # the option of the first command line was reset
+        self.assertEqual(results[6]['output'], 'default 0\n')
+
+    def test_global_options(self):
+        (failed, results) = self.run_batch(['echo', 'echo -n'],
+                                           '--dry-run')
+        self.assertEqual([result['output'] for result in results],
+                         ['default 1\n', 'default 1\n'])
+        # the global options are reset too
+        (failed, results) = self.run_batch(['echo -n', 'echo'])
+        self.assertEqual([result['output'] for result in results],
+                         ['default 1\n', 'default 0\n'])
+
+    def test_nested_batch(self):
+        (failed, results) = self.run_batch(['--batch - echo'])
+        self.assertEqual(failed, 1)
+        self.assert_('--batch' in results[0]['error'], results[0])
+
+    def test_workers(self):
+        if not hasattr(os, 'fork'):
+            return
+        lines = ['echo -m %d' % i for i in range(40)] + ['fail']
+        (failed, results) = self.run_batch(lines, '--batch-workers', '3')
+        self.assertEqual(failed, 1)
+        self.assertEqual([result['output'] for result in results[:-1]],
+                         ['%d 0\n' % i for i in range(40)])
+        self.assertEqual(results[-1]['error'], 'RuntimeError: default')
+
+    def test_invalid_workers(self):
+        cmdutil = self.make_cmdutil('--batch-workers', '0')
+        self.assertRaises(CMDHelperOptionError, cmdutil.run_batch,
+                          ['echo'], StringIO())
+
+
+if __name__ == '__main__':
+    unittest.main()
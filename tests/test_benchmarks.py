@@ -0,0 +1,70 @@
+"""Tests of the benchmark suite (benchmarks/bench_suite.py), on a tiny
+size.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, shutil, tempfile, unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+try:
+    import bench_suite
+finally:
+    del sys.path[0]
+
+
+class MeasureTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_measure(self):
+        results = bench_suite.measure(3, 5, 1, self.tempdir)
+        self.assertEqual(sorted(results.keys()),
+                         ['get_command_class', 'get_command_class (no cache)',
+                          'import', 'parse_command_line',
+                          'parse_config_files',
+                          'parse_config_files_no_snapshot',
+                          'print_commands', 'run_commands'])
+        for value in results.values():
+            self.assert_(value >= 0, results)
+        # the caches really were used
+        cache_dir = os.path.join(self.tempdir, '3', 'cache')
+        self.assert_(os.listdir(cache_dir))
+        self.assert_(os.listdir(os.path.join(cache_dir, 'config')))
+
+
+class CompareTestCase(unittest.TestCase):
+
+    def compare(self, results, baseline):
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            regressions = bench_suite.compare(results, baseline, 0.1)
+            return regressions, sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+
+    def test_regressions(self):
+        (regressions, output) = self.compare(
+            {'faster': 0.5, 'same': 1.05, 'slower': 1.5, 'added': 1.0},
+            {'faster': 1.0, 'same': 1.0, 'slower': 1.0, 'removed': 1.0})
+        self.assertEqual(regressions, ['slower'])
+        lines = output.split('\n')
+        self.assertEqual([line.split()[0] for line in lines[1:5]],
+                         ['added', 'faster', 'same', 'slower'])
+        self.assert_(lines[1].endswith('new'), lines[1])
+        self.assert_(lines[4].endswith(' !'), lines[4])
+        self.assert_('removed' not in output)
+
+    def test_no_baseline(self):
+        self.assertEqual(self.compare({'a': 1.0}, {})[0], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
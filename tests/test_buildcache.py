@@ -0,0 +1,185 @@
+"""Tests of the content-hash build cache (cmdhelper.buildcache) and of
+Command.make_file() using it.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, shutil, tempfile, unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.buildcache import BuildCache, make_signature
+from cmdhelper.fscache import StatCache
+
+
+def concatenate(outfile, *infiles):
+    data = []
+    for filename in infiles:
+        f = open(filename)
+        try:
+            data.append(f.read())
+        finally:
+            f.close()
+    f = open(outfile, 'w')
+    try:
+        f.write(''.join(data))
+    finally:
+        f.close()
+
+
+class MakeCommand(Command):
+    """Generates 'output' from 'inputs', counting the generations."""
+    user_options = []
+    inputs = output = generated = None
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        self.make_file(self.inputs, self.output, self.generate,
+                       (self.output,) + tuple(self.inputs))
+
+    def generate(self, outfile, *infiles):
+        self.generated.append(outfile)
+        concatenate(outfile, *infiles)
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.cache_file = self.path('cache', 'build.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def write(self, name, data, mtime=1000):
+        f = open(self.path(name), 'w')
+        f.write(data)
+        f.close()
+        os.utime(self.path(name), (mtime, mtime))
+        return self.path(name)
+
+
+class BuildCacheTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.inputs = [self.write('a', 'a'), self.write('b', 'b')]
+        self.output = self.path('out')
+        self.signature = make_signature(concatenate, (self.output,))
+
+    def make_cache(self):
+        """Return the build cache as a new run finds it."""
+        return BuildCache(self.cache_file, StatCache())
+
+    def generate(self):
+        concatenate(self.output, *self.inputs)
+        os.utime(self.output, (2000, 2000))
+        cache = self.make_cache()
+        cache.record(self.inputs, self.output, self.signature)
+        cache.save()
+
+    def is_outdated(self, inputs=None, signature=None):
+        return self.make_cache().is_outdated(inputs or self.inputs,
+                                             self.output,
+                                             signature or self.signature)
+
+    def test_missing_output(self):
+        self.assertEqual(self.is_outdated(), 1)
+
+    def test_touched_inputs(self):
+        self.generate()
+        self.assertEqual(self.is_outdated(), 0)
+        # newer, but the same contents
+        self.write('a', 'a', mtime=3000)
+        self.assertEqual(self.is_outdated(), 0)
+
+    def test_changed_inputs(self):
+        self.generate()
+        # the same size and an older modification time than the output
+        self.write('a', 'A', mtime=1001)
+        self.assertEqual(self.is_outdated(), 1)
+
+    def test_changed_call(self):
+        self.generate()
+        self.assertEqual(self.is_outdated(self.inputs[:1]), 1)
+        self.assertEqual(self.is_outdated(signature='other'), 1)
+
+    def test_changed_output(self):
+        self.generate()
+        self.write('out', 'edited', mtime=2000)
+        self.assertEqual(self.is_outdated(), 1)
+
+    def test_unrecorded_output_checked_by_timestamps(self):
+        concatenate(self.output, *self.inputs)
+        os.utime(self.output, (500, 500))
+        self.assertEqual(self.is_outdated(), 1)
+        os.utime(self.output, (2000, 2000))
+        cache = self.make_cache()
+        self.assertEqual(cache.is_outdated(self.inputs, self.output,
+                                           self.signature), 0)
+        cache.save()
+        # recorded now: only the contents matter
+        self.write('a', 'a', mtime=3000)
+        self.assertEqual(self.is_outdated(), 0)
+
+    def test_broken_cache_file(self):
+        self.generate()
+        f = open(self.cache_file, 'w')
+        f.write('{"format": ')
+        f.close()
+        # timestamps are compared again
+        self.assertEqual(self.is_outdated(), 0)
+        self.write('a', 'a', mtime=3000)
+        self.assertEqual(self.is_outdated(), 1)
+
+
+class MakeFileTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.generated = []
+        self.inputs = [self.write('a', 'a')]
+
+    def run_utility(self, use_build_cache=1):
+        cmdclass = {'make': type('make', (MakeCommand,),
+                                 {'inputs': self.inputs,
+                                  'output': self.path('out'),
+                                  'generated': self.generated})}
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': cmdclass,
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': '',
+                             'use_build_cache': use_build_cache,
+                             'build_cache_dir': self.path('cache')})
+        cmdutil.script_args = ['-q', 'make']
+        cmdutil.parse_command_line()
+        del self.generated[:]
+        cmdutil.run_commands()
+        return len(self.generated)
+
+    def test_build_cache(self):
+        self.assertEqual(self.run_utility(), 1)
+        self.assertEqual(self.run_utility(), 0)
+        self.write('a', 'a', mtime=os.stat(self.path('out')).st_mtime + 10)
+        self.assertEqual(self.run_utility(), 0)
+        self.write('a', 'changed', mtime=os.stat(self.path('out')).st_mtime)
+        self.assertEqual(self.run_utility(), 1)
+
+    def test_timestamps_without_build_cache(self):
+        self.assertEqual(self.run_utility(0), 1)
+        self.assertEqual(self.run_utility(0), 0)
+        self.write('a', 'a', mtime=os.stat(self.path('out')).st_mtime + 10)
+        self.assertEqual(self.run_utility(0), 1)
+        self.assert_(not os.path.exists(self.path('cache')))
+
+
+if __name__ == '__main__':
+    unittest.main()
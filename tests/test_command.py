@@ -0,0 +1,86 @@
+"""Tests of the attributes of Command objects: the global flags resolved
+when finalized and the CMDHelper attributes delegated (cmdhelper.cmd).
+
+Run with: python -m unittest discover -s tests
+"""
+
+import unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+
+
+class PlainCommand(Command):
+    user_options = [('level=', None, "any option")]
+
+    def initialize_options(self):
+        self.level = None
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+def make_command(cls, **attrs):
+    attrs.update({'cmdclass': {'plain': cls},
+                  'hooks_entry_point': None,
+                  'registry_cache_dir': ''})
+    cmdutil = CMDHelper('cmdhelper.tests', attrs)
+    return cmdutil.get_command_obj('plain')
+
+
+class DelegationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cls = type('Plain', (PlainCommand,), {})
+        self.names = self.cls.__dict__.keys()
+
+    def test_class_untouched(self):
+        command = make_command(self.cls)
+        self.assert_(command.get_jobs.im_self is command.cmdutil)
+        self.assert_(command.get_jobs.im_self is command.cmdutil)
+        self.assert_(not hasattr(command, 'no_such_attribute'))
+        command.ensure_finalized()
+        self.assertEqual(sorted(self.cls.__dict__.keys()),
+                         sorted(self.names))
+
+    def test_each_object_uses_its_cmdutil(self):
+        first = make_command(self.cls, batch='first')
+        second = make_command(self.cls, batch='second')
+        self.assertEqual(first.batch, 'first')
+        self.assertEqual(second.batch, 'second')
+
+    def test_object_attributes_shadow_cmdutil(self):
+        command = make_command(self.cls, batch='helper')
+        self.assertEqual(command.batch, 'helper')
+        command.batch = 'own'
+        self.assertEqual(command.batch, 'own')
+        del command.batch
+        self.assertEqual(command.batch, 'helper')
+
+    def test_special_names_not_delegated(self):
+        command = make_command(self.cls)
+        self.assertRaises(AttributeError, getattr, command, '__length_hint__')
+        del command.cmdutil
+        self.assertRaises(AttributeError, getattr, command, 'get_jobs')
+
+
+class GlobalFlagsTestCase(unittest.TestCase):
+
+    def test_unset_flags_resolved(self):
+        command = make_command(PlainCommand, dry_run=1)
+        self.assertEqual(command.dry_run, 1)
+        command.ensure_finalized()
+        self.assertEqual(command.__dict__['dry_run'], 1)
+
+    def test_own_flags_kept(self):
+        command = make_command(PlainCommand, dry_run=1)
+        command.dry_run = 0
+        command.ensure_finalized()
+        self.assertEqual(command.dry_run, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+"""Tests of the configuration layers: the files found, their order and
+the options read from them (cmdhelper.config).
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, stat, shutil, tempfile, unittest
+from ConfigParser import ConfigParser, MissingSectionHeaderError
+
+from cmdhelper import CMDHelper, config
+from cmdhelper.config import environ_options, LazyCommandOptions, \
+     ConfigLayer, compile_config_files, read_config_files, get_snapshot_file
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = os.path.realpath(
+            tempfile.mkdtemp(prefix='cmdhelper-test-'))
+        self.saved = (os.getcwd(), os.environ.get('HOME'))
+        os.environ['HOME'] = self.path('home')
+        os.mkdir(self.path('home'))
+
+    def tearDown(self):
+        (cwd, home) = self.saved
+        os.chdir(cwd)
+        if home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = home
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def write(self, name, data):
+        filename = self.path(name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        f = open(filename, 'w')
+        f.write(data)
+        f.close()
+        return filename
+
+    def make_cmdutil(self, **attrs):
+        attrs.update({'hooks_entry_point': None, 'registry_cache_dir': '',
+                      'config_cache_dir': ''})
+        return CMDHelper('cmdhelper.tests', attrs)
+
+
+class FindConfigFilesTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.user_file = self.write('home/.karm.cfg', '')
+        self.config_file = self.write('utility.cfg', '')
+        self.project_file = self.write('project/karm.cfg', '')
+        os.makedirs(self.path('project', 'src', 'pkg'))
+        os.chdir(self.path('project', 'src', 'pkg'))
+
+    def find(self, **attrs):
+        files = self.make_cmdutil(**attrs).find_config_files()
+        return [filename for filename in files
+                if filename.startswith(self.tempdir)]
+
+    def test_user_file_overrides_config_file(self):
+        self.assertEqual(self.find(config_file=self.config_file),
+                         [self.config_file, self.user_file])
+
+    def test_project_file_is_opt_in(self):
+        self.assertEqual(self.find(), [self.user_file])
+        self.assertEqual(self.find(use_project_config=1,
+                                   config_file=self.config_file),
+                         [self.config_file, self.user_file,
+                          self.project_file])
+
+    def test_project_search_stops_at_project_root(self):
+        os.mkdir(self.path('project', 'src', '.git'))
+        self.assertEqual(self.find(use_project_config=1), [self.user_file])
+        cmdutil = self.make_cmdutil(use_project_config=1)
+        self.assertEqual(cmdutil.get_project_dir(), os.getcwd())
+
+    def test_layers(self):
+        self.write('home/.karm.cfg', '[cmd]\na = user\nb = user\n')
+        self.write('utility.cfg', '[cmd]\na = utility\nc = utility\n')
+        self.write('project/karm.cfg', '[cmd]\nb = project\n')
+        cmdutil = self.make_cmdutil(use_project_config=1,
+                                    config_file=self.config_file)
+        cmdutil.parse_config_files()
+        options = cmdutil.get_option_dict('cmd')
+        self.assertEqual(options['a'], (self.user_file, 'user'))
+        self.assertEqual(options['b'], (self.project_file, 'project'))
+        self.assertEqual(options['c'], (self.config_file, 'utility'))
+
+
+class SnapshotTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.cache_dir = self.path('cache')
+        self.config_file = self.write('utility.cfg', '[cmd]\na = 1\n')
+
+    def test_off_by_default(self):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'hooks_entry_point': None,
+                             'registry_cache_dir': '',
+                             'config_file': self.config_file})
+        self.assertEqual(cmdutil.get_config_cache_dir(), None)
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'hooks_entry_point': None,
+                             'registry_cache_dir': '',
+                             'use_config_snapshots': 1,
+                             'config_cache_dir': self.cache_dir})
+        self.assertEqual(cmdutil.get_config_cache_dir(), self.cache_dir)
+
+    def test_snapshot_private_and_reused(self):
+        os.utime(self.config_file, (0, 0))
+        layer = read_config_files([self.config_file], self.cache_dir)
+        self.assertEqual(layer['cmd'], {'a': (self.config_file, '1')})
+        snapshot_file = get_snapshot_file(self.cache_dir, [self.config_file])
+        self.assertEqual(stat.S_IMODE(os.stat(snapshot_file).st_mode), 0600)
+        # the snapshot is used while the size and modification time of
+        # the file are unchanged
+        self.write('utility.cfg', '[cmd]\na = 2\n')
+        os.utime(self.config_file, (0, 0))
+        layer = read_config_files([self.config_file], self.cache_dir)
+        self.assertEqual(layer['cmd'], {'a': (self.config_file, '1')})
+
+    def test_snapshot_invalidated(self):
+        read_config_files([self.config_file], self.cache_dir)
+        self.write('utility.cfg', '[cmd]\na = 22\n')
+        layer = read_config_files([self.config_file], self.cache_dir)
+        self.assertEqual(layer['cmd'], {'a': (self.config_file, '22')})
+
+
+class EnvironOptionsTestCase(unittest.TestCase):
+
+    def test_names_mapped_to_commands(self):
+        environ = {'CMDHELPER_BUILD_DOCS__OUT_DIR': 'html',
+                   'CMDHELPER_MYCMD__FORCE': '1',
+                   'CMDHELPER_GLOBAL__DRY_RUN': '1',
+                   'CMDHELPER_OTHER__X': 'y',
+                   'CMDHELPER_CACHE_DIR': '/tmp',
+                   'PATH': '/bin'}
+        options = environ_options(environ,
+                                  lambda: ['build-docs', 'myCmd', 'test'])
+        self.assertEqual(options, {
+            'build-docs': {'out_dir': ('$CMDHELPER_BUILD_DOCS__OUT_DIR',
+                                       'html')},
+            'myCmd': {'force': ('$CMDHELPER_MYCMD__FORCE', '1')},
+            'global': {'dry_run': ('$CMDHELPER_GLOBAL__DRY_RUN', '1')},
+            'other': {'x': ('$CMDHELPER_OTHER__X', 'y')}})
+
+    def test_commands_listed_only_when_needed(self):
+        def commands():
+            self.fail("commands listed")
+        self.assertEqual(environ_options({'CMDHELPER_CACHE_DIR': '/tmp'},
+                                         commands), {})
+
+    def test_parse_config_files(self):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': {'build-docs': object},
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': '',
+                             'config_cache_dir': ''})
+        saved = os.environ.copy()
+        os.environ['CMDHELPER_BUILD_DOCS__OUT_DIR'] = 'html'
+        try:
+            cmdutil.parse_config_files([])
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        self.assertEqual(cmdutil.get_option_dict('build-docs')['out_dir'],
+                         ('$CMDHELPER_BUILD_DOCS__OUT_DIR', 'html'))
+
+
+CONFIG = """\
+# comment
+[DEFAULT]
+base = /srv
+
+[build]
+out-dir = %(base)s/out
+long = first
+  second line
+[install]
+prefix = /usr
+[build]
+jobs = 2
+"""
+
+
+class ConfigLayerTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.config_file = self.write('utility.cfg', CONFIG)
+        self.parsed = []
+        self.parse_section = config.parse_section
+        def parse_section(filename, section, text, defaults):
+            self.parsed.append(section)
+            return self.parse_section(filename, section, text, defaults)
+        config.parse_section = parse_section
+
+    def tearDown(self):
+        config.parse_section = self.parse_section
+        TempDirTestCase.tearDown(self)
+
+    def test_same_as_configparser(self):
+        layer = ConfigLayer(compile_config_files([self.config_file]))
+        parser = ConfigParser()
+        parser.read([self.config_file])
+        self.assertEqual(sorted(layer.keys()), sorted(parser.sections()))
+        for section in parser.sections():
+            expected = {}
+            for option in parser.options(section):
+                expected[option.replace('-', '_')] = \
+                    (self.config_file, parser.get(section, option))
+            self.assertEqual(layer[section], expected)
+
+    def test_sections_parsed_on_first_lookup(self):
+        layer = ConfigLayer(compile_config_files([self.config_file]))
+        self.assert_('install' in layer)
+        self.assert_('test' not in layer)
+        self.assertEqual(self.parsed, [])
+        self.assertEqual(layer['install'],
+                         {'base': (self.config_file, '/srv'),
+                          'prefix': (self.config_file, '/usr')})
+        layer['install']
+        self.assertRaises(KeyError, layer.__getitem__, 'test')
+        self.assertEqual(self.parsed, ['install'])
+
+    def test_files_merged(self):
+        other = self.write('other.cfg', '[build]\njobs = 4\n')
+        layer = ConfigLayer(compile_config_files(
+            [self.config_file, self.path('missing.cfg'), other]))
+        self.assertEqual(layer['build']['jobs'], (other, '4'))
+        self.assertEqual(layer['build']['out_dir'],
+                         (self.config_file, '/srv/out'))
+        self.assertRaises(TypeError, layer.__setitem__, 'build', {})
+
+    def test_missing_section_header(self):
+        self.write('broken.cfg', 'option = value\n')
+        self.assertRaises(MissingSectionHeaderError, compile_config_files,
+                          [self.path('broken.cfg')])
+
+
+class LazyCommandOptionsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.layer = {'cmd': {'a': ('file', '1')},
+                      'other': {'b': ('file', '2')}}
+        self.options = LazyCommandOptions()
+        self.options.add_layer(self.layer)
+
+    def test_merge(self):
+        self.options.add_layer({'cmd': {'a': ('env', '3')}})
+        self.assertEqual(self.options['cmd'], {'a': ('env', '3')})
+        self.assertEqual(sorted(self.options.keys()), ['cmd', 'other'])
+
+    def test_delete_leaves_layers_and_copies(self):
+        snapshot = self.options.copy()
+        options = snapshot.copy()
+        del options['cmd']
+        self.assert_('cmd' not in options)
+        self.assertRaises(KeyError, options.__getitem__, 'cmd')
+        self.assertEqual(options.keys(), ['other'])
+        self.assertRaises(KeyError, options.__delitem__, 'cmd')
+        # eg. the next item of a --batch run
+        self.assertEqual(self.layer['cmd'], {'a': ('file', '1')})
+        self.assertEqual(snapshot.copy()['cmd'], {'a': ('file', '1')})
+        self.assertEqual(self.options['cmd'], {'a': ('file', '1')})
+
+    def test_delete_merged_section(self):
+        self.options['cmd']['a'] = ('command line', '4')
+        options = self.options.copy()
+        del options['cmd']
+        self.assertEqual(self.options['cmd'], {'a': ('command line', '4')})
+        self.assertEqual(self.layer['cmd'], {'a': ('file', '1')})
+
+    def test_layer_added_after_delete(self):
+        del self.options['cmd']
+        self.options.add_layer({'cmd': {'c': ('env', '5')}})
+        self.assertEqual(self.options['cmd'], {'c': ('env', '5')})
+        self.options['cmd'] = {}
+        self.assertEqual(self.options['cmd'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
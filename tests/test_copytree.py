@@ -0,0 +1,162 @@
+"""Tests of the parallel, incremental copy engine behind
+Command.copy_tree() (cmdhelper.copytree) and of its fallbacks.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, errno, shutil, tempfile, unittest
+from stat import S_IMODE
+from distutils import dir_util
+from distutils.errors import DistutilsFileError
+
+from cmdhelper import copytree
+from cmdhelper.copytree import copy_tree, copy_file_contents
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.src = self.path('src')
+        self.make_tree()
+        self.saved = (copytree._copy_methods, copytree._unsupported.copy(),
+                      copytree.scandir)
+
+    def tearDown(self):
+        (copytree._copy_methods, unsupported, copytree.scandir) = self.saved
+        copytree._unsupported.clear()
+        copytree._unsupported.update(unsupported)
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def write(self, filename, data, mtime=1000):
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        f = open(filename, 'wb')
+        f.write(data)
+        f.close()
+        os.utime(filename, (mtime, mtime))
+
+    def read(self, filename):
+        f = open(filename, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def make_tree(self):
+        self.write(os.path.join(self.src, 'a.txt'), 'a' * 100)
+        self.write(os.path.join(self.src, 'sub', 'b.txt'), 'b' * 3000000)
+        self.write(os.path.join(self.src, 'sub', 'deeper', 'c.txt'), '')
+        os.chmod(os.path.join(self.src, 'a.txt'), 0750)
+
+
+class CopyTreeTestCase(TempDirTestCase):
+
+    def test_same_as_distutils(self):
+        outputs = copy_tree(self.src, self.path('dst'), verbose=0)
+        expected = dir_util.copy_tree(self.src, self.path('expected'),
+                                      verbose=0)
+        self.assertEqual(sorted(outputs),
+                         sorted([name.replace('expected', 'dst')
+                                 for name in expected]))
+        for name in expected:
+            copied = name.replace('expected', 'dst')
+            self.assertEqual(self.read(copied), self.read(name))
+            self.assertEqual(S_IMODE(os.stat(copied).st_mode),
+                             S_IMODE(os.stat(name).st_mode))
+            self.assertEqual(os.stat(copied).st_mtime, 1000)
+
+    def test_update(self):
+        dst = self.path('dst')
+        copy_tree(self.src, dst, verbose=0)
+        # same size and not older: left alone
+        self.write(os.path.join(dst, 'a.txt'), 'x' * 100, mtime=2000)
+        # another size: copied again
+        self.write(os.path.join(dst, 'sub', 'deeper', 'c.txt'), 'stale')
+        outputs = copy_tree(self.src, dst, update=1, verbose=0)
+        self.assertEqual(len(outputs), 3)
+        self.assertEqual(self.read(os.path.join(dst, 'a.txt')), 'x' * 100)
+        self.assertEqual(self.read(os.path.join(dst, 'sub', 'deeper',
+                                                'c.txt')), '')
+        # not updating: everything is copied
+        copy_tree(self.src, dst, verbose=0)
+        self.assertEqual(self.read(os.path.join(dst, 'a.txt')), 'a' * 100)
+
+    def test_symlinks(self):
+        os.symlink('a.txt', os.path.join(self.src, 'link'))
+        copy_tree(self.src, self.path('links'), preserve_symlinks=1,
+                  verbose=0)
+        self.assertEqual(os.readlink(self.path('links', 'link')), 'a.txt')
+        copy_tree(self.src, self.path('files'), verbose=0)
+        self.assert_(not os.path.islink(self.path('files', 'link')))
+        self.assertEqual(self.read(self.path('files', 'link')), 'a' * 100)
+
+    def test_dry_run(self):
+        outputs = copy_tree(self.src, self.path('dst'), verbose=0,
+                            dry_run=1)
+        self.assertEqual(len(outputs), 3)
+        self.assert_(not os.path.exists(self.path('dst')))
+
+    def test_not_a_directory(self):
+        self.assertRaises(DistutilsFileError, copy_tree,
+                          os.path.join(self.src, 'a.txt'), self.path('dst'))
+
+    def test_without_scandir(self):
+        copytree.scandir = None
+        outputs = copy_tree(self.src, self.path('dst'), verbose=0)
+        self.assertEqual(len(outputs), 3)
+
+
+def unsupported(errno_value, writes=''):
+    """Return a copy method writing 'writes', then failing with
+    'errno_value', and the list of its calls.
+    """
+    calls = []
+    def method(fsrc, fdst, size):
+        calls.append(size)
+        fdst.write(writes)
+        fdst.flush()
+        raise IOError(errno_value, os.strerror(errno_value))
+    return method, calls
+
+
+class FallbackTestCase(TempDirTestCase):
+
+    def copy(self):
+        src = os.path.join(self.src, 'sub', 'b.txt')
+        dst = self.path('b.txt')
+        copy_file_contents(src, dst, os.path.getsize(src))
+        self.assertEqual(self.read(dst), self.read(src))
+
+    def test_every_method(self):
+        # whichever the kernel supports, the result is the same
+        for method in copytree._copy_methods:
+            copytree._copy_methods = (method,)
+            self.copy()
+
+    def test_buffered_copy(self):
+        copytree._copy_methods = ()
+        self.copy()
+
+    def test_unsupported_methods_skipped(self):
+        (einval, einval_calls) = unsupported(errno.EINVAL, 'garbage')
+        (enosys, enosys_calls) = unsupported(errno.ENOSYS)
+        copytree._copy_methods = (einval, enosys)
+        self.copy()
+        self.copy()
+        # EINVAL may depend on the files, ENOSYS doesn't
+        self.assertEqual((len(einval_calls), len(enosys_calls)), (2, 1))
+
+    def test_errors_reported(self):
+        (method, calls) = unsupported(errno.EIO)
+        copytree._copy_methods = (method,)
+        self.assertRaises(DistutilsFileError, self.copy)
+        self.assertRaises(DistutilsFileError, copy_tree, self.src,
+                          self.path('dst'), verbose=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
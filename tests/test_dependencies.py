@@ -0,0 +1,150 @@
+"""Tests of the 'depends_on' dependencies between commands.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import threading, unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperClassError, CMDHelperExecError
+
+
+class RecordingCommand(Command):
+    user_options = []
+    ran = None
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        self.ran.append(self.get_command_name())
+
+
+class ParentCommand(RecordingCommand):
+    """Runs its sub-commands in parallel."""
+    parallel_sub_commands = 1
+
+    def run(self):
+        self.run_sub_commands()
+        RecordingCommand.run(self)
+
+
+def make_cmdutil(depends, args, subs={}, **attrs):
+    """Return a CMDHelper knowing the commands of 'depends' (command
+    names mapped to their 'depends_on') and of 'subs' (command names
+    mapped to their parallel sub-commands), with 'args' parsed, and the
+    list the commands record their runs in.
+    """
+    ran = []
+    cmdclass = {}
+    for (name, depends_on) in depends.items():
+        cmdclass[name] = type(name, (RecordingCommand,),
+                              {'depends_on': depends_on, 'ran': ran})
+    for (name, sub_commands) in subs.items():
+        cmdclass[name] = type(name, (ParentCommand,),
+                              {'sub_commands': [(sub, None)
+                                                for sub in sub_commands],
+                               'ran': ran})
+    attrs.update({'cmdclass': cmdclass, 'hooks_entry_point': None,
+                  'registry_cache_dir': ''})
+    cmdutil = CMDHelper('cmdhelper.tests', attrs)
+    cmdutil.script_args = ['-q'] + args
+    cmdutil.parse_command_line()
+    return cmdutil, ran
+
+
+class DependsOnTestCase(unittest.TestCase):
+
+    def test_dependencies_run_first(self):
+        cmdutil, ran = make_cmdutil({'a': ['b'], 'b': ['c'], 'c': []},
+                                    ['a', 'c'])
+        cmdutil.run_commands()
+        self.assertEqual(ran, ['c', 'b', 'a'])
+
+    def check_cycle(self, args, **attrs):
+        cmdutil, ran = make_cmdutil({'a': ['b'], 'b': ['a'], 'c': []},
+                                    args, **attrs)
+        try:
+            cmdutil.run_commands()
+        except CMDHelperClassError, e:
+            self.assert_('circular dependency' in str(e), str(e))
+            self.assert_('a -> b -> a' in str(e), str(e))
+        else:
+            self.fail("cycle not reported")
+        self.assertEqual(ran, [])
+
+    def test_cycle_sequential(self):
+        self.check_cycle(['a'])
+
+    def test_cycle_single_command_with_jobs(self):
+        self.check_cycle(['a'], jobs='2')
+
+    def test_cycle_scheduler(self):
+        self.check_cycle(['a', 'c'], jobs='2')
+
+    def test_command_run_again_after_cycle(self):
+        cmdutil, ran = make_cmdutil({'a': ['b'], 'b': ['a'], 'c': []},
+                                    ['a', 'c'])
+        self.assertRaises(CMDHelperClassError, cmdutil.run_commands)
+        cmdutil.run_command('c')
+        self.assertEqual(ran, ['c'])
+
+
+def run_with_timeout(func, timeout=20):
+    """Call 'func()' in a thread; return its exception, or the string
+    "hung" if it didn't return within 'timeout' seconds.
+    """
+    result = []
+
+    def run():
+        try:
+            func()
+        except Exception, e:
+            result.append(e)
+        else:
+            result.append(None)
+
+    thread = threading.Thread(target=run)
+    thread.setDaemon(1)
+    thread.start()
+    thread.join(timeout)
+    if thread.isAlive():
+        return "hung"
+    return result[0]
+
+
+class ThreadedDependenciesTestCase(unittest.TestCase):
+
+    def test_cycle_through_parallel_sub_command(self):
+        # 'b' runs in a pool thread, while 'a' holds its lock
+        cmdutil, ran = make_cmdutil({'b': ['a'], 'c': []}, ['-j', '2', 'a'],
+                                    subs={'a': ['b', 'c']})
+        error = run_with_timeout(cmdutil.run_commands)
+        self.assert_(isinstance(error, CMDHelperExecError), error)
+        self.assert_('a -> b -> a' in str(error), str(error))
+        self.assertEqual(ran, ['c'])
+
+    def test_cycle_through_scheduled_command(self):
+        cmdutil, ran = make_cmdutil({'b': ['a'], 'c': []},
+                                    ['-j', '2', 'a', 'c'],
+                                    subs={'a': ['b', 'c']})
+        error = run_with_timeout(cmdutil.run_commands)
+        self.assert_(isinstance(error, CMDHelperExecError), error)
+        self.assert_('a -> b -> a' in str(error), str(error))
+
+    def test_nested_parallel_sub_commands(self):
+        # every pool thread waits for sub-commands queued behind them
+        cmdutil, ran = make_cmdutil({'x1': [], 'x2': [], 'y1': [], 'y2': []},
+                                    ['-j', '2', 'x', 'y'],
+                                    subs={'x': ['x1', 'x2'],
+                                          'y': ['y1', 'y2']})
+        self.assertEqual(run_with_timeout(cmdutil.run_commands), None)
+        self.assertEqual(sorted(ran), ['x', 'x1', 'x2', 'y', 'y1', 'y2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""Tests of the entry point discovery backends (cmdhelper.discovery),
+run on a distribution installed in a temporary sys.path entry.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, shutil, tempfile, unittest
+
+from cmdhelper.discovery import MetadataDiscovery, PkgResourcesDiscovery, \
+     entry_point_re, get_discovery
+from cmdhelper.errors import CMDHelperModuleError, CMDHelperOptionError
+
+GROUP = 'cmdhelper.tests'
+
+METADATA = """\
+Metadata-Version: 2.1
+Name: demo
+Version: 1.0
+Requires-Dist: six
+Requires-Dist: cmdhelper-no-such-dist ; extra == "fast"
+"""
+
+ENTRY_POINTS = """\
+[cmdhelper.tests]
+hello = demo_commands:Hello
+fast = demo_commands.sub:Fast.Inner [fast]
+
+[cmdhelper.tests.other]
+other = demo_commands:Other
+"""
+
+
+class DistTestCase(unittest.TestCase):
+    """Installs the distribution 'demo' in a temporary sys.path entry."""
+
+    def setUp(self):
+        self.entry = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.metadata = os.path.join(self.entry, 'demo-1.0.dist-info')
+        os.mkdir(self.metadata)
+        self.write('METADATA', METADATA)
+        self.write('entry_points.txt', ENTRY_POINTS)
+        sys.path.insert(0, self.entry)
+
+    def tearDown(self):
+        sys.path.remove(self.entry)
+        shutil.rmtree(self.entry)
+
+    def write(self, name, data):
+        f = open(os.path.join(self.metadata, name), 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def get_backends(self):
+        """Return the discovery backends that can run here."""
+        backends = [PkgResourcesDiscovery()]
+        try:
+            backends.append(MetadataDiscovery())
+        except CMDHelperModuleError:
+            pass
+        return backends
+
+    def scan(self, backend, group=GROUP):
+        if backend.name != 'pkg_resources':
+            return backend.scan(group)
+        # the global working set was built before our entry was added
+        import pkg_resources
+        saved = pkg_resources.iter_entry_points
+        working_set = pkg_resources.WorkingSet([self.entry])
+        pkg_resources.iter_entry_points = working_set.iter_entry_points
+        try:
+            return backend.scan(group)
+        finally:
+            pkg_resources.iter_entry_points = saved
+
+
+class ScanTestCase(DistTestCase):
+
+    def test_records(self):
+        for backend in self.get_backends():
+            commands = self.scan(backend)
+            self.assertEqual(commands, {
+                'hello': {'module': 'demo_commands', 'attrs': ['Hello'],
+                          'extras': [], 'dist': 'demo'},
+                'fast': {'module': 'demo_commands.sub',
+                         'attrs': ['Fast', 'Inner'], 'extras': ['fast'],
+                         'dist': 'demo'}}, backend.name)
+            self.assertEqual(self.scan(backend, 'cmdhelper.tests.none'), {})
+
+    def test_backends_agree(self):
+        results = [self.scan(backend) for backend in self.get_backends()]
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_missing_extras(self):
+        try:
+            backend = MetadataDiscovery()
+        except CMDHelperModuleError:
+            self.skipTest("needs importlib.metadata")
+        commands = backend.scan(GROUP)
+        self.assertEqual(backend.get_missing(commands['fast']),
+                         ['cmdhelper-no-such-dist'])
+        self.assertEqual(backend.get_missing(commands['hello']), [])
+        # nothing to install: setuptools isn't involved
+        backend.require(GROUP, 'hello', commands['hello'])
+
+    def test_invalid_entry_point(self):
+        try:
+            backend = MetadataDiscovery()
+        except CMDHelperModuleError:
+            self.skipTest("needs importlib.metadata")
+        self.write('entry_points.txt', '[%s]\nbroken = demo commands\n' %
+                   GROUP)
+        self.assertRaises(CMDHelperModuleError, backend.scan, GROUP)
+
+
+class EntryPointTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        match = entry_point_re.match(' pkg.mod : Cls.attr [a, b] ')
+        self.assertEqual(match.group('module', 'attrs', 'extras'),
+                         ('pkg.mod', 'Cls.attr', 'a, b'))
+        match = entry_point_re.match('pkg.mod')
+        self.assertEqual(match.group('module', 'attrs', 'extras'),
+                         ('pkg.mod', None, None))
+        self.assertEqual(entry_point_re.match('pkg.mod:'), None)
+
+
+class GetDiscoveryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = os.environ.get('CMDHELPER_DISCOVERY')
+
+    def tearDown(self):
+        if self.saved is None:
+            os.environ.pop('CMDHELPER_DISCOVERY', None)
+        else:
+            os.environ['CMDHELPER_DISCOVERY'] = self.saved
+
+    def test_named(self):
+        self.assertEqual(get_discovery('pkg_resources').name,
+                         'pkg_resources')
+        self.assertRaises(CMDHelperOptionError, get_discovery, 'other')
+
+    def test_environment(self):
+        os.environ['CMDHELPER_DISCOVERY'] = 'pkg_resources'
+        self.assertEqual(get_discovery().name, 'pkg_resources')
+        os.environ['CMDHELPER_DISCOVERY'] = ''
+        self.assert_(get_discovery().name in ('metadata', 'pkg_resources'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""Tests of the run's StatCache (cmdhelper.fscache) and the Command file
+helpers using it.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, sys, time, shutil, tempfile, unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperOptionError
+from cmdhelper.fscache import StatCache
+
+
+class FileCommand(Command):
+    user_options = [('input=', None, "input file")]
+
+    def initialize_options(self):
+        self.input = None
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+def touch_later(path):
+    """Argument list of a program setting the modification time of
+    'path' a few seconds ahead (make_file() compares whole seconds).
+    """
+    return [sys.executable, '-c',
+            'import os, sys, time; t = time.time() + 10; '
+            'open(sys.argv[1], "a").close(); os.utime(sys.argv[1], (t, t))',
+            path]
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def write(self, name, data='data'):
+        f = open(self.path(name), 'w')
+        f.write(data)
+        f.close()
+        return self.path(name)
+
+
+class StatCacheTestCase(TempDirTestCase):
+
+    def test_missing_paths_not_cached(self):
+        stats = StatCache()
+        self.assertEqual(stats.stat(self.path('a')), None)
+        self.write('a')
+        self.assert_(stats.isfile(self.path('a')))
+
+    def test_invalidate(self):
+        stats = StatCache()
+        filename = self.write('a', 'short')
+        self.assertEqual(stats.stat(filename).st_size, 5)
+        self.write('a', 'longer data')
+        self.assertEqual(stats.stat(filename).st_size, 5)
+        stats.invalidate(filename)
+        self.assertEqual(stats.stat(filename).st_size, 11)
+
+    def test_prefetch(self):
+        names = [self.write('f%d' % i) for i in range(40)]
+        stats = StatCache()
+        stats.prefetch(names + [self.path('missing')], threads=4)
+        self.assertEqual(len(stats.stats), 40)
+
+    def test_newer_group(self):
+        stats = StatCache()
+        source = self.write('source')
+        target = self.write('target')
+        os.utime(source, (0, 0))
+        self.assertEqual(stats.newer_group([source], target), 0)
+        self.assertEqual(stats.newer_group([source], self.path('none')), 1)
+        self.assertRaises(OSError, stats.newer_group,
+                          [self.path('none')], target)
+        self.assertEqual(stats.newer_group([self.path('none')], target,
+                                           missing='newer'), 1)
+
+
+class CommandStatsTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.cmdutil = CMDHelper('cmdhelper.tests',
+                                 {'cmdclass': {'files': FileCommand},
+                                  'hooks_entry_point': None,
+                                  'registry_cache_dir': ''})
+        self.cmdutil.verbose = 0
+        self.cmd = self.cmdutil.get_command_obj('files')
+        self.generated = []
+
+    def generate(self, infile, outfile):
+        self.generated.append(outfile)
+        shutil.copyfile(infile, outfile)
+
+    def make(self, infile, outfile):
+        self.cmd.make_file([infile], outfile, self.generate,
+                           (infile, outfile))
+
+    def test_spawn_then_make_file(self):
+        infile = self.write('in')
+        outfile = self.path('out')
+        self.make(infile, outfile)
+        self.make(infile, outfile)
+        self.assertEqual(len(self.generated), 1)
+        # the input changes behind the helpers' back
+        self.cmd.spawn(touch_later(infile))
+        self.make(infile, outfile)
+        self.assertEqual(len(self.generated), 2)
+
+    def test_spawn_many_then_make_file(self):
+        infile = self.write('in')
+        outfile = self.path('out')
+        self.make(infile, outfile)
+        self.make(infile, outfile)
+        self.cmd.spawn_many([touch_later(infile)])
+        self.make(infile, outfile)
+        self.assertEqual(len(self.generated), 2)
+
+    def test_execute_then_make_file(self):
+        infile = self.write('in')
+        outfile = self.path('out')
+        self.make(infile, outfile)
+        self.make(infile, outfile)
+        t = time.time() + 10
+        self.cmd.execute(os.utime, (infile, (t, t)))
+        self.make(infile, outfile)
+        self.assertEqual(len(self.generated), 2)
+
+    def test_ensure_filename_of_generated_file(self):
+        self.cmd.input = self.path('generated')
+        self.assertRaises(CMDHelperOptionError, self.cmd.ensure_filename,
+                          'input')
+        self.write('generated')
+        self.cmd.ensure_filename('input')
+
+    def test_mkpath_after_removal(self):
+        directory = self.path('a', 'b')
+        self.cmd.mkpath(directory)
+        self.cmd.mkpath(directory)          # now known to exist
+        self.assert_(os.path.isdir(directory))
+        self.cmd.spawn([sys.executable, '-c',
+                        'import shutil, sys; shutil.rmtree(sys.argv[1])',
+                        self.path('a')])
+        # distutils remembers the directories it created, regardless
+        from distutils import dir_util
+        dir_util._path_created.clear()
+        self.cmd.mkpath(directory)
+        self.assert_(os.path.isdir(directory))
+
+    def test_copy_file_updates_cache(self):
+        src = self.write('src')
+        stats = self.cmdutil.get_stat_cache()
+        self.assertEqual(stats.stat(self.path('dst')), None)
+        self.cmd.copy_file(src, self.path('dst'))
+        self.assert_(stats.isfile(self.path('dst')))
+
+
+if __name__ == '__main__':
+    unittest.main()
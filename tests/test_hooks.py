@@ -0,0 +1,191 @@
+"""Tests of the hooks observing commands (cmdhelper.hooks), of their
+discovery through the CommandRegistry and of the --trace-file exporter.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, shutil, tempfile, unittest
+from StringIO import StringIO
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.hooks import HookRegistry
+from cmdhelper.discovery import make_record
+from cmdhelper.registry import CommandRegistry
+
+
+class CountingDiscovery(object):
+    """Discovery backend serving fixed entry points, counting scans."""
+
+    name = 'counting'
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.scans = []
+
+    def scan(self, group):
+        self.scans.append(group)
+        return dict(self.groups.get(group, {}))
+
+    def require(self, group, command, record):
+        pass
+
+
+class RecordingHook(object):
+
+    def __init__(self, cmdutil):
+        self.events = cmdutil.hook_events
+
+    def before_run(self, event):
+        self.events.append((event.event, event.command, event.options))
+
+    after_run = before_run
+
+
+class NoopCommand(Command):
+    user_options = [('level=', None, "any option")]
+
+    def initialize_options(self):
+        self.level = None
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+class FailingCommand(NoopCommand):
+
+    def run(self):
+        raise RuntimeError("failed")
+
+
+GROUPS = {
+    'cmdhelper.tests': {
+        'noop': make_record('test_hooks', ['NoopCommand'], [], None)},
+    'cmdhelper.tests.hooks': {
+        'recording': make_record('test_hooks', ['RecordingHook'], [],
+                                 None)}}
+
+
+class HookDiscoveryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def make_registry(self, discovery):
+        registry = CommandRegistry('cmdhelper.tests', self.cache_dir,
+                                   hooks_group='cmdhelper.tests.hooks')
+        registry.discovery = discovery
+        return registry
+
+    def test_hooks_cached_with_commands(self):
+        discovery = CountingDiscovery(GROUPS)
+        registry = self.make_registry(discovery)
+        self.assertEqual(registry.hook_names(), ['recording'])
+        self.assertEqual(registry.names(), ['noop'])
+        self.assertEqual(sorted(discovery.scans),
+                         ['cmdhelper.tests', 'cmdhelper.tests.hooks'])
+        # another run: nothing is scanned
+        discovery = CountingDiscovery(GROUPS)
+        registry = self.make_registry(discovery)
+        self.assertEqual(registry.hook_names(), ['recording'])
+        self.assert_(registry.load_hook('recording') is RecordingHook)
+        self.assertEqual(discovery.scans, [])
+
+    def test_hooks_dispatched(self):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'hooks_entry_point': 'cmdhelper.tests.hooks',
+                             'registry_cache_dir': self.cache_dir})
+        cmdutil.hook_events = []
+        cmdutil.get_registry().discovery = CountingDiscovery(GROUPS)
+        cmdutil.script_args = ['-q', 'noop']
+        cmdutil.parse_command_line()
+        cmdutil.run_commands()
+        self.assertEqual(cmdutil.hook_events,
+                         [('before_run', 'noop', {}),
+                          ('after_run', 'noop', {})])
+
+    def test_dispatch_creates_no_option_dicts(self):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'hooks_entry_point': 'cmdhelper.tests.hooks',
+                             'registry_cache_dir': self.cache_dir})
+        cmdutil.hook_events = []
+        cmdutil.get_registry().discovery = CountingDiscovery(GROUPS)
+        hooks = cmdutil.get_hooks()
+        hooks.dispatch('before_run', 'other', cmdutil)
+        self.assertEqual(cmdutil.hook_events, [('before_run', 'other', {})])
+        self.assert_('other' not in cmdutil.command_options)
+
+
+class TraceFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.trace_file = os.path.join(self.tempdir, 'trace.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_utility(self, *args):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': {'noop': NoopCommand,
+                                          'fail': FailingCommand},
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.script_args = ['-q', '--trace-file', self.trace_file] + \
+                              list(args)
+        cmdutil.parse_command_line()
+        cmdutil.run_commands()
+
+    def read_events(self):
+        import json
+        f = open(self.trace_file)
+        try:
+            return [json.loads(line) for line in f]
+        finally:
+            f.close()
+
+    def test_events_appended(self):
+        self.run_utility('noop', '--level', '2')
+        self.assertRaises(RuntimeError, self.run_utility, 'fail')
+        events = self.read_events()
+        self.assertEqual([(event['event'], event['command'])
+                          for event in events],
+                         [('before_finalize', 'noop'), ('before_run', 'noop'),
+                          ('after_run', 'noop'),
+                          ('before_finalize', 'fail'), ('before_run', 'fail'),
+                          ('on_error', 'fail')])
+        self.assertEqual(events[1]['options'], {'level': 'command line'})
+        self.assertEqual(events[0]['duration'], None)
+        self.assert_(events[2]['duration'] >= 0)
+        self.assertEqual(events[-1]['error'], 'RuntimeError: failed')
+
+    def test_failing_hooks_ignored(self):
+        class FailingHook(object):
+            def before_run(self, event):
+                raise ValueError("broken hook")
+        hooks = HookRegistry()
+        hooks.register(FailingHook())
+        self.assert_(hooks.active)
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        saved = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            hooks.dispatch('before_run', 'noop', cmdutil)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = saved
+        self.assert_('failed on before_run of noop: broken hook' in output,
+                     output)
+        self.assert_(not HookRegistry().active)
+
+
+if __name__ == '__main__':
+    unittest.main()
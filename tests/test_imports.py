@@ -0,0 +1,51 @@
+"""Tests of the distutils helpers imported on first use: importing
+cmdhelper stays cheap, and what it defines instead of importing it
+behaves as in distutils.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, unittest
+from subprocess import Popen, PIPE
+
+import cmdhelper
+from cmdhelper import CMDHelper, options
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+try:
+    from check_import_time import IMPORT, LAZY_MODULES
+finally:
+    del sys.path[0]
+
+
+class LazyImportTestCase(unittest.TestCase):
+
+    def test_lazy_modules_not_imported(self):
+        process = Popen([sys.executable, '-c',
+                         IMPORT + "\nimport sys\nprint ' '.join(sys.modules)"],
+                        stdout=PIPE)
+        modules = process.communicate()[0].split()
+        self.assertEqual(process.returncode, 0)
+        self.assert_('cmdhelper.cmd' in modules, modules)
+        self.assertEqual([name for name in LAZY_MODULES if name in modules],
+                         [])
+
+    def test_same_as_distutils(self):
+        from distutils import dist
+        from distutils.fancy_getopt import translate_longopt
+        for name in ('build', 'build_ext', 'x1', '1x', 'bdist-rpm', '_x',
+                     ''):
+            self.assertEqual(bool(cmdhelper.command_re.match(name)),
+                             bool(dist.command_re.match(name)), name)
+        help_options = [('help-me', 'h', "help", lambda: None),
+                        ('other', None, "other")]
+        self.assertEqual(options.fix_help_options(help_options),
+                         dist.fix_help_options(help_options))
+        self.assertEqual(CMDHelper.display_option_names,
+                         [translate_longopt(option[0])
+                          for option in CMDHelper.display_options])
+
+
+if __name__ == '__main__':
+    unittest.main()
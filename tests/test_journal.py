@@ -0,0 +1,174 @@
+"""Tests of the journaled file operations run in batches
+(cmdhelper.journal and Command.begin_journal()/commit_journal()).
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, shutil, tempfile, unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.fscache import StatCache
+from cmdhelper.journal import Journal, Operation
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.journal = Journal(StatCache())
+
+    def record(self, kind, reads=(), writes=(), barrier=0, key=None):
+        operation = Operation(kind, self.calls.append, (kind,), reads,
+                              writes, barrier)
+        if kind == 'mkpath':
+            return self.journal.mkpath(operation)
+        return self.journal.add(operation, key)
+
+    def batches(self):
+        return [[operation.kind for operation in batch]
+                for batch in self.journal.get_batches()]
+
+    def test_independent_operations(self):
+        self.record('a', ['/src/a'], ['/dst/a'])
+        self.record('b', ['/src/b'], ['/dst/b'])
+        self.record('c', ['/src/a'], ['/dst/c'])
+        self.assertEqual(self.batches(), [['a', 'b', 'c']])
+
+    def test_dependencies(self):
+        self.record('mkpath', writes=['/dst'])
+        # writes below the directory created
+        self.record('copy', ['/src/a'], ['/dst/a'])
+        # reads what the copy writes
+        self.record('read', ['/dst/a'], ['/out/a'])
+        # writes what was read before
+        self.record('overwrite', ['/src/b'], ['/src/a'])
+        # writes a directory something below was read from
+        self.record('move', writes=['/out', '/moved'])
+        self.assertEqual(self.batches(), [['mkpath'], ['copy'],
+                                          ['read', 'overwrite'], ['move']])
+
+    def test_barrier(self):
+        self.record('a', ['/src/a'], ['/dst/a'])
+        self.record('b', ['/src/b'], ['/dst/b'])
+        self.record('execute', barrier=1)
+        self.record('c', ['/src/c'], ['/dst/c'])
+        self.assertEqual(self.batches(), [['a', 'b'], ['execute'], ['c']])
+
+    def test_duplicates(self):
+        made = self.record('mkpath', writes=['/dst/sub'])
+        self.assert_(self.record('mkpath', writes=['/dst']) is made)
+        self.assert_(self.record('mkpath', writes=['/dst/sub/']) is made)
+        self.assert_(self.journal.isdir('/dst/sub'))
+        copy = self.record('copy', ['/a'], ['/dst/sub/a'], key='a')
+        self.assert_(self.record('copy', ['/a'], ['/dst/sub/a'],
+                                 key='a') is copy)
+        self.assertEqual(self.batches(), [['mkpath'], ['copy']])
+        self.assertEqual([data['op'] for data in self.journal.as_list()],
+                         ['mkpath', 'copy'])
+
+    def test_run(self):
+        self.record('mkpath', writes=['/dst'])
+        self.record('a', ['/src/a'], ['/dst/a'])
+        self.record('b', ['/src/b'], ['/dst/b'])
+        self.record('execute', barrier=1)
+        self.journal.run(threads=4)
+        self.assertEqual(self.calls[0], 'mkpath')
+        self.assertEqual(sorted(self.calls[1:3]), ['a', 'b'])
+        self.assertEqual(self.calls[3:], ['execute'])
+
+    def test_failures(self):
+        def fail():
+            raise RuntimeError("failed")
+        self.journal.add(Operation('fail', fail, (), writes=['/a']))
+        self.record('other', writes=['/b'])
+        self.record('after', barrier=1)
+        self.assertRaises(RuntimeError, self.journal.run, 2)
+        # the rest of the batch ran, not the next batch
+        self.assertEqual(self.calls, ['other'])
+
+
+class CopyCommand(Command):
+    """Copies 'a' and 'b' of 'src' to 'dst/sub' through the journal."""
+    user_options = []
+    src = dst = None
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        self.begin_journal()
+        sub = os.path.join(self.dst, 'sub')
+        self.mkpath(sub)
+        self.mkpath(self.dst)
+        for name in ('a', 'b', 'a'):
+            self.copy_file(os.path.join(self.src, name), sub)
+        self.move_file(os.path.join(sub, 'b'), os.path.join(sub, 'c'))
+        self.execute(os.mkdir, (os.path.join(sub, 'd'),))
+        self.commit_journal()
+
+
+class CommandJournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.src = self.path('src')
+        os.mkdir(self.src)
+        for name in ('a', 'b'):
+            f = open(os.path.join(self.src, name), 'w')
+            f.write(name)
+            f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def run_copy(self, *args):
+        cmdclass = {'copy': type('copy', (CopyCommand,),
+                                 {'src': self.src, 'dst': self.path('dst')})}
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': cmdclass,
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.script_args = ['-q', '--plan-file', self.path('plan')] + \
+                              list(args) + ['copy']
+        cmdutil.parse_command_line()
+        cmdutil.run_commands()
+        f = open(self.path('plan'))
+        try:
+            return json.loads(f.readlines()[-1])
+        finally:
+            f.close()
+
+    def test_commit(self):
+        plan = self.run_copy()
+        sub = self.path('dst', 'sub')
+        self.assertEqual(sorted(os.listdir(sub)), ['a', 'c', 'd'])
+        self.assertEqual(open(os.path.join(sub, 'c')).read(), 'b')
+        self.assertEqual((plan['command'], plan['dry_run']), ('copy', False))
+        self.assertEqual([(data['op'], data['batch'])
+                          for data in plan['operations']],
+                         [('mkpath', 1), ('copy_file', 2), ('copy_file', 2),
+                          ('move_file', 3), ('execute', 4)])
+        self.assertEqual(plan['operations'][1]['writes'],
+                         [os.path.join(sub, 'a')])
+
+    def test_dry_run(self):
+        plan = self.run_copy('--dry-run')
+        self.assert_(plan['dry_run'])
+        self.assertEqual(len(plan['operations']), 5)
+        self.assert_(not os.path.exists(self.path('dst')))
+
+
+if __name__ == '__main__':
+    unittest.main()
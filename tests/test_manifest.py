@@ -0,0 +1,120 @@
+"""Tests of the static command manifests (cmdhelper.manifest): reading
+them, merging them into command records and listing commands without
+importing them.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, unittest
+from StringIO import StringIO
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.discovery import make_record
+from cmdhelper.manifest import MANIFEST_NAME, describe_command, \
+     parse_manifest, merge_manifest, assert_groups
+
+from test_discovery import DistTestCase, GROUP
+
+
+class DescribedCommand(Command):
+    description = "described statically"
+    user_options = [('level=', 'l', "any option")]
+
+
+class StaticDiscovery(object):
+    """Discovery backend serving fixed command records."""
+
+    name = 'static'
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def scan(self, group):
+        return dict(self.commands)
+
+    def require(self, group, command, record):
+        pass
+
+
+class ManifestTestCase(unittest.TestCase):
+
+    def test_describe_command(self):
+        self.assertEqual(describe_command(DescribedCommand),
+                         {'description': "described statically",
+                          'user_options': [('level=', 'l', "any option")]})
+        self.assertEqual(describe_command(object), {})
+
+    def test_parse_broken(self):
+        self.assertEqual(parse_manifest('{"group": {}}'), {'group': {}})
+        self.assertEqual(parse_manifest('{"group": '), {})
+        self.assertEqual(parse_manifest('[]'), {})
+
+    def test_merge(self):
+        commands = {'a': make_record('mod', ['A'], [], 'dist'),
+                    'b': make_record('mod', ['B'], [], 'other'),
+                    'c': make_record('mod', ['C'], [], 'dist')}
+        manifest = {'group': {'a': {'description': "A", 'extra': 1},
+                              'b': {'description': "B"},
+                              'c': "broken",
+                              'd': {'description': "D"}},
+                    'other': {'c': {'description': "C"}}}
+        merge_manifest(commands, manifest, 'group', 'dist')
+        self.assertEqual(commands['a']['description'], "A")
+        self.assert_('extra' not in commands['a'])
+        # commands of other distributions or groups are left alone
+        self.assert_('description' not in commands['b'])
+        self.assert_('description' not in commands['c'])
+        self.assert_('d' not in commands)
+        merge_manifest(commands, {'group': []}, 'group', 'dist')
+
+    def test_assert_groups(self):
+        from distutils.errors import DistutilsSetupError
+        assert_groups(None, 'cmdhelper_manifest', ['group'])
+        for value in ('group', [1]):
+            self.assertRaises(DistutilsSetupError, assert_groups, None,
+                              'cmdhelper_manifest', value)
+
+
+class ListCommandsTestCase(unittest.TestCase):
+
+    def test_described_commands_not_imported(self):
+        record = make_record('cmdhelper_no_such_module', ['Command'], [],
+                             'dist')
+        record['description'] = "described in the manifest"
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.get_registry().discovery = StaticDiscovery({'remote':
+                                                            record})
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            cmdutil.print_commands()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+        self.assert_("remote  described in the manifest" in output, output)
+        self.assert_('cmdhelper_no_such_module' not in sys.modules)
+
+
+class ScanManifestTestCase(DistTestCase):
+
+    def test_manifest_merged(self):
+        self.write(MANIFEST_NAME,
+                   '{"%s": {"hello": {"description": "Says hello"}}}' %
+                   GROUP)
+        for backend in self.get_backends():
+            commands = self.scan(backend)
+            self.assertEqual(commands['hello']['description'], "Says hello",
+                             backend.name)
+            self.assert_('description' not in commands['fast'])
+
+    def test_broken_manifest_ignored(self):
+        self.write(MANIFEST_NAME, '{"%s": ' % GROUP)
+        for backend in self.get_backends():
+            self.assert_('description' not in self.scan(backend)['hello'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests of the option tables and descriptors compiled per command class
+(cmdhelper.options), of parsing command lines with them and of applying
+option values to command objects.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperClassError, CMDHelperOptionError
+from cmdhelper.options import get_command_options, get_option_descriptor
+
+
+class OptionsCommand(Command):
+    user_options = [('level=', 'l', "level"),
+                    ('force', 'f', "force"),
+                    ('keep', None, "keep the files"),
+                    ('no-keep', None, "don't keep the files")]
+    negative_opt = {'no-keep': 'keep'}
+    boolean_options = ['force', 'keep']
+    help_options = [('list-levels', None, "list the levels",
+                     lambda: LISTED.append(1))]
+
+    def initialize_options(self):
+        self.level = None
+        self.force = None
+        self.keep = 1
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+LISTED = []
+
+
+def parse(*args):
+    cmdutil = CMDHelper('cmdhelper.tests',
+                        {'cmdclass': {'opts': OptionsCommand},
+                         'hooks_entry_point': None,
+                         'registry_cache_dir': ''})
+    cmdutil.script_args = list(args)
+    cmdutil.parse_command_line()
+    return cmdutil
+
+
+class CommandOptionsTestCase(unittest.TestCase):
+
+    def test_memoized(self):
+        global_options = [('verbose', 'v', "verbose")]
+        compiled = get_command_options(OptionsCommand, global_options, {})
+        self.assert_(get_command_options(OptionsCommand, global_options, {})
+                     is compiled)
+        self.assert_(get_command_options(OptionsCommand, [], {})
+                     is not compiled)
+        self.assertEqual(compiled.negative_opt, {'no-keep': 'keep'})
+        self.assertEqual([(attr, option) for (attr, option, func)
+                          in compiled.help_options],
+                         [('list_levels', 'list-levels')])
+
+    def test_invalid_classes(self):
+        class NoOptions(Command):
+            user_options = None
+        for klass in (object, NoOptions):
+            self.assertRaises(CMDHelperClassError, get_command_options,
+                              klass, [], {})
+
+    def test_parser_reused(self):
+        options = parse('opts', '-l', '3', '--no-keep').get_option_dict('opts')
+        self.assertEqual(options['level'], ('command line', '3'))
+        self.assertEqual(options['keep'], ('command line', 0))
+        # the compiled parser doesn't remember the previous command line
+        options = parse('opts', '-f').get_option_dict('opts')
+        self.assertEqual(options, {'force': ('command line', 1)})
+
+    def test_help_options(self):
+        del LISTED[:]
+        cmdutil = parse('opts', '--list-levels')
+        self.assertEqual(LISTED, [1])
+        self.assertEqual(cmdutil.commands, ['opts'])
+
+
+class OptionDescriptorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.command = parse().get_command_obj('opts')
+
+    def apply(self, **options):
+        option_dict = {}
+        for (option, value) in options.items():
+            option_dict[option] = ('config', value)
+        get_option_descriptor(self.command).apply(self.command, option_dict,
+                                                  'opts')
+
+    def test_memoized(self):
+        descriptor = get_option_descriptor(self.command)
+        self.assert_(get_option_descriptor(parse().get_command_obj('opts'))
+                     is descriptor)
+        self.assertEqual(descriptor.known,
+                         {'level': 1, 'force': 1, 'keep': 1, 'no_keep': 1})
+
+    def test_strings_converted(self):
+        self.apply(level='3', force='yes')
+        self.assertEqual((self.command.level, self.command.force), ('3', 1))
+        get_option_descriptor(self.command).apply(
+            self.command, {'no-keep': ('config', 'true')}, 'opts')
+        self.assertEqual(self.command.keep, 0)
+        # values which aren't strings are taken as they are
+        self.apply(force=0, level=4)
+        self.assertEqual((self.command.level, self.command.force), (4, 0))
+
+    def test_invalid_values(self):
+        self.assertRaises(CMDHelperOptionError, self.apply, force='maybe')
+        self.assertRaises(CMDHelperOptionError, self.apply, unknown='1')
+
+    def test_existing_attributes(self):
+        # not in 'user_options', but set by the command class
+        self.apply(help='1')
+        self.assertEqual(self.command.help, '1')
+
+    def test_class_left_alone(self):
+        names = OptionsCommand.__dict__.keys()
+        self.assert_(hasattr(self.command, 'get_jobs'))
+        self.assertRaises(CMDHelperOptionError, self.apply, typo='1')
+        self.assertEqual(sorted(OptionsCommand.__dict__.keys()),
+                         sorted(names))
+
+
+if __name__ == '__main__':
+    unittest.main()
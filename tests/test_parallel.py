@@ -0,0 +1,237 @@
+"""Tests of running commands concurrently (cmdhelper.parallel): the
+worker pool, the capture of their output, the scheduler behind --jobs
+and the sub-commands run in parallel.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, threading, unittest
+from StringIO import StringIO
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperExecError
+from cmdhelper.parallel import Job, WorkerPool, CommandScheduler, run_all
+
+# seconds a test waits for other threads before giving up
+TIMEOUT = 20
+
+
+class StepCommand(Command):
+    """Prints its name once the events named in 'wait_for' are set, then
+    sets its own event; raises RuntimeError if 'fail' is set.
+    """
+    user_options = []
+    depends_on = []
+    wait_for = ()
+    fail = 0
+    events = ran = None
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        name = self.get_command_name()
+        for other in self.wait_for:
+            if not self.events[other].wait(TIMEOUT):
+                raise RuntimeError("%s waited for %s" % (name, other))
+        print name
+        self.ran.append(name)
+        self.events[name].set()
+        if self.fail:
+            raise RuntimeError("%s failed" % name)
+
+
+class ParentCommand(StepCommand):
+    """Runs its sub-commands in parallel, then itself."""
+    parallel_sub_commands = 1
+
+    def run(self):
+        self.run_sub_commands()
+        StepCommand.run(self)
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.ran = []
+        self.events = {}
+        self.cmdclass = {}
+
+    def add(self, name, base=StepCommand, **attrs):
+        attrs.update({'ran': self.ran, 'events': self.events})
+        self.cmdclass[name] = type(name, (base,), attrs)
+        self.events[name] = threading.Event()
+
+    def run_utility(self, *args):
+        """Run the command line 'args' with 2 jobs and return its output.
+        """
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': self.cmdclass,
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.script_args = ['-q', '-j', '2'] + list(args)
+        cmdutil.parse_command_line()
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            try:
+                cmdutil.run_commands()
+            finally:
+                output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+        return output
+
+    def test_independent_commands_concurrent(self):
+        # 'a' can only finish once 'b' ran
+        self.add('a', wait_for=['b'])
+        self.add('b')
+        self.assertEqual(self.run_utility('a', 'b'), 'a\nb\n')
+        self.assertEqual(self.ran, ['b', 'a'])
+
+    def test_dependencies_first(self):
+        self.add('a', depends_on=['b'])
+        self.add('b')
+        self.add('c')
+        self.assertEqual(self.run_utility('a', 'c'), 'b\na\nc\n')
+        self.assertEqual(self.ran.index('b') < self.ran.index('a'), 1)
+
+    def test_sub_commands_serialized(self):
+        self.add('a', sub_commands=[('b', None)])
+        self.add('b')
+        self.assertEqual(self.run_utility('b', 'a'), 'b\na\n')
+        self.assertEqual(self.ran, ['b', 'a'])
+
+    def test_failure_stops_scheduling(self):
+        self.add('a', fail=1)
+        self.add('b', depends_on=['a'])
+        self.add('c', wait_for=['a'])
+        self.assertRaises(RuntimeError, self.run_utility, 'b', 'c')
+        self.assertEqual(sorted(self.ran), ['a', 'c'])
+
+    def test_build_graph(self):
+        self.add('a', depends_on=['b'])
+        self.add('b')
+        self.add('c', sub_commands=[('a', None)])
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': self.cmdclass,
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        (order, deps) = CommandScheduler(cmdutil, None).build_graph(['c',
+                                                                     'a'])
+        self.assertEqual(order, ['c', 'b', 'a'])
+        self.assertEqual(deps, {'a': ['b', 'c'], 'b': [], 'c': []})
+
+
+class ParallelSubCommandsTestCase(SchedulerTestCase):
+
+    def add_parent(self, name, sub_commands):
+        self.add(name, ParentCommand,
+                 sub_commands=[(sub, None) for sub in sub_commands])
+
+    def test_sub_commands_concurrent(self):
+        self.add_parent('parent', ['a', 'b'])
+        self.add('a', wait_for=['b'])
+        self.add('b')
+        # the output comes in the order of 'sub_commands'
+        self.assertEqual(self.run_utility('parent'), 'a\nb\nparent\n')
+        self.assertEqual(self.ran, ['b', 'a', 'parent'])
+
+    def test_failures_reported_together(self):
+        self.add_parent('parent', ['a', 'b', 'c'])
+        self.add('a', fail=1)
+        self.add('b', fail=1)
+        self.add('c')
+        try:
+            self.run_utility('parent')
+        except CMDHelperExecError, e:
+            self.assertEqual([name for (name, exc_info) in e.failures],
+                             ['a', 'b'])
+        else:
+            self.fail("failures not reported")
+        self.assertEqual(sorted(self.ran), ['a', 'b', 'c'])
+
+
+class RunAllTestCase(unittest.TestCase):
+
+    def test_results_and_output_in_order(self):
+        pool = WorkerPool(3)
+        events = [threading.Event() for i in range(3)]
+
+        def call(i):
+            # the calls finish in reverse order
+            if i < 2 and not events[i + 1].wait(TIMEOUT):
+                raise RuntimeError("%d waited" % i)
+            print i
+            events[i].set()
+            if i == 1:
+                raise ValueError(i)
+            return i * 10
+
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            results = run_all(pool, call, range(3))
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+            pool.close()
+        self.assertEqual(output, '0\n1\n2\n')
+        self.assertEqual([result for (result, exc_info) in results],
+                         [0, None, 20])
+        self.assertEqual(results[1][1][0], ValueError)
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_results_and_errors(self):
+        jobs = [self.pool.submit(lambda x: 10 / x, x) for x in (5, 0)]
+        self.pool.wait(jobs)
+        self.assertEqual(jobs[0].get(), 2)
+        self.assertRaises(ZeroDivisionError, jobs[1].get)
+
+    def test_jobs_waiting_for_jobs(self):
+        # a single worker waits for jobs queued behind it
+        def outer(depth):
+            if not depth:
+                return 0
+            job = self.pool.submit(outer, depth - 1)
+            self.pool.wait([job])
+            return job.get() + 1
+        job = self.pool.submit(outer, 3)
+        self.assert_(job.finished.wait(TIMEOUT))
+        self.assertEqual(job.get(), 3)
+
+    def test_cancel(self):
+        blocker = threading.Event()
+        first = self.pool.submit(blocker.wait, TIMEOUT)
+        ran = []
+        second = self.pool.submit(ran.append, 1)
+        self.assertEqual(second.cancel(), 1)
+        blocker.set()
+        self.pool.wait([first, second])
+        self.assertEqual(first.cancel(), 0)
+        self.assertEqual(ran, [])
+
+    def test_callbacks(self):
+        job = Job(len, ('abc',))
+        results = []
+        job.callbacks.append(lambda job: results.append(job.get()))
+        self.pool.submit_job(job)
+        # callbacks run after the job is finished: wait for the worker
+        self.pool.close()
+        self.assertEqual(results, [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""Tests of the persistent command registry (cmdhelper.registry): its
+cache file, the fingerprint of the installed distributions and the
+loading of command classes.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, shutil, tempfile, unittest
+
+from cmdhelper.cmd import Command
+from cmdhelper.discovery import make_record
+from cmdhelper.errors import CMDHelperModuleError
+from cmdhelper.registry import CommandRegistry, path_fingerprint
+
+
+class CountingDiscovery(object):
+    """Discovery backend serving fixed entry points, counting scans."""
+
+    name = 'counting'
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.scans = []
+
+    def scan(self, group):
+        self.scans.append(group)
+        return dict(self.groups.get(group, {}))
+
+    def require(self, group, command, record):
+        pass
+
+
+class ListedCommand(Command):
+    description = "a command of the registry"
+    user_options = []
+
+
+GROUPS = {
+    'cmdhelper.tests': {
+        'listed': make_record('test_registry', ['ListedCommand'], [], None),
+        'missing': make_record('no_such_module', ['Command'], [], None),
+        'typo': make_record('test_registry', ['NoSuchCommand'], [], None)}}
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def make_registry(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = self.cache_dir
+        registry = CommandRegistry('cmdhelper.tests', cache_dir)
+        registry.discovery = self.discovery = CountingDiscovery(GROUPS)
+        return registry
+
+    def rewrite_cache(self, **changes):
+        import json
+        filename = self.make_registry().get_cache_file()
+        f = open(filename)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        data.update(changes)
+        f = open(filename, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+
+    def test_cache_reused(self):
+        self.assertEqual(self.make_registry().names(),
+                         ['listed', 'missing', 'typo'])
+        self.assertEqual(self.discovery.scans, ['cmdhelper.tests'])
+        registry = self.make_registry()
+        self.assert_('listed' in registry)
+        self.assert_(registry.load('listed') is ListedCommand)
+        self.assertEqual(self.discovery.scans, [])
+
+    def test_stale_fingerprint_rescanned(self):
+        self.make_registry().names()
+        self.rewrite_cache(fingerprint='stale', commands={})
+        registry = self.make_registry()
+        self.assert_('listed' in registry)
+        self.assertEqual(self.discovery.scans, ['cmdhelper.tests'])
+        # and the cache is rewritten
+        self.make_registry().names()
+        self.assertEqual(self.discovery.scans, [])
+
+    def test_other_format_rescanned(self):
+        self.make_registry().names()
+        self.rewrite_cache(format=0, commands={})
+        self.assertEqual(self.make_registry().names(),
+                         ['listed', 'missing', 'typo'])
+        self.assertEqual(self.discovery.scans, ['cmdhelper.tests'])
+
+    def test_broken_cache_rescanned(self):
+        f = open(self.make_registry().get_cache_file(), 'w')
+        f.write('{"format": ')
+        f.close()
+        self.assertEqual(self.make_registry().names(),
+                         ['listed', 'missing', 'typo'])
+
+    def test_in_memory(self):
+        registry = self.make_registry('')
+        self.assertEqual(registry.get_cache_file(), None)
+        self.assertEqual(registry.names(), ['listed', 'missing', 'typo'])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_unwritable_cache_ignored(self):
+        # the cache directory is a file: the cache can't be written
+        filename = os.path.join(self.cache_dir, 'file')
+        open(filename, 'w').close()
+        registry = self.make_registry(filename)
+        self.assert_(registry.load('listed') is ListedCommand)
+
+    def test_load_errors(self):
+        registry = self.make_registry()
+        for command in ('missing', 'typo', 'unknown'):
+            self.assertRaises(CMDHelperModuleError, registry.load, command)
+
+
+class PathFingerprintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.entry = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.path = [self.entry, os.path.join(self.entry, 'missing')]
+
+    def tearDown(self):
+        shutil.rmtree(self.entry)
+
+    def touch(self, filename, mtime):
+        if not os.path.exists(filename):
+            open(filename, 'w').close()
+        os.utime(filename, (mtime, mtime))
+
+    def test_distributions_changed(self):
+        metadata = os.path.join(self.entry, 'demo-1.0.dist-info')
+        os.mkdir(metadata)
+        self.touch(os.path.join(metadata, 'entry_points.txt'), 1000)
+        os.utime(metadata, (1000, 1000))
+        os.utime(self.entry, (1000, 1000))
+        fingerprint = path_fingerprint(self.path)
+        self.assertEqual(path_fingerprint(self.path), fingerprint)
+
+        # entry points of an installed distribution changed
+        self.touch(os.path.join(metadata, 'entry_points.txt'), 2000)
+        self.assertNotEqual(path_fingerprint(self.path), fingerprint)
+        fingerprint = path_fingerprint(self.path)
+
+        # a distribution upgraded in place
+        os.utime(metadata, (2000, 2000))
+        os.utime(self.entry, (1000, 1000))
+        self.assertNotEqual(path_fingerprint(self.path), fingerprint)
+
+    def test_other_files_ignored(self):
+        self.touch(os.path.join(self.entry, 'module.py'), 1000)
+        fingerprint = path_fingerprint(self.path)
+        self.touch(os.path.join(self.entry, 'module.py'), 2000)
+        self.assertEqual(path_fingerprint(self.path), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
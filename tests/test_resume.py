@@ -0,0 +1,200 @@
+"""Tests of resuming a chain of commands (cmdhelper.resume) and of the
+atomic writes of its state file.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os, shutil, tempfile, unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.resume import RunState, get_state_file, get_options_digest
+from cmdhelper.util import write_file_atomic
+
+
+class StepCommand(Command):
+    """Records its runs in 'ran'; fails while its name is in 'failing'."""
+    user_options = [('level=', None, "any option")]
+    ran = failing = None
+
+    def initialize_options(self):
+        self.level = None
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        name = self.get_command_name()
+        if name in self.failing:
+            raise RuntimeError("%s failed" % name)
+        self.ran.append(name)
+
+
+class UnstableCommand(StepCommand):
+    """Has an option whose repr() changes from one run to the next."""
+
+    def finalize_options(self):
+        self.level = object()
+
+
+class ResumeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.state_file = os.path.join(self.tempdir, 'state.json')
+        self.ran = []
+        self.failing = []
+        self.cmdclass = {}
+        for name in ('a', 'b', 'c'):
+            self.cmdclass[name] = type(name, (StepCommand,),
+                                       {'ran': self.ran,
+                                        'failing': self.failing})
+        self.cmdclass['unstable'] = type('unstable', (UnstableCommand,),
+                                         {'ran': self.ran,
+                                          'failing': self.failing})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_utility(self, *args):
+        self.run_args(['--resume', '--state-file', self.state_file] +
+                      list(args))
+
+    def run_args(self, args):
+        del self.ran[:]
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': self.cmdclass,
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.verbose = 0
+        cmdutil.script_args = args
+        cmdutil.parse_command_line()
+        cmdutil.run_commands()
+
+    def write_state(self, data):
+        f = open(self.state_file, 'w')
+        f.write(data)
+        f.close()
+
+    def test_failure_rerun_skip(self):
+        self.failing.append('b')
+        self.assertRaises(RuntimeError, self.run_utility, 'a', 'b', 'c')
+        self.assertEqual(self.ran, ['a'])
+        state = RunState(self.state_file)
+        state.load()
+        self.assertEqual(state.completed.keys(), ['a'])
+        # still failing: 'a' is skipped, 'b' tried again
+        self.assertRaises(RuntimeError, self.run_utility, 'a', 'b', 'c')
+        self.assertEqual(self.ran, [])
+        # fixed: the run restarts at 'b'
+        del self.failing[:]
+        self.run_utility('a', 'b', 'c')
+        self.assertEqual(self.ran, ['b', 'c'])
+        # nothing left to resume: the next run starts over
+        self.assert_(not os.path.exists(self.state_file))
+        self.run_utility('a', 'b', 'c')
+        self.assertEqual(self.ran, ['a', 'b', 'c'])
+
+    def test_changed_options_run_again(self):
+        self.failing.append('b')
+        self.assertRaises(RuntimeError, self.run_utility, 'a', 'b')
+        del self.failing[:]
+        self.run_utility('a', '--level', '2', 'b')
+        self.assertEqual(self.ran, ['a', 'b'])
+
+    def test_dry_run_keeps_state(self):
+        self.failing.append('b')
+        self.assertRaises(RuntimeError, self.run_utility, 'a', 'b')
+        del self.failing[:]
+        self.run_utility('--dry-run', 'b')
+        self.assert_(os.path.exists(self.state_file))
+
+    def test_state_ignored_without_resume(self):
+        self.failing.append('b')
+        self.assertRaises(RuntimeError, self.run_utility, 'a', 'b')
+        del self.failing[:]
+        self.run_args(['--state-file', self.state_file, 'a', 'b'])
+        self.assertEqual(self.ran, ['a', 'b'])
+        # still there for a run with --resume
+        self.run_utility('a', 'b')
+        self.assertEqual(self.ran, ['b'])
+
+    def test_broken_state_file_starts_over(self):
+        for data in ('{"format": ', '{"format": 0, "completed": {"a": ""}}',
+                     '[]'):
+            self.write_state(data)
+            self.run_utility('a', 'b')
+            self.assertEqual(self.ran, ['a', 'b'])
+
+    def test_unstable_options_run_again(self):
+        self.failing.append('b')
+        self.assertRaises(RuntimeError, self.run_utility, 'unstable', 'a',
+                          'b')
+        del self.failing[:]
+        self.run_utility('unstable', 'a', 'b')
+        self.assertEqual(self.ran, ['unstable', 'b'])
+        command = UnstableCommand.__new__(UnstableCommand)
+        command.finalize_options()
+        self.assertEqual(get_options_digest(command), None)
+        command.level = [1, {'a': 'b'}]
+        self.assert_(get_options_digest(command))
+
+    def test_default_state_file(self):
+        filename = get_state_file('/cache', 'group', '/work')
+        self.assertEqual(os.path.dirname(filename), '/cache/resume')
+        self.assertEqual(get_state_file('/cache', 'group', '/work/'),
+                         filename)
+        self.assertNotEqual(get_state_file('/cache', 'other', '/work'),
+                            filename)
+        self.assertNotEqual(get_state_file('/cache', 'group', '/other'),
+                            filename)
+
+
+class WriteFileAtomicTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.filename = os.path.join(self.tempdir, 'sub', 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self):
+        f = open(self.filename, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_replace(self):
+        write_file_atomic(self.filename, 'old')
+        write_file_atomic(self.filename, 'new')
+        self.assertEqual(self.read(), 'new')
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)),
+                         ['file'])
+
+    def test_failed_write_keeps_old_contents(self):
+        write_file_atomic(self.filename, 'old')
+        # not a string: the write fails after the temporary file is open
+        self.assertRaises(TypeError, write_file_atomic, self.filename,
+                          object())
+        self.assertEqual(self.read(), 'old')
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)),
+                         ['file'])
+
+    def test_state_file_keeps_other_commands(self):
+        RunState(self.filename).mark_completed('a', '1')
+        state = RunState(self.filename)
+        state.mark_completed('b', '2')
+        self.assert_(state.is_completed('a', '1'))
+        self.assert_(RunState(self.filename).is_completed('b', '2'))
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)),
+                         ['file'])
+        state.clear()
+        self.assert_(not os.path.exists(self.filename))
+        self.assert_(not state.is_completed('a', '1'))
+        state.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Tests of the command server (cmdhelper.server) and its client
+(cmdhelper.client), skipped where fork() or Unix sockets are missing.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, time, signal, socket, shutil, tempfile, unittest
+from StringIO import StringIO
+
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperFileError
+from cmdhelper.client import run_remote
+
+try:
+    from cmdhelper.server import CommandServer
+except ImportError:
+    CommandServer = None
+
+# seconds the server may take to start
+TIMEOUT = 20
+
+
+class CatCommand(Command):
+    """Copies stdin to stdout, upper-cased."""
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        sys.stdout.write(sys.stdin.read().upper())
+
+
+def make_server(socket_path):
+    return CommandServer('cmdhelper.tests', socket_path,
+                         attrs={'cmdclass': {'cat': CatCommand},
+                                'hooks_entry_point': None,
+                                'registry_cache_dir': ''})
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if CommandServer is None or not hasattr(os, 'fork') or \
+           not hasattr(socket, 'AF_UNIX'):
+            self.skipTest("needs fork() and Unix sockets")
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+        self.socket_path = os.path.join(self.tempdir, 'socket')
+        self.pid = None
+
+    def tearDown(self):
+        if self.pid is not None:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+        shutil.rmtree(self.tempdir)
+
+    def start_server(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                try:
+                    make_server(self.socket_path).serve_forever()
+                    status = 0
+                except SystemExit:
+                    status = 0
+            finally:
+                os._exit(status)
+        self.pid = pid
+        deadline = time.time() + TIMEOUT
+        while not os.path.exists(self.socket_path):
+            if time.time() > deadline:
+                self.fail("server didn't start")
+            time.sleep(0.05)
+
+    def test_stdin_forwarded(self):
+        self.start_server()
+        stdout = StringIO()
+        stderr = StringIO()
+        status = run_remote(self.socket_path, ['utility.py', '-q', 'cat'],
+                            stdout=stdout, stderr=stderr,
+                            stdin=StringIO('hello\nworld\n'))
+        self.assertEqual((status, stderr.getvalue()), (0, ''))
+        self.assertEqual(stdout.getvalue(), 'HELLO\nWORLD\n')
+
+    def test_live_server_not_replaced(self):
+        self.start_server()
+        self.assertRaises(CMDHelperFileError,
+                          make_server(self.socket_path).remove_stale_socket)
+        self.assert_(os.path.exists(self.socket_path))
+
+    def test_stale_socket_removed(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.close()
+        make_server(self.socket_path).remove_stale_socket()
+        self.assert_(not os.path.exists(self.socket_path))
+
+    def test_other_file_not_removed(self):
+        open(self.socket_path, 'w').close()
+        self.assertRaises(CMDHelperFileError,
+                          make_server(self.socket_path).remove_stale_socket)
+        self.assert_(os.path.exists(self.socket_path))
+
+    def test_preload_again_when_distributions_change(self):
+        server = make_server(self.socket_path)
+        server.preload()
+        registry = server.registry
+        server.check_fingerprint()
+        self.assert_(server.registry is registry)
+
+        sys.modules['cmdhelper_test_preloaded'] = object()
+        server.preloaded_modules.append('cmdhelper_test_preloaded')
+        registry.fingerprint = 'stale'
+        server.check_fingerprint()
+        self.assert_(server.registry is not registry)
+        self.assert_('cmdhelper_test_preloaded' not in sys.modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
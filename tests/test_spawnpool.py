@@ -0,0 +1,154 @@
+"""Tests of running many programs concurrently (cmdhelper.spawnpool) and
+of Command.spawn_many().
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, shutil, tempfile, unittest
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperExecError
+from cmdhelper.spawnpool import SpawnPool, SpawnResult
+
+# seconds a program waits for the others before giving up
+TIMEOUT = 20
+
+
+def python(code, *args):
+    return [sys.executable, '-c', code] + list(args)
+
+
+# creates the file argv[1], then waits for the file argv[2]
+RENDEZVOUS = ('import os, sys, time\n'
+              'open(sys.argv[1], "w").close()\n'
+              'deadline = time.time() + %d\n'
+              'while not os.path.exists(sys.argv[2]):\n'
+              '    if time.time() > deadline: sys.exit(3)\n'
+              '    time.sleep(0.01)\n' % TIMEOUT)
+
+
+class NoopCommand(Command):
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+class SpawnPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def test_results(self):
+        pool = SpawnPool(2)
+        results = [
+            pool.submit(python('import sys; sys.stdout.write("out"); '
+                               'sys.stderr.write("err")')),
+            pool.submit(python('import sys; sys.exit(4)')),
+            pool.submit(python('import os; os.kill(os.getpid(), 9)')),
+            pool.submit(['cmdhelper-no-such-program'])]
+        pool.close()
+        self.assertEqual((results[0].returncode, results[0].stdout,
+                          results[0].stderr), (0, 'out', 'err'))
+        self.assertEqual([result.failed() for result in results],
+                         [0, 1, 1, 1])
+        self.assertEqual(results[1].describe(),
+                         "command '%s' failed with exit status 4" %
+                         sys.executable)
+        self.assertEqual(results[2].returncode, -9)
+        self.assert_('signal 9' in results[2].describe())
+        self.assertEqual(results[3].returncode, None)
+        self.assert_(results[3].error)
+        self.assert_(results[0].elapsed >= 0)
+
+    def test_concurrent(self):
+        # each program waits for the file created by the other one
+        pool = SpawnPool(2)
+        results = [pool.submit(python(RENDEZVOUS, self.path('a'),
+                                      self.path('b'))),
+                   pool.submit(python(RENDEZVOUS, self.path('b'),
+                                      self.path('a')))]
+        pool.close()
+        self.assertEqual([result.returncode for result in results], [0, 0])
+
+    def test_cwd_and_env(self):
+        pool = SpawnPool(1)
+        result = pool.submit(python('import os; print os.getcwd(), '
+                                    'os.environ["CMDHELPER_TEST"]'),
+                             cwd=self.tempdir,
+                             env={'CMDHELPER_TEST': 'value'})
+        pool.close()
+        self.assertEqual(result.stdout.split(),
+                         [os.path.realpath(self.tempdir), 'value'])
+
+    def test_search_path(self):
+        pool = SpawnPool(1, search_path=0)
+        result = pool.submit([os.path.basename(sys.executable), '-c', ''])
+        pool.close()
+        self.assert_(result.error)
+
+    def test_dry_run(self):
+        pool = SpawnPool(1, dry_run=1)
+        result = pool.submit(python('open("%s", "w")' % self.path('a')))
+        pool.close()
+        self.assertEqual(result.returncode, None)
+        self.assert_(not os.path.exists(self.path('a')))
+        self.assertEqual(repr(SpawnResult(['prog'])),
+                         "<SpawnResult ['prog']: command 'prog' not run>")
+
+
+class SpawnManyTestCase(unittest.TestCase):
+
+    def make_command(self, *args):
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': {'noop': NoopCommand},
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.script_args = ['-q'] + list(args) + ['noop']
+        cmdutil.parse_command_line()
+        return cmdutil.get_command_obj('noop')
+
+    def test_results_in_order(self):
+        command = self.make_command('-j', '3')
+        results = command.spawn_many([python('print %d' % i)
+                                      for i in range(6)])
+        self.assertEqual([result.stdout for result in results],
+                         ['%d\n' % i for i in range(6)])
+
+    def test_failures(self):
+        command = self.make_command()
+        cmds = [python('pass'), python('import sys; sys.exit(1)'),
+                ['cmdhelper-no-such-program']]
+        try:
+            command.spawn_many(cmds)
+        except CMDHelperExecError, e:
+            self.assert_(str(e).startswith("2 of 3 command(s) failed:"),
+                         str(e))
+            self.assertEqual([result.failed() for result in e.results],
+                             [0, 1, 1])
+        else:
+            self.fail("failures not reported")
+        results = command.spawn_many(cmds, check=0)
+        self.assertEqual([result.failed() for result in results], [0, 1, 1])
+
+    def test_dry_run(self):
+        command = self.make_command('--dry-run')
+        results = command.spawn_many([python('import sys; sys.exit(1)')])
+        self.assertEqual(results[0].returncode, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
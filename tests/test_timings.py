@@ -0,0 +1,144 @@
+"""Tests of the measurements of a run (cmdhelper.timings) and of the
+--timings and --profile global options.
+
+Run with: python -m unittest discover -s tests
+"""
+
+import sys, os, shutil, tempfile, unittest
+from StringIO import StringIO
+
+from cmdhelper import CMDHelper
+from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperOptionError
+from cmdhelper.timings import Timings
+
+
+class ChildCommand(Command):
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        pass
+
+
+class ParentCommand(ChildCommand):
+    sub_commands = [('child', None)]
+
+    def run(self):
+        self.run_sub_commands()
+
+
+class FailingCommand(ChildCommand):
+
+    def run(self):
+        raise RuntimeError("failed")
+
+
+class TimingsTestCase(unittest.TestCase):
+
+    def test_nesting(self):
+        timer = Timings()
+        outer = timer.start('command', 'outer')
+        inner = timer.start('command', 'inner')
+        timer.stop(inner)
+        failed = timer.start('command', 'failed')
+        timer.abort(failed)
+        timer.stop(outer)
+        after = timer.start('phase', 'after')
+        timer.stop(after)
+        self.assertEqual([(timing.name, timing.depth)
+                          for timing in timer.records],
+                         [('outer', 0), ('inner', 1), ('failed', 1),
+                          ('after', 0)])
+        self.assert_(outer.wall >= inner.wall >= 0)
+        self.assertEqual(failed.wall, None)
+
+    def test_formats(self):
+        import json
+        timer = Timings()
+        timer.add('import', 'cmdhelper', 0.5, 0.25)
+        timer.start('command', 'running')
+        lines = timer.format_table().split('\n')
+        self.assertEqual(lines[1].split()[:4],
+                         ['import', 'cmdhelper', '0.5000', '0.2500'])
+        self.assertEqual(lines[2].split()[:4], ['command', 'running', '-',
+                                                '-'])
+        self.assertEqual(lines[3].split()[0], 'total')
+        data = json.loads(timer.format_json())
+        self.assertEqual([phase['name'] for phase in data['phases']],
+                         ['cmdhelper', 'running'])
+        self.assertEqual(data['phases'][1]['wall'], None)
+        self.assert_(data['total']['wall'] >= 0)
+
+
+class TimingsOptionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='cmdhelper-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def execute(self, *args):
+        """Run the command line 'args'; return what it wrote to
+        sys.stderr and the exception it raised, if any.
+        """
+        cmdutil = CMDHelper('cmdhelper.tests',
+                            {'cmdclass': {'parent': ParentCommand,
+                                          'child': ChildCommand,
+                                          'fail': FailingCommand},
+                             'hooks_entry_point': None,
+                             'registry_cache_dir': ''})
+        cmdutil.script_args = ['-q'] + list(args)
+        cmdutil.parse_command_line()
+        error = None
+        saved = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            try:
+                cmdutil.execute()
+            except Exception, error:
+                pass
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = saved
+        return output, error
+
+    def test_json_report(self):
+        import json
+        (output, error) = self.execute('--timings', 'json', 'parent')
+        self.assertEqual(error, None)
+        self.assertEqual([(phase['kind'], phase['name'], phase['depth'])
+                          for phase in json.loads(output)['phases']],
+                         [('command', 'parent', 0), ('command', 'child', 1)])
+
+    def test_reported_after_failures(self):
+        (output, error) = self.execute('--timings', 'table', 'child', 'fail')
+        self.assert_(isinstance(error, RuntimeError), error)
+        lines = [line.split() for line in output.split('\n')[1:] if line]
+        self.assertEqual([line[:3] for line in lines[:2]],
+                         [['command', 'child', lines[0][2]],
+                          ['command', 'fail', '-']])
+        self.assertEqual(lines[2][0], 'total')
+
+    def test_invalid_format(self):
+        (output, error) = self.execute('--timings', 'xml', 'child')
+        self.assert_(isinstance(error, CMDHelperOptionError), error)
+
+    def test_profile(self):
+        import pstats
+        filename = os.path.join(self.tempdir, 'profile')
+        self.assertEqual(self.execute('--profile', filename, 'parent'),
+                         ('', None))
+        stats = pstats.Stats(filename)
+        functions = [function for (file, line, function) in stats.stats]
+        self.assert_('run_sub_commands' in functions, functions)
+
+
+if __name__ == '__main__':
+    unittest.main()